@@ -1,14 +1,16 @@
 import time
-from typing import List
+from typing import List, Union
 
 from IPython.display import display
 from ipytree import Tree
 from ipywidgets import Label, VBox
 from pydantic import ValidationError
 
+from biasanalyzer.background.threading_utils import CancellableTask, run_async
 from biasanalyzer.cohort import CohortAction
 from biasanalyzer.config import load_config
 from biasanalyzer.database import BiasDatabase, OMOPCDMDatabase
+from biasanalyzer.models import AgeBinSpec
 from biasanalyzer.utils import build_concept_tree, get_direction_arrow, notify_users
 
 
@@ -50,6 +52,8 @@ class BIAS:
 
         self.cleanup()
 
+        # cohorts are kept in memory unless a file-backed BiasAnalyzer database is configured
+        bias_db_path = self.config["root_omop_cdm_database"].get("bias_database") or ":memory:"
         db_type = self.config["root_omop_cdm_database"]["database_type"]
         if db_type == "postgresql":
             user = self.config["root_omop_cdm_database"]["username"]
@@ -59,13 +63,15 @@ class BIAS:
             db = self.config["root_omop_cdm_database"]["database"]
             db_url = f"postgresql://{user}:{password}@{host}:{port}/{db}"
             self.omop_cdm_db = OMOPCDMDatabase(db_url)
-            self.bias_db = BiasDatabase(":memory:", omop_db_url=db_url)
+            self.bias_db = BiasDatabase(bias_db_path, omop_db_url=db_url)
         elif db_type == "duckdb":
             db_path = self.config["root_omop_cdm_database"].get("database", ":memory:")
             self.omop_cdm_db = OMOPCDMDatabase(db_path, read_only=read_only)
-            self.bias_db = BiasDatabase(":memory:", omop_db_url=db_path)
+            self.bias_db = BiasDatabase(bias_db_path, omop_db_url=db_path)
         else:
             notify_users(f"Unsupported database type: {db_type}")
+            return
+        self.bias_db.use_incidence_tables = bool(self.config["root_omop_cdm_database"].get("use_incidence_tables"))
 
     def _set_cohort_action(self):
         if self.omop_cdm_db is None:
@@ -85,7 +91,21 @@ class BIAS:
                 "Call set_root_omop first to set a valid root OMOP CDM"
             )
             return None
-        return self.omop_cdm_db.get_domains_and_vocabularies()
+        return self.bias_db.omop_catalog.get_domains_and_vocabularies()
+
+    def get_omop_catalog(self):
+        """
+        get the metadata catalog of the OMOP CDM database, which provides its domains, vocabularies, per-vocabulary
+        concept counts, and table row counts loaded once and kept in memory until the OMOP data version changes
+        :return: OMOPCatalog object, or None if no OMOP CDM has been set
+        """
+        if self.omop_cdm_db is None:
+            notify_users(
+                "A valid OMOP CDM must be set before getting the OMOP catalog. "
+                "Call set_root_omop first to set a valid root OMOP CDM"
+            )
+            return None
+        return self.bias_db.omop_catalog
 
     def get_concepts(self, search_term, domain=None, vocabulary=None):
         if self.omop_cdm_db is None:
@@ -145,7 +165,16 @@ class BIAS:
             return root_node
 
     def create_cohort(
-        self, cohort_name: str, cohort_desc: str, query_or_yaml_file: str, created_by: str, delay: float = 0
+        self,
+        cohort_name: str,
+        cohort_desc: str,
+        query_or_yaml_file: str,
+        created_by: str,
+        delay: float = 0,
+        in_engine: bool = False,
+        reuse_existing: bool = False,
+        timeout: float = None,
+        return_handle: bool = False,
     ):
         """
         API method that allows to create a cohort
@@ -155,12 +184,43 @@ class BIAS:
         :param created_by: name of the user that created the cohort
         :param delay: the number of seconds to sleep/delay for simulating long-running task for async testing,
         default is 0, meaning no delay
-        :return: CohortData object if cohort is created successfully; otherwise, None
+        :param in_engine: if True, materialize the cohort inside BiasDatabase with a single INSERT ... SELECT
+        against the attached OMOP database so that cohort rows are never pulled into Python, keeping memory use
+        constant regardless of cohort size. Default is False
+        :param reuse_existing: if True, return the existing cohort already created from the same SQL query or
+        cohort creation yaml definition against the same OMOP data instead of recreating it. Default is False
+        :param timeout: number of seconds after which cohort creation is cancelled by interrupting its running query,
+        default is None meaning no timeout
+        :param return_handle: if True, create the cohort in a worker thread and return a CancellableTask handle
+        right away, whose result() method returns the created cohort and cancel() method stops cohort creation.
+        Default is False
+        :return: CohortData object if cohort is created successfully; otherwise, None. A CancellableTask handle
+        is returned instead if return_handle is True
         """
+        if timeout is not None or return_handle:
+            return self._run_cancellable(
+                self.create_cohort,
+                cohort_name,
+                cohort_desc,
+                query_or_yaml_file,
+                created_by,
+                delay=delay,
+                in_engine=in_engine,
+                reuse_existing=reuse_existing,
+                timeout=timeout,
+                return_handle=return_handle,
+            )
 
         c_action = self._set_cohort_action()
         if c_action:
-            created_cohort = c_action.create_cohort(cohort_name, cohort_desc, query_or_yaml_file, created_by)
+            created_cohort = c_action.create_cohort(
+                cohort_name,
+                cohort_desc,
+                query_or_yaml_file,
+                created_by,
+                in_engine=in_engine,
+                reuse_existing=reuse_existing,
+            )
             if created_cohort is not None:
                 if delay > 0:
                     notify_users(f"[DEBUG] Simulating long-running task with {delay} seconds delay...")
@@ -171,6 +231,189 @@ class BIAS:
             notify_users("failed to create a valid cohort action object")
             return None
 
+    def create_cohorts(self, cohort_specs: list, reuse_existing: bool = False):
+        """
+        API method that allows to create a batch of cohorts together, e.g., a baseline cohort and several study
+        cohorts. The cohorts are created in-engine and the domain events needed by all cohort creation yaml files in
+        the batch are scanned and ranked once, which is much faster than creating the cohorts one by one.
+        :param cohort_specs: list of dicts, each with cohort_name, cohort_desc, query_or_yaml_file, and created_by
+        keys as arguments of create_cohort()
+        :param reuse_existing: if True, return existing cohorts already created from the same SQL query or cohort
+        creation yaml definition against the same OMOP data instead of recreating them. Default is False
+        :return: list of CohortData objects in the order of cohort_specs, with None for cohorts not created
+        """
+        c_action = self._set_cohort_action()
+        if c_action:
+            created_cohorts = c_action.create_cohorts(cohort_specs, reuse_existing=reuse_existing)
+            notify_users(
+                f"{sum(cohort is not None for cohort in created_cohorts)} of {len(cohort_specs)} "
+                f"cohorts created successfully"
+            )
+            return created_cohorts
+        else:
+            notify_users("failed to create a valid cohort action object")
+            return None
+
+    def get_cohort(self, cohort_id: int):
+        """
+        Get a previously created cohort, e.g., a cohort created in an earlier session of a file-backed
+        BiasAnalyzer database
+        :param cohort_id: cohort definition id of the cohort
+        :return: CohortData object if the cohort exists; otherwise, None
+        """
+        c_action = self._set_cohort_action()
+        if c_action:
+            return c_action.get_cohort(cohort_id)
+        else:
+            notify_users("failed to create a valid cohort action object")
+            return None
+
+    def get_cohort_definitions(self):
+        """
+        Get definitions of all cohorts stored in the BiasAnalyzer database
+        :return: list of cohort definition dicts, or None if no OMOP CDM has been set
+        """
+        if self.bias_db is None:
+            notify_users(
+                "A valid OMOP CDM must be set before getting cohort definitions. "
+                "Call set_root_omop first to set a valid root OMOP CDM"
+            )
+            return None
+        return self.bias_db.get_cohort_definitions()
+
+    def delete_cohort(self, cohort_id: int):
+        """
+        Delete a cohort and its definition from the BiasAnalyzer database along with its cached statistics
+        :param cohort_id: cohort definition id of the cohort to delete
+        :return: True if the cohort is deleted, False if it does not exist, or None if no OMOP CDM has been set
+        """
+        if self.bias_db is None:
+            notify_users(
+                "A valid OMOP CDM must be set before deleting a cohort. "
+                "Call set_root_omop first to set a valid root OMOP CDM"
+            )
+            return None
+        deleted = self.bias_db.delete_cohort(cohort_id)
+        if deleted:
+            notify_users(f"Cohort {cohort_id} deleted.")
+        else:
+            notify_users(f"Cohort {cohort_id} does not exist.", level="warning")
+        return deleted
+
+    def get_cohorts_stats(
+        self, cohorts: List[int], variable: str = "", output_format: str = "df", approximate: bool = False
+    ):
+        """
+        Get statistics of multiple cohorts side by side computed in one query grouped by cohort
+        :param cohorts: list of cohort ids
+        :param variable: optional variable such as age, gender, race, or ethnicity to get the stats of, default is
+        an empty string meaning the basic stats of the cohorts
+        :param output_format: "df" (default) for a pandas DataFrame, "records" for a list of dicts, or "arrow"
+        for a pyarrow Table
+        :param approximate: if True, medians are estimated with approx_quantile for fast exploration of very large
+        cohorts, with <median>_lower and <median>_upper columns of a heuristic rank band around each estimate.
+        Default is False
+        :return: tidy stats with a cohort_definition_id column, or None if no OMOP CDM has been set
+        """
+        if self.bias_db is None:
+            notify_users(
+                "A valid OMOP CDM must be set before getting cohort stats. "
+                "Call set_root_omop first to set a valid root OMOP CDM"
+            )
+            return None
+        return self.bias_db.get_cohorts_basic_stats(
+            cohorts, variable=variable, output_format=output_format, approximate=approximate
+        )
+
+    def get_cohorts_temporal_distribution(self, cohorts: List[int], granularity: str = "month", output_format="df"):
+        """
+        Get the number of cohort entries in each calendar period of cohort_start_date of multiple cohorts side by
+        side computed in one query grouped by cohort, e.g., to plot entries per month of the cohorts over time
+        :param cohorts: list of cohort ids
+        :param granularity: calendar period to count entries by, i.e., day, week, month (default), quarter, or year
+        :param output_format: "df" (default) for a pandas DataFrame, "records" for a list of dicts, or "arrow"
+        for a pyarrow Table
+        :return: tidy temporal distributions with cohort_definition_id, period, entry_count, and probability
+        columns, or None if no OMOP CDM has been set
+        """
+        if self.bias_db is None:
+            notify_users(
+                "A valid OMOP CDM must be set before getting cohort distributions. "
+                "Call set_root_omop first to set a valid root OMOP CDM"
+            )
+            return None
+        return self.bias_db.get_cohorts_temporal_distribution(
+            cohorts, granularity=granularity, output_format=output_format
+        )
+
+    def get_cohorts_stratified_stats(
+        self,
+        cohorts: List[int],
+        dimensions: List[str],
+        grouping_sets: List[List[str]] = None,
+        age_bins: Union[AgeBinSpec, dict] = None,
+        output_format: str = "df",
+    ):
+        """
+        Get the number of persons in each stratum of cross-tabulations of person attributes of multiple cohorts
+        side by side computed in one pass over the cohorts with GROUP BY CUBE or GROUPING SETS
+        :param cohorts: list of cohort ids
+        :param dimensions: list of dimensions to stratify by, i.e., age_bin, gender, race, ethnicity, birth_decade,
+        or any OMOP person column
+        :param grouping_sets: list of lists of dimensions to cross-tabulate, e.g., [["gender"], ["gender", "race"]],
+        default is None meaning all combinations of the dimensions
+        :param age_bins: AgeBinSpec object or a dict of its fields defining the age_bin dimension, default is None
+        meaning the decade age bins
+        :param output_format: "df" (default) for a pandas DataFrame, "records" for a list of dicts, or "arrow"
+        for a pyarrow Table
+        :return: tidy stratified stats with cohort_definition_id, dimensions, a column per dimension, person_count,
+        and probability columns, or None if no OMOP CDM has been set
+        """
+        if self.bias_db is None:
+            notify_users(
+                "A valid OMOP CDM must be set before getting cohort stats. "
+                "Call set_root_omop first to set a valid root OMOP CDM"
+            )
+            return None
+        return self.bias_db.get_cohorts_stratified_stats(
+            cohorts, dimensions, grouping_sets=grouping_sets, age_bins=age_bins, output_format=output_format
+        )
+
+    def get_cohorts_distributions(
+        self, cohorts: List[int], variable: str, output_format: str = "df", age_bins: Union[AgeBinSpec, dict] = None
+    ):
+        """
+        Get distributions of a variable such as age or gender of multiple cohorts side by side computed in one
+        query grouped by cohort
+        :param cohorts: list of cohort ids
+        :param variable: variable to get the distributions of
+        :param output_format: "df" (default) for a pandas DataFrame, "records" for a list of dicts, or "arrow"
+        for a pyarrow Table
+        :param age_bins: AgeBinSpec object or a dict of its fields defining the bins of the age distribution, e.g.,
+        {"width": 5, "num_bins": 20} or {"edges": [17, 44, 64]}, default is None meaning the decade age bins
+        :return: tidy distributions with a cohort_definition_id column, or None if no OMOP CDM has been set
+        """
+        if self.bias_db is None:
+            notify_users(
+                "A valid OMOP CDM must be set before getting cohort distributions. "
+                "Call set_root_omop first to set a valid root OMOP CDM"
+            )
+            return None
+        return self.bias_db.get_cohorts_distributions(cohorts, variable, output_format=output_format, age_bins=age_bins)
+
+    def checkpoint(self, compact: bool = False):
+        """
+        Checkpoint the file-backed BiasAnalyzer database, optionally compacting the database file to reclaim space
+        :param compact: whether to rewrite the database file to keep it small. Default is False
+        """
+        if self.bias_db is None:
+            notify_users(
+                "A valid OMOP CDM must be set before checkpointing. "
+                "Call set_root_omop first to set a valid root OMOP CDM"
+            )
+            return
+        self.bias_db.checkpoint(compact=compact)
+
     def get_cohorts_concept_stats(
         self, cohorts: List[int], concept_type: str = "condition_occurrence", filter_count: int = 0, vocab=None
     ):
@@ -195,14 +438,189 @@ class BIAS:
             notify_users("failed to get concept prevalence stats for the union of cohorts")
             return None
 
-    def compare_cohorts(self, cohort_id1, cohort_id2):
+    def compare_cohorts(
+        self,
+        cohort_id1,
+        cohort_id2,
+        timeout: float = None,
+        return_handle: bool = False,
+        age_bins: Union[AgeBinSpec, dict] = None,
+        metrics: List[str] = None,
+        confidence_level: float = None,
+        n_resamples: int = 1000,
+        seed=None,
+    ):
+        """
+        compare demographic distributions of two cohorts from their raw bin counts
+        :param cohort_id1: id of the first cohort
+        :param cohort_id2: id of the second cohort
+        :param timeout: number of seconds after which the comparison is cancelled by interrupting its running
+        query, default is None meaning no timeout
+        :param return_handle: if True, compare the cohorts in a worker thread and return a CancellableTask handle
+        right away. Default is False
+        :param age_bins: AgeBinSpec object or a dict of its fields defining the bins of the age distribution to
+        compare, default is None meaning the decade age bins
+        :param metrics: list of distance metric names, i.e., "hellinger", "jensen_shannon", "total_variation", and
+        "wasserstein", default is ["hellinger"]
+        :param confidence_level: confidence level, e.g., 0.95, to also compute bootstrap confidence intervals of the
+        distances, default is None meaning no confidence intervals
+        :param n_resamples: number of bootstrap resamples for the confidence intervals, default is 1000
+        :param seed: seed for reproducible bootstrap resamples, default is None
+        :return: list of distance metrics of the two cohorts, each with a <name>_ci (lower, upper) tuple if
+        confidence_level is set, or a CancellableTask handle if return_handle is True
+        """
+        if timeout is not None or return_handle:
+            return self._run_cancellable(
+                self.compare_cohorts,
+                cohort_id1,
+                cohort_id2,
+                age_bins=age_bins,
+                metrics=metrics,
+                confidence_level=confidence_level,
+                n_resamples=n_resamples,
+                seed=seed,
+                timeout=timeout,
+                return_handle=return_handle,
+            )
         c_action = self._set_cohort_action()
         if c_action:
-            return c_action.compare_cohorts(cohort_id1, cohort_id2)
+            return c_action.compare_cohorts(
+                cohort_id1,
+                cohort_id2,
+                age_bins=age_bins,
+                metrics=metrics,
+                confidence_level=confidence_level,
+                n_resamples=n_resamples,
+                seed=seed,
+            )
         else:
             notify_users("failed to create a valid cohort action object")
             return None
 
+    def compare_cohort_matrix(
+        self, cohorts: List[int], metrics: List[str] = None, age_bins: Union[AgeBinSpec, dict] = None
+    ):
+        """
+        compare demographic distributions of all pairs of cohorts at once, e.g., to rank many candidate cohorts
+        against a baseline cohort
+        :param cohorts: list of cohort ids
+        :param metrics: list of distance metric names, i.e., "hellinger", "jensen_shannon", "total_variation", and
+        "wasserstein", default is ["hellinger"]
+        :param age_bins: AgeBinSpec object or a dict of its fields defining the bins of the age distribution to
+        compare, default is None meaning the decade age bins
+        :return: dict keyed by <variable>_<metric>_distance, e.g., age_hellinger_distance, with a pandas DataFrame of
+        pairwise distances indexed by cohort ids, or None if no OMOP CDM has been set
+        """
+        c_action = self._set_cohort_action()
+        if c_action:
+            return c_action.compare_cohort_matrix(cohorts, metrics=metrics, age_bins=age_bins)
+        else:
+            notify_users("failed to create a valid cohort action object")
+            return None
+
+    def compare_concept_prevalence(
+        self,
+        cohort_id1: int,
+        cohort_id2: int,
+        concept_type: str = "condition_occurrence",
+        filter_count: int = 0,
+        vocab=None,
+    ):
+        """
+        compare the prevalence of every concept in a domain between two cohorts, e.g., to find the conditions that
+        differ most between a study cohort and a baseline cohort
+        :param cohort_id1: id of the first cohort
+        :param cohort_id2: id of the second cohort
+        :param concept_type: concept type to consider with default "condition_occurrence"
+        :param filter_count: filtering out those concepts with less than this count in both cohorts. Default is 0
+        meaning no filtering
+        :param vocab: vocabulary to consider with default None meaning using the default vocabulary corresponding to
+        the domain instead as defined in DOMAIN_MAPPING variable in models.py
+        :return: pandas DataFrame with the subject count and prevalence of each concept in both cohorts along with
+        the standardized mean difference (smd), chi-square test p-value, and Benjamini-Hochberg adjusted p-value,
+        sorted by decreasing absolute smd, or None if no OMOP CDM has been set
+        """
+        c_action = self._set_cohort_action()
+        if c_action:
+            return c_action.compare_concept_prevalence(
+                cohort_id1, cohort_id2, concept_type=concept_type, filter_count=filter_count, vocab=vocab
+            )
+        else:
+            notify_users("failed to create a valid cohort action object")
+            return None
+
+    # Awaitable versions of the API methods above, which run the blocking database work on a bounded thread pool
+    # shared by all async calls, so that they can be fanned out with asyncio.gather from an async application.
+    # Cancelling an awaiting task interrupts the duckdb query it is running.
+    async def aget_concepts(self, search_term, domain=None, vocabulary=None):
+        return await run_async(self.get_concepts, search_term, domain=domain, vocabulary=vocabulary)
+
+    async def aget_concept_hierarchy(self, concept_id):
+        return await run_async(self.get_concept_hierarchy, concept_id)
+
+    async def acreate_cohort(
+        self,
+        cohort_name: str,
+        cohort_desc: str,
+        query_or_yaml_file: str,
+        created_by: str,
+        delay: float = 0,
+        in_engine: bool = False,
+        reuse_existing: bool = False,
+    ):
+        return await run_async(
+            self.create_cohort,
+            cohort_name,
+            cohort_desc,
+            query_or_yaml_file,
+            created_by,
+            delay=delay,
+            in_engine=in_engine,
+            reuse_existing=reuse_existing,
+        )
+
+    async def acreate_cohorts(self, cohort_specs: list, reuse_existing: bool = False):
+        return await run_async(self.create_cohorts, cohort_specs, reuse_existing=reuse_existing)
+
+    async def aget_cohort(self, cohort_id: int):
+        return await run_async(self.get_cohort, cohort_id)
+
+    async def aget_cohorts_concept_stats(
+        self, cohorts: List[int], concept_type: str = "condition_occurrence", filter_count: int = 0, vocab=None
+    ):
+        return await run_async(
+            self.get_cohorts_concept_stats,
+            cohorts,
+            concept_type=concept_type,
+            filter_count=filter_count,
+            vocab=vocab,
+        )
+
+    async def acompare_cohorts(
+        self,
+        cohort_id1,
+        cohort_id2,
+        age_bins: Union[AgeBinSpec, dict] = None,
+        metrics: List[str] = None,
+        confidence_level: float = None,
+        n_resamples: int = 1000,
+        seed=None,
+    ):
+        return await run_async(
+            self.compare_cohorts,
+            cohort_id1,
+            cohort_id2,
+            age_bins=age_bins,
+            metrics=metrics,
+            confidence_level=confidence_level,
+            n_resamples=n_resamples,
+            seed=seed,
+        )
+
+    def _run_cancellable(self, func, *args, timeout=None, return_handle=False, **kwargs):
+        task = CancellableTask(func, *args, timeout=timeout, **kwargs)
+        return task if return_handle else task.result()
+
     def cleanup(self):
         if self.bias_db:
             self.bias_db.close()
@@ -1,5 +1,128 @@
+import asyncio
+import itertools
+import os
 import threading
 import traceback
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, suppress
+
+from biasanalyzer.utils import notify_users
+
+# bounded thread pool shared by all async API calls, created on first use
+_async_executor = None
+_async_executor_lock = threading.Lock()
+
+# worker scope of the task the calling thread is running, if any
+_worker_state = threading.local()
+
+
+class OperationCancelledError(Exception):
+    """
+    Raised in a worker thread when its operation is cancelled before the worker starts a database query
+    """
+
+
+class CancellationToken:
+    """
+    Cancellation state of one operation, e.g., a cohort creation or an async call, shared by the worker threads
+    running it. Database connections register an interrupt function for each cursor running the operation's queries
+    while the operation uses the cursor, so that cancelling the token interrupts exactly the queries of this operation
+    and never those of an operation running later on the same thread.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cancelled = False
+        self._interrupts = {}
+        self._keys = itertools.count()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+    def cancel(self):
+        """
+        Cancel the operation and interrupt the queries running on its registered cursors
+        """
+        with self._lock:
+            if self._cancelled:
+                return
+            self._cancelled = True
+            interrupts = list(self._interrupts.values())
+        for interrupt in interrupts:
+            # a query that completed in the meantime may no longer be interruptible
+            with suppress(Exception):
+                interrupt()
+
+    def add_interrupt(self, interrupt):
+        """
+        Register a function interrupting a query of the operation, e.g., the interrupt method of its duckdb cursor
+        :param interrupt: function without arguments
+        :return: key to remove the interrupt function with
+        :raises OperationCancelledError if the operation is already cancelled
+        """
+        with self._lock:
+            if self._cancelled:
+                raise OperationCancelledError("operation was cancelled")
+            key = next(self._keys)
+            self._interrupts[key] = interrupt
+        return key
+
+    def remove_interrupt(self, key):
+        with self._lock:
+            self._interrupts.pop(key, None)
+
+    def raise_if_cancelled(self):
+        """
+        :raises OperationCancelledError if the operation is cancelled
+        """
+        if self._cancelled:
+            raise OperationCancelledError("operation was cancelled")
+
+
+class _WorkerScope:
+    def __init__(self, token):
+        self.token = token
+        self.exit_callbacks = []
+        # ids of the connection managers whose cursor of the scope is registered with the token
+        self.registered = set()
+
+
+@contextmanager
+def worker_scope(token: CancellationToken = None):
+    """
+    Run one task of a worker thread, e.g., one job of a thread pool, under a cancellation token. Connections used
+    in the scope register their cursors with the token and close the cursors they open for the thread when the scope
+    ends, so that a pool thread picking up its next task holds no cursor of an earlier task.
+    :param token: CancellationToken of the operation the task belongs to, default is None meaning the token of the
+    enclosing scope of the thread, if any
+    """
+    previous = getattr(_worker_state, "scope", None)
+    if token is None and previous is not None:
+        token = previous.token
+    scope = _WorkerScope(token)
+    _worker_state.scope = scope
+    try:
+        yield scope
+    finally:
+        _worker_state.scope = previous
+        for callback in reversed(scope.exit_callbacks):
+            callback()
+
+
+def get_worker_scope():
+    """
+    :return: the worker scope of the calling thread, or None if the thread is not running a task in a worker scope
+    """
+    return getattr(_worker_state, "scope", None)
+
+
+def get_cancellation_token():
+    """
+    :return: the CancellationToken of the task the calling thread is running, or None if there is none
+    """
+    scope = get_worker_scope()
+    return scope.token if scope is not None else None
 
 
 class BackgroundResult:
@@ -14,6 +137,88 @@ class BackgroundResult:
         self.ready = True
 
 
+class CancellableTask:
+    """
+    Handle of a long-running database operation, e.g., cohort creation, running in a worker thread, which can be
+    cancelled explicitly or automatically after a timeout. Cancelling interrupts the query the operation is running
+    and stops it from starting another one, including when it is cancelled before its first query starts. An operation
+    that completes despite a late cancellation, e.g., one that committed its results before it got cancelled, is not
+    reported as cancelled.
+    """
+
+    def __init__(self, func, *args, timeout=None, **kwargs):
+        """
+        :param func: function to run in a worker thread
+        :param args: function positional arguments to be passed in
+        :param timeout: number of seconds after which the operation is cancelled, default is None meaning no timeout
+        :param kwargs: any keyword arguments of the function to be passed in as a dict
+        """
+        self._token = CancellationToken()
+        self._result = BackgroundResult()
+        self._lock = threading.Lock()
+        self.cancelled = False
+        self.timed_out = False
+
+        def wrapper():
+            result, error = None, None
+            with worker_scope(self._token):
+                try:
+                    result = func(*args, **kwargs)
+                except Exception as e:
+                    error = e
+            with self._lock:
+                if self.cancelled and error is None and result is not None:
+                    # the operation completed before the cancellation could stop it
+                    self.cancelled = self.timed_out = False
+                self._result.set(result, error=error)
+
+        self._thread = threading.Thread(target=wrapper, daemon=True)
+        self._thread.start()
+        self._timer = None
+        if timeout is not None:
+            self._timer = threading.Timer(timeout, self.cancel, kwargs={"timed_out": True})
+            self._timer.daemon = True
+            self._timer.start()
+
+    def cancel(self, timed_out=False):
+        """
+        Cancel the operation by interrupting its running query. It has no effect if the operation has completed.
+        :param timed_out: whether the operation is cancelled because of its timeout
+        :return: True if the cancellation is requested, False if the operation has already completed or been cancelled
+        """
+        with self._lock:
+            if self._result.ready or self.cancelled:
+                return False
+            self.cancelled = True
+            self.timed_out = timed_out
+        self._token.cancel()
+        return True
+
+    def done(self):
+        return self._result.ready
+
+    def result(self, timeout=None):
+        """
+        Wait for the operation to complete and get its result
+        :param timeout: number of seconds to wait, default is None meaning waiting until the operation completes
+        :return: the result returned by the operation, or None if the operation was cancelled before it completed
+        :raises TimeoutError if the operation does not complete within the timeout, or the exception raised by the
+        operation if it failed without being cancelled
+        """
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            raise TimeoutError(f"operation did not complete within {timeout} seconds")
+        if self._timer is not None:
+            self._timer.cancel()
+        if self.cancelled:
+            if self.timed_out:
+                notify_users("operation timed out and was cancelled")
+            return None
+        if self._result.error is not None:
+            raise self._result.error
+        return self._result.value
+
+
 def run_in_background(func, *args, result_holder=None, on_complete=None, **kwargs):
     """
     Run a time-consuming function in background
@@ -25,10 +230,14 @@ def run_in_background(func, *args, result_holder=None, on_complete=None, **kwarg
     :return: a background thread
     """
 
+    def run():
+        with worker_scope():
+            return func(*args, **kwargs)
+
     def wrapper():
         try:
             print("[*] Background task started...", flush=True)
-            result = func(*args, **kwargs)
+            result = run()
             print("[✓] Background task completed.", flush=True)
             if result_holder:
                 result_holder.set(result)
@@ -45,3 +254,95 @@ def run_in_background(func, *args, result_holder=None, on_complete=None, **kwarg
     thread = threading.Thread(target=wrapper)
     thread.start()
     return thread
+
+
+def run_in_parallel(tasks, max_workers=None):
+    """
+    Run independent functions such as cohort stats, distribution, and concept prevalence calls concurrently in a
+    thread pool. Each worker thread queries BiasDatabase and the OMOP CDM database through its own duckdb cursor,
+    so the queries run in parallel rather than one after another. The tasks run under the cancellation token of the
+    calling thread, so cancelling the calling operation interrupts all of them, and each worker thread closes its
+    cursors when its task completes.
+    :param tasks: list of functions taking no arguments, e.g., lambda: cohort.get_stats("age"), or tuples of
+    (func, args) or (func, args, kwargs)
+    :param max_workers: maximum number of worker threads, default is the number of tasks capped at the CPU count
+    :return: list of the results returned by the tasks in the order of tasks
+    :raises the exception of the first task in the order of tasks that failed after all tasks complete
+    """
+    if not tasks:
+        return []
+    if max_workers is None:
+        max_workers = min(len(tasks), os.cpu_count() or 1)
+
+    def normalize(task):
+        if callable(task):
+            return task, (), {}
+        func, args, *kwargs = task
+        return func, args, kwargs[0] if kwargs else {}
+
+    token = get_cancellation_token()
+
+    def run(func, args, kwargs):
+        with worker_scope(token):
+            return func(*args, **kwargs)
+
+    tasks = [normalize(task) for task in tasks]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(run, func, args, kwargs) for func, args, kwargs in tasks]
+        errors = [future.exception() for future in futures]
+    for error in errors:
+        if error is not None:
+            raise error
+    return [future.result() for future in futures]
+
+
+def get_async_executor():
+    """
+    Get the bounded thread pool running blocking database work of async API calls, so that concurrent async calls
+    share a fixed number of worker threads instead of starting one thread per call
+    :return: the shared ThreadPoolExecutor
+    """
+    global _async_executor
+    with _async_executor_lock:
+        if _async_executor is None:
+            _async_executor = ThreadPoolExecutor(thread_name_prefix="biasanalyzer-async")
+        return _async_executor
+
+
+def set_async_max_workers(max_workers=None):
+    """
+    Set the maximum number of worker threads running blocking database work of async API calls. Calls already
+    running finish on the previous thread pool.
+    :param max_workers: maximum number of worker threads, default is min(32, CPU count + 4)
+    """
+    global _async_executor
+    with _async_executor_lock:
+        previous_executor = _async_executor
+        _async_executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="biasanalyzer-async")
+    if previous_executor is not None:
+        previous_executor.shutdown(wait=False)
+
+
+async def run_async(func, *args, **kwargs):
+    """
+    Run a blocking function on the bounded async executor and await its result, so that it can be used with
+    asyncio.gather and cancelled from async code. Cancelling the awaiting task interrupts the database queries the
+    function is running.
+    :param func: blocking function to run
+    :param args: function positional arguments to be passed in
+    :param kwargs: any keyword arguments of the function to be passed in as a dict
+    :return: the result returned by the function
+    """
+    token = CancellationToken()
+
+    def wrapper():
+        with worker_scope(token):
+            return func(*args, **kwargs)
+
+    future = asyncio.get_running_loop().run_in_executor(get_async_executor(), wrapper)
+    try:
+        return await future
+    except asyncio.CancelledError:
+        # a function that has not started yet is cancelled with the future, otherwise its queries are interrupted
+        token.cancel()
+        raise
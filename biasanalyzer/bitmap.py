@@ -0,0 +1,131 @@
+import networkx as nx
+import numpy as np
+
+# number of set bits of each byte value for counting the persons of packed bitmaps
+_BYTE_POPCOUNTS = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+class PersonBitmap:
+    """
+    Compressed set of person indices in [0, n_persons) of a cohort. Like a roaring bitmap container, a sparse set
+    is stored as a sorted array of person indices and a dense set, i.e., one with at least 1/32 of the persons, as
+    a packed bitmap, whichever is smaller, so that both rare and common concepts are stored and merged compactly.
+    """
+
+    __slots__ = ("n_persons", "_indices", "_bits")
+
+    def __init__(self, n_persons: int, indices=None, bits=None):
+        """
+        :param n_persons: number of persons of the cohort
+        :param indices: sorted unique array of person indices of a sparse set
+        :param bits: packed little-endian bitmap array of uint8 of a dense set
+        """
+        self.n_persons = n_persons
+        self._indices = indices
+        self._bits = bits
+
+    @classmethod
+    def _from_sorted_indices(cls, n_persons: int, indices):
+        if len(indices) * 32 < n_persons:
+            return cls(n_persons, indices=indices.astype(np.uint32, copy=False))
+        mask = np.zeros(n_persons, dtype=bool)
+        mask[indices] = True
+        return cls(n_persons, bits=np.packbits(mask, bitorder="little"))
+
+    @classmethod
+    def from_indices(cls, n_persons: int, indices):
+        """
+        :param n_persons: number of persons of the cohort
+        :param indices: array-like of person indices in [0, n_persons), which may be unsorted and repeated
+        :return: PersonBitmap of the persons
+        """
+        return cls._from_sorted_indices(n_persons, np.unique(np.asarray(indices, dtype=np.int64)))
+
+    @property
+    def is_dense(self) -> bool:
+        return self._bits is not None
+
+    def __len__(self):
+        if self.is_dense:
+            return int(_BYTE_POPCOUNTS[self._bits].sum(dtype=np.int64))
+        return len(self._indices)
+
+    def to_indices(self):
+        """
+        :return: sorted array of the person indices in the set
+        """
+        if self.is_dense:
+            return np.flatnonzero(np.unpackbits(self._bits, count=self.n_persons, bitorder="little"))
+        return self._indices.astype(np.int64)
+
+    @classmethod
+    def union(cls, n_persons: int, bitmaps):
+        """
+        OR multiple bitmaps of the same cohort at once
+        :param n_persons: number of persons of the cohort
+        :param bitmaps: list of PersonBitmap objects
+        :return: PersonBitmap of the persons in any of the bitmaps
+        """
+        dense = [b._bits for b in bitmaps if b.is_dense]
+        sparse = [b._indices for b in bitmaps if not b.is_dense]
+        if not dense:
+            if len(sparse) == 1:
+                return cls(n_persons, indices=sparse[0])
+            return cls._from_sorted_indices(n_persons, np.unique(np.concatenate(sparse)))
+        bits = np.bitwise_or.reduce(dense, axis=0) if len(dense) > 1 else dense[0].copy()
+        if sparse:
+            mask = np.zeros(len(bits) * 8, dtype=bool)
+            mask[np.concatenate(sparse)] = True
+            bits |= np.packbits(mask, bitorder="little")
+        return cls(n_persons, bits=bits)
+
+
+def rollup_concept_counts(event_concept_ids, event_person_indices, n_persons: int, parent_ids, child_ids):
+    """
+    Count the distinct persons with each concept or any of its descendants by building one PersonBitmap per event
+    concept and ORing the bitmaps of the children of each concept into it in topological order of the concept
+    hierarchy DAG, so that every concept is merged once per parent instead of once per ancestor. The counts are
+    exact as long as every ancestor-descendant pair of the hierarchy is connected by a path of parent-child edges,
+    e.g., edges of a transitive reduction of the ancestor-descendant pairs.
+    :param event_concept_ids: array-like of the concept ids of the cohort events
+    :param event_person_indices: array-like of the person indices in [0, n_persons) of the cohort events aligned
+    with event_concept_ids
+    :param n_persons: number of persons of the cohort
+    :param parent_ids: array-like of the parent concept ids of the hierarchy edges
+    :param child_ids: array-like of the child concept ids of the hierarchy edges aligned with parent_ids
+    :return: dict of the number of distinct persons keyed by concept id for all concepts of the events and edges
+    """
+    event_concept_ids = np.asarray(event_concept_ids)
+    event_person_indices = np.asarray(event_person_indices)
+    order = np.lexsort((event_person_indices, event_concept_ids))
+    concept_ids, starts = np.unique(event_concept_ids[order], return_index=True)
+    person_indices = np.split(event_person_indices[order], starts[1:]) if len(order) else []
+    bitmaps = {
+        concept_id: PersonBitmap.from_indices(n_persons, indices)
+        for concept_id, indices in zip(concept_ids.tolist(), person_indices)
+    }
+
+    graph = nx.DiGraph()
+    graph.add_nodes_from(bitmaps)
+    graph.add_edges_from(zip(np.asarray(parent_ids).tolist(), np.asarray(child_ids).tolist()))
+    empty = PersonBitmap(n_persons, indices=np.empty(0, dtype=np.uint32))
+    remaining_parents = dict(graph.in_degree())
+    counts = {}
+    # children come before their parents in reversed topological order
+    for concept_id in reversed(list(nx.topological_sort(graph))):
+        children = list(graph.successors(concept_id))
+        own = bitmaps.get(concept_id)
+        merged = [own] if own is not None else []
+        merged.extend(bitmaps[child] for child in children)
+        bitmap = PersonBitmap.union(n_persons, merged) if merged else empty
+        counts[concept_id] = len(bitmap)
+        if remaining_parents[concept_id]:
+            bitmaps[concept_id] = bitmap
+        else:
+            bitmaps.pop(concept_id, None)
+        # free the bitmaps of children once all of their parents have merged them
+        for child in children:
+            remaining_parents[child] -= 1
+            if not remaining_parents[child]:
+                del bitmaps[child]
+    return counts
@@ -0,0 +1,145 @@
+# ruff: noqa: S608
+import threading
+
+from biasanalyzer.models import DOMAIN_MAPPING
+
+# OMOP CDM tables whose row counts are kept in the catalog in addition to the domain event tables
+OMOP_CATALOG_TABLES = ("person", "observation_period", "concept", "concept_ancestor")
+
+
+class OMOPCatalog:
+    """
+    Metadata catalog of the OMOP CDM database attached to BiasDatabase holding its domains, vocabularies,
+    per-vocabulary concept counts, and table row counts. Each part is loaded lazily on first use and kept in memory
+    until the OMOP data version changes, so that validating vocabularies and listing domains are in-memory lookups
+    rather than scans of the OMOP concept table. The OMOP data version token is also looked up once per session,
+    since the lookup queries the OMOP database, and refresh() looks it up again after the OMOP data is updated.
+    """
+
+    def __init__(self, bias_db):
+        """
+        :param bias_db: BiasDatabase object the OMOP CDM database is attached to
+        """
+        self.bias_db = bias_db
+        # OMOP data version token looked up on first use, which is kept until refresh() is called
+        self._cached_data_version = None
+        self._data_version = None
+        # loaded catalog parts keyed by name, e.g., concept_counts, for the OMOP data version in _data_version
+        self._parts = {}
+        self._lock = threading.Lock()
+
+    def get_data_version(self):
+        """
+        Get the OMOP data version token from BiasDatabase.get_omop_data_version(), which is looked up on first use
+        and cached until refresh() is called
+        :return: OMOP data version token string, or None if no OMOP database is attached
+        """
+        with self._lock:
+            if self._cached_data_version is None:
+                self._cached_data_version = self.bias_db.get_omop_data_version()
+            return self._cached_data_version
+
+    def refresh(self):
+        """
+        Look up the OMOP data version again on next use, e.g., after the OMOP data is updated in the session, so that
+        the catalog and results derived from OMOP data are reloaded if the version changed
+        """
+        with self._lock:
+            self._cached_data_version = None
+
+    def _get_part(self, name, load_part, data_version=None):
+        data_version = data_version or self.get_data_version()
+        with self._lock:
+            if data_version != self._data_version:
+                self._data_version = data_version
+                self._parts = {}
+            if name not in self._parts:
+                self._parts[name] = load_part()
+            return self._parts[name]
+
+    def _load_concept_counts(self):
+        return self.bias_db._execute_query(f"""
+            SELECT domain_id, vocabulary_id, COUNT(*) AS concept_count
+            FROM {self.bias_db.omop_alias}.concept
+            GROUP BY domain_id, vocabulary_id
+            ORDER BY domain_id, vocabulary_id
+        """)
+
+    def _load_table_row_counts(self):
+        candidate_tables = list(
+            dict.fromkeys(
+                [*OMOP_CATALOG_TABLES, *(domain["table"] for domain in DOMAIN_MAPPING.values() if domain["table"])]
+            )
+        )
+        existing_tables = {
+            row["table_name"]
+            for row in self.bias_db._execute_query(f"""
+                SELECT table_name FROM information_schema.tables
+                WHERE table_catalog = '{self.bias_db.omop_alias}' AND table_schema = '{self.bias_db.omop_schema}'
+            """)
+        }
+        tables = [table for table in candidate_tables if table in existing_tables]
+        if not tables:
+            return {}
+        counts_query = " UNION ALL ".join(
+            f"SELECT '{table}' AS table_name, COUNT(*) AS row_count FROM {self.bias_db.omop_alias}.{table}"
+            for table in tables
+        )
+        row_counts = {row["table_name"]: row["row_count"] for row in self.bias_db._execute_query(counts_query)}
+        return {table: row_counts[table] for table in tables}
+
+    def get_domains_and_vocabularies(self, data_version=None):
+        """
+        :param data_version: OMOP data version token if already looked up, default is None meaning the cached token
+        from get_data_version()
+        :return: list of dicts with domain_id and vocabulary_id of the concepts ordered by domain and vocabulary
+        """
+        concept_counts = self._get_part("concept_counts", self._load_concept_counts, data_version)
+        return [{"domain_id": row["domain_id"], "vocabulary_id": row["vocabulary_id"]} for row in concept_counts]
+
+    def get_domains(self, data_version=None):
+        """
+        :return: sorted list of the domain ids of the concepts
+        """
+        concept_counts = self._get_part("concept_counts", self._load_concept_counts, data_version)
+        return sorted({row["domain_id"] for row in concept_counts})
+
+    def get_vocabularies(self, data_version=None):
+        """
+        :return: sorted list of the vocabulary ids of the concepts
+        """
+        return sorted(self.get_vocabulary_concept_counts(data_version))
+
+    def get_vocabulary_concept_counts(self, data_version=None):
+        """
+        :return: dict of the number of concepts keyed by vocabulary id
+        """
+        concept_counts = self._get_part("concept_counts", self._load_concept_counts, data_version)
+        vocabulary_counts = {}
+        for row in concept_counts:
+            vocabulary_counts[row["vocabulary_id"]] = (
+                vocabulary_counts.get(row["vocabulary_id"], 0) + row["concept_count"]
+            )
+        return vocabulary_counts
+
+    def is_valid_vocabulary(self, vocab: str, data_version=None):
+        """
+        :return: whether vocab is the vocabulary id of any concept
+        """
+        return vocab in self.get_vocabulary_concept_counts(data_version)
+
+    def get_table_row_counts(self, data_version=None):
+        """
+        :return: dict of the row counts of the OMOP CDM person, observation_period, vocabulary, and domain event
+        tables that exist in the OMOP database keyed by table name
+        """
+        return self._get_part("table_row_counts", self._load_table_row_counts, data_version)
+
+    def clear(self):
+        """
+        Clear the loaded catalog so that it is reloaded on next use
+        """
+        with self._lock:
+            self._cached_data_version = None
+            self._data_version = None
+            self._parts = {}
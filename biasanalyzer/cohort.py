@@ -1,17 +1,26 @@
 from datetime import datetime
-from functools import reduce
 from typing import List
 
+import numpy as np
 import pandas as pd
 from pydantic import ValidationError
 from tqdm.auto import tqdm
 
+from biasanalyzer.background.threading_utils import CancellableTask, run_async, run_in_parallel
 from biasanalyzer.cohort_query_builder import CohortQueryBuilder
 from biasanalyzer.concept import ConceptHierarchy
 from biasanalyzer.config import load_cohort_creation_config
 from biasanalyzer.database import BiasDatabase, OMOPCDMDatabase
+from biasanalyzer.metrics import (
+    DISTANCE_METRICS,
+    benjamini_hochberg,
+    bootstrap_distance_ci,
+    chi_square_test,
+    pairwise_distances,
+    standardized_mean_difference,
+)
 from biasanalyzer.models import DOMAIN_MAPPING, CohortDefinition
-from biasanalyzer.utils import clean_string, hellinger_distance, notify_users
+from biasanalyzer.utils import clean_string, compute_cohort_fingerprint, notify_users
 
 
 class CohortData:
@@ -33,32 +42,116 @@ class CohortData:
             self._cohort_data = self.bias_db.get_cohort(self.cohort_id)
         return self._cohort_data
 
+    def get_data(self, output_format="records"):
+        """
+        Get the cohort data in the requested format. Columnar formats are fetched from the database directly
+        without building intermediate Python dicts and are not cached.
+        :param output_format: "records" (default) for a list of dicts, "df" for a pandas DataFrame,
+        or "arrow" for a pyarrow Table
+        :return: cohort data
+        """
+        if output_format == "records":
+            return self.data
+        return self.bias_db.get_cohort(self.cohort_id, output_format=output_format)
+
     @property
     def metadata(self):
         if self._metadata is None:
             self._metadata = self.bias_db.get_cohort_definition(self.cohort_id)
         return self._metadata
 
-    def get_stats(self, variable=""):
+    def get_stats(self, variable="", output_format="records", approximate=False):
         """
         Get aggregation statistics for the cohort in BiasDatabase.
         variable is optional with a default empty string. Supported variables are: age, gender,
-        race, and ethnicity.
+        race, and ethnicity. output_format can be "records" (default), "df", or "arrow".
+        Set approximate to True to estimate medians of very large cohorts faster along with their error bounds.
+        """
+        return self.bias_db.get_cohort_basic_stats(
+            self.cohort_id, variable=variable, output_format=output_format, approximate=approximate
+        )
+
+    def get_profile(self, output_format="records"):
+        """
+        Get basic, age, gender, race, and ethnicity statistics for the cohort in one query, returned as a dict
+        keyed by variable with "basic" for the basic stats. Each value is the same as get_stats() returns for the
+        variable. output_format can be "records" (default), "df", or "arrow".
         """
-        return self.bias_db.get_cohort_basic_stats(self.cohort_id, variable=variable)
+        return self.bias_db.get_cohort_profile(self.cohort_id, output_format=output_format)
 
-    def get_distributions(self, variable):
+    def get_temporal_distribution(self, granularity="month", output_format="records"):
+        """
+        Get the number of cohort entries in each calendar period of cohort_start_date, computed in BiasDatabase
+        without fetching the cohort data. granularity can be "day", "week", "month" (default), "quarter", or "year".
+        output_format can be "records" (default), "df", or "arrow".
+        """
+        return self.bias_db.get_cohort_temporal_distribution(
+            self.cohort_id, granularity=granularity, output_format=output_format
+        )
+
+    def get_stratified_stats(self, dimensions, grouping_sets=None, age_bins=None, output_format="records"):
+        """
+        Get the number of persons in each stratum of cross-tabulations of person attributes in the cohort in one
+        pass over the cohort. dimensions can be age_bin, gender, race, ethnicity, birth_decade, or any OMOP person
+        column. All combinations of the dimensions are cross-tabulated with CUBE unless grouping_sets lists the
+        combinations to cross-tabulate, e.g., [["gender"], ["gender", "race"]]. age_bins defines the age_bin
+        dimension as in get_distributions(). output_format can be "records" (default), "df", or "arrow".
+        """
+        return self.bias_db.get_cohort_stratified_stats(
+            self.cohort_id, dimensions, grouping_sets=grouping_sets, age_bins=age_bins, output_format=output_format
+        )
+
+    def get_distributions(self, variable, output_format="records", age_bins=None):
         """
         Get distribution statistics for a variable (e.g., age) in a specific cohort in BiasDatabase.
+        output_format can be "records" (default), "df", or "arrow". age_bins can be an AgeBinSpec object or a dict
+        of its fields, e.g., {"edges": [17, 44, 64]}, to configure the age bins instead of the default decade bins.
         """
-        return self.bias_db.get_cohort_distributions(self.cohort_id, variable)
+        return self.bias_db.get_cohort_distributions(
+            self.cohort_id, variable, output_format=output_format, age_bins=age_bins
+        )
 
     def get_concept_stats(
-        self, concept_type="condition_occurrence", filter_count=0, vocab=None, print_concept_hierarchy=False
+        self,
+        concept_type="condition_occurrence",
+        filter_count=0,
+        vocab=None,
+        print_concept_hierarchy=False,
+        timeout=None,
+        return_handle=False,
+        approximate=False,
+        concept_types=None,
+        strategy="sql",
     ):
         """
-        Get cohort concept statistics such as concept prevalence
+        Get cohort concept statistics such as concept prevalence. A timeout in seconds can be set to cancel the
+        computation by interrupting its running query. If return_handle is True, the computation runs in a worker
+        thread and a CancellableTask handle is returned right away, whose result() method returns the statistics.
+        Set approximate to True to estimate the concept counts of very large cohorts faster along with their error
+        bounds. Set concept_types to a list of concept types, e.g., ["condition_occurrence", "drug_exposure"], to
+        characterize the cohort over multiple domains at once with concurrent per-domain queries instead of
+        concept_type, in which case vocab can also be a dict of vocabularies keyed by concept type, and a dict of
+        ConceptHierarchy objects keyed by concept type is returned along with the statistics of all domains. Set
+        strategy to "bitmap" to roll up the exact concept counts to ancestor concepts by ORing person bitmaps up the
+        concept hierarchy instead of joining the cohort events with all of their ancestors in SQL.
         """
+        if timeout is not None or return_handle:
+            task = CancellableTask(
+                self.get_concept_stats,
+                concept_type=concept_type,
+                filter_count=filter_count,
+                vocab=vocab,
+                print_concept_hierarchy=print_concept_hierarchy,
+                approximate=approximate,
+                concept_types=concept_types,
+                strategy=strategy,
+                timeout=timeout,
+            )
+            return task if return_handle else task.result()
+        if concept_types is not None:
+            return self._get_domains_concept_stats(
+                concept_types, filter_count, vocab, print_concept_hierarchy, approximate, strategy
+            )
         if concept_type not in DOMAIN_MAPPING:
             raise ValueError(f"input concept_type {concept_type} is not a valid concept type to get concept stats")
 
@@ -69,14 +162,113 @@ class CohortData:
             filter_count=filter_count,
             vocab=vocab,
             print_concept_hierarchy=print_concept_hierarchy,
+            approximate=approximate,
+            strategy=strategy,
         )
         return (
             cohort_stats,
             ConceptHierarchy.build_concept_hierarchy_from_results(
-                self.cohort_id, concept_type, cohort_stats[concept_type], filter_count=filter_count, vocab=vocab
+                self.cohort_id,
+                concept_type,
+                cohort_stats[concept_type],
+                filter_count=filter_count,
+                vocab=vocab,
+                approximate=approximate,
             ),
         )
 
+    def _get_domains_concept_stats(
+        self, concept_types, filter_count, vocab, print_concept_hierarchy, approximate, strategy="sql"
+    ):
+        """
+        Get concept statistics of multiple domains with one query per domain, which run concurrently on the
+        cursors of their own worker threads unless the concept hierarchies are printed in the order of the domains.
+        The worker threads close their cursors when their queries complete.
+        :return: tuple of the concept statistics keyed by concept type and the ConceptHierarchy objects keyed by
+        concept type
+        """
+        concept_types = list(dict.fromkeys(concept_types))
+        if not concept_types:
+            raise ValueError("concept_types must include at least one concept type to get concept stats")
+        invalid_concept_types = [c for c in concept_types if c not in DOMAIN_MAPPING]
+        if invalid_concept_types:
+            raise ValueError(f"input concept_types {invalid_concept_types} are not valid concept types")
+        vocabs = vocab if isinstance(vocab, dict) else dict.fromkeys(concept_types, vocab)
+        results = run_in_parallel(
+            [
+                (
+                    self.get_concept_stats,
+                    (),
+                    {
+                        "concept_type": concept_type,
+                        "filter_count": filter_count,
+                        "vocab": vocabs.get(concept_type),
+                        "print_concept_hierarchy": print_concept_hierarchy,
+                        "approximate": approximate,
+                        "strategy": strategy,
+                    },
+                )
+                for concept_type in concept_types
+            ],
+            max_workers=1 if print_concept_hierarchy else None,
+        )
+        cohort_stats = {}
+        for domain_stats, _ in results:
+            cohort_stats.update(domain_stats)
+        return cohort_stats, {concept_type: hierarchy for concept_type, (_, hierarchy) in zip(concept_types, results)}
+
+    async def aget_data(self, output_format="records"):
+        """
+        Awaitable version of get_data() running the query on the bounded async executor
+        """
+        return await run_async(self.get_data, output_format=output_format)
+
+    async def aget_stats(self, variable="", output_format="records", approximate=False):
+        """
+        Awaitable version of get_stats() running the query on the bounded async executor
+        """
+        return await run_async(
+            self.get_stats,
+            variable=variable,
+            output_format=output_format,
+            approximate=approximate,
+        )
+
+    async def aget_distributions(self, variable, output_format="records", age_bins=None):
+        """
+        Awaitable version of get_distributions() running the query on the bounded async executor
+        """
+        return await run_async(
+            self.get_distributions,
+            variable,
+            output_format=output_format,
+            age_bins=age_bins,
+        )
+
+    async def aget_concept_stats(
+        self,
+        concept_type="condition_occurrence",
+        filter_count=0,
+        vocab=None,
+        print_concept_hierarchy=False,
+        approximate=False,
+        concept_types=None,
+        strategy="sql",
+    ):
+        """
+        Awaitable version of get_concept_stats() running the query on the bounded async executor
+        """
+        return await run_async(
+            self.get_concept_stats,
+            concept_type=concept_type,
+            filter_count=filter_count,
+            vocab=vocab,
+            print_concept_hierarchy=print_concept_hierarchy,
+            approximate=approximate,
+            concept_types=concept_types,
+            strategy=strategy,
+        )
+
     def __del__(self):
         self._cohort_data = None
         self._metadata = None
@@ -88,7 +280,15 @@ class CohortAction:
         self.bias_db = bias_db
         self._query_builder = CohortQueryBuilder()
 
-    def create_cohort(self, cohort_name: str, description: str, query_or_yaml_file: str, created_by: str):
+    def create_cohort(
+        self,
+        cohort_name: str,
+        description: str,
+        query_or_yaml_file: str,
+        created_by: str,
+        in_engine: bool = False,
+        reuse_existing: bool = False,
+    ):
         """
         Create a new cohort by executing a query on OMOP CDM database
         and storing the result in BiasDatabase. The query can be passed in directly
@@ -98,6 +298,10 @@ class CohortAction:
         :param query_or_yaml_file: the SQL query string or yaml file name for creating a cohort
         :param created_by: created_by string indicating who created the cohort, it could be 'system',
         or a username, or whatever metadata to record who created the cohort
+        :param in_engine: if True, run the query inside BiasDatabase against its attached OMOP database and
+        insert the results into the cohort table directly without pulling cohort rows into Python. Default is False
+        :param reuse_existing: if True, return the existing cohort already created from the same cohort definition
+        against the same OMOP data instead of re-executing the query. Default is False
         :return: CohortData object if cohort is created successfully; otherwise, return None
         """
         stages = [
@@ -108,6 +312,159 @@ class CohortAction:
         progress = tqdm(total=len(stages), desc="Cohort creation", unit="stage", dynamic_ncols=True, leave=True)
 
         progress.set_postfix_str(stages[0])
+        built_query = self._build_cohort_query(query_or_yaml_file)
+        if built_query is None:
+            return None
+        query, cohort_config = built_query
+        progress.update(1)
+
+        # fingerprint the parsed config so that yaml formatting, comments, and key order do not matter, and the raw
+        # SQL query text since the built query has whitespace inside its string literals collapsed
+        fingerprint = self._get_fingerprint(cohort_config if cohort_config is not None else query_or_yaml_file)
+        if reuse_existing:
+            existing_cohort = self._find_existing_cohort(fingerprint)
+            if existing_cohort is not None:
+                progress.update(2)
+                return existing_cohort
+
+        progress.set_postfix_str(stages[1])
+        cohort_def = CohortDefinition(
+            name=cohort_name,
+            description=description,
+            created_date=datetime.now().date(),
+            creation_info=clean_string(query),
+            created_by=created_by,
+            fingerprint=fingerprint,
+        )
+        if in_engine:
+            return self._create_cohort_in_engine(cohort_def, query, progress)
+
+        omop_session = self.omop_db.get_session()
+        try:
+            # Execute read-only query from OMOP CDM database and fetch the results in columnar form
+            cohort_df = self.omop_db.execute_query(query, output_format="df")
+            if not cohort_df.empty:
+                # Store cohort_definition and cohort data into BiasDatabase in one transaction, which is rolled back
+                # if the cohort creation fails or is cancelled before it commits
+                with self.bias_db.transaction():
+                    cohort_def_id = self.bias_db.create_cohort_definition(cohort_def, progress_obj=tqdm)
+                    progress.update(1)
+
+                    progress.set_postfix_str(stages[2])
+                    cohort_df["cohort_definition_id"] = cohort_def_id
+                    cohort_df = cohort_df.rename(columns={"person_id": "subject_id"})
+                    self.bias_db.create_cohort_in_bulk(cohort_df)
+                progress.update(1)
+
+                tqdm.write(f"Cohort {cohort_name} successfully created.")
+                return CohortData(cohort_id=cohort_def_id, bias_db=self.bias_db, omop_db=self.omop_db)
+            else:
+                progress.update(2)
+                notify_users("No cohort is created due to empty results being returned from query")
+                return None
+        except Exception as e:
+            progress.update(2)
+            notify_users(f"Error executing query: {e}")
+            if omop_session is not None:
+                omop_session.close()
+            return None
+
+    def create_cohorts(self, cohort_specs: List[dict], reuse_existing: bool = False):
+        """
+        Create a batch of cohorts in-engine in one pass over the OMOP domain tables. The ranked domain events
+        needed by all cohort creation yaml configs in the batch are materialized once into temporary tables shared
+        by every cohort query, instead of each cohort scanning and window-ranking the same domain tables again.
+        :param cohort_specs: list of dicts with cohort_name, cohort_desc, query_or_yaml_file, and created_by keys
+        as accepted by BIAS.create_cohort()
+        :param reuse_existing: if True, return existing cohorts already created from the same cohort definitions
+        against the same OMOP data instead of recreating them. Default is False
+        :return: list of CohortData objects in the order of cohort_specs, with None for cohorts not created
+        """
+        progress = tqdm(
+            total=len(cohort_specs) + 1, desc="Cohorts creation", unit="cohort", dynamic_ncols=True, leave=True
+        )
+        created_cohorts = [None] * len(cohort_specs)
+        pending_cohorts = []
+        # index of the first cohort in the batch with each fingerprint, used to create duplicated cohorts once
+        batch_fingerprints = {}
+        duplicated_cohorts = {}
+        for idx, spec in enumerate(cohort_specs):
+            built_query = self._build_cohort_query(spec["query_or_yaml_file"])
+            if built_query is None:
+                progress.update(1)
+                continue
+            query, cohort_config = built_query
+            fingerprint = self._get_fingerprint(
+                cohort_config if cohort_config is not None else spec["query_or_yaml_file"]
+            )
+            if reuse_existing and fingerprint is not None:
+                existing_cohort = self._find_existing_cohort(fingerprint)
+                if existing_cohort is not None:
+                    created_cohorts[idx] = existing_cohort
+                    progress.update(1)
+                    continue
+                if fingerprint in batch_fingerprints:
+                    duplicated_cohorts[idx] = batch_fingerprints[fingerprint]
+                    progress.update(1)
+                    continue
+                batch_fingerprints[fingerprint] = idx
+            cohort_def = CohortDefinition(
+                name=spec["cohort_name"],
+                description=spec["cohort_desc"],
+                created_date=datetime.now().date(),
+                creation_info=clean_string(query),
+                created_by=spec["created_by"],
+                fingerprint=fingerprint,
+            )
+            pending_cohorts.append((idx, cohort_def, query, cohort_config))
+
+        progress.set_postfix_str("Materialized shared domain events")
+        shared_queries = self._query_builder.build_query_shared_event_domains(
+            [cohort_config for _, _, _, cohort_config in pending_cohorts if cohort_config is not None]
+        )
+        try:
+            self.bias_db.create_temp_tables_from_queries(shared_queries)
+        except Exception as e:
+            progress.update(len(pending_cohorts) + 1)
+            notify_users(f"Error executing query: {e}")
+            self.bias_db.drop_temp_tables(shared_queries.keys())
+            return created_cohorts
+        progress.update(1)
+
+        try:
+            for idx, cohort_def, query, cohort_config in pending_cohorts:
+                progress.set_postfix_str(f"Created cohort {cohort_def.name}")
+                if cohort_config is not None:
+                    query = self._query_builder.build_query_cohort_creation(cohort_config, shared_event_domains=True)
+                try:
+                    cohort_def_id = self.bias_db.create_cohort_from_query(cohort_def, query, progress_obj=tqdm)
+                except Exception as e:
+                    notify_users(f"Error executing query for cohort {cohort_def.name}: {e}")
+                    cohort_def_id = None
+                else:
+                    if cohort_def_id is None:
+                        notify_users(
+                            f"No cohort {cohort_def.name} is created due to empty results being returned from query"
+                        )
+                if cohort_def_id is not None:
+                    created_cohorts[idx] = CohortData(
+                        cohort_id=cohort_def_id, bias_db=self.bias_db, omop_db=self.omop_db
+                    )
+                progress.update(1)
+        finally:
+            self.bias_db.drop_temp_tables(shared_queries.keys())
+
+        for idx, first_idx in duplicated_cohorts.items():
+            created_cohorts[idx] = created_cohorts[first_idx]
+        return created_cohorts
+
+    def _build_cohort_query(self, query_or_yaml_file: str):
+        """
+        Build the cohort creation SQL query from a SQL query string or cohort creation yaml file
+        :param query_or_yaml_file: the SQL query string or yaml file name for creating a cohort
+        :return: tuple of the SQL query and the cohort creation config loaded from the yaml file, which is None
+        for a SQL query string; or None if the yaml file cannot be loaded
+        """
         if query_or_yaml_file.endswith(".yaml") or query_or_yaml_file.endswith(".yml"):
             try:
                 cohort_config = load_cohort_creation_config(query_or_yaml_file)
@@ -121,78 +478,211 @@ class CohortAction:
             except ValidationError as ex:
                 notify_users(f"cohort creation configuration yaml file is not valid with validation error: {ex}")
                 return None
+            return self._query_builder.build_query_cohort_creation(cohort_config), cohort_config
+        return clean_string(query_or_yaml_file), None
 
-            query = self._query_builder.build_query_cohort_creation(cohort_config)
-        else:
-            query = clean_string(query_or_yaml_file)
-        progress.update(1)
+    def _find_existing_cohort(self, fingerprint):
+        if fingerprint is None:
+            return None
+        existing_cohort_id = self.bias_db.find_cohort_by_fingerprint(fingerprint)
+        if existing_cohort_id is None:
+            return None
+        notify_users(
+            f"Cohort {existing_cohort_id} was already created from the same cohort definition and OMOP data, "
+            f"reusing it as requested by reuse_existing."
+        )
+        return CohortData(cohort_id=existing_cohort_id, bias_db=self.bias_db, omop_db=self.omop_db)
 
-        progress.set_postfix_str(stages[1])
-        omop_session = self.omop_db.get_session()
+    def _get_fingerprint(self, definition):
         try:
-            # Execute read-only query from OMOP CDM database
-            result = self.omop_db.execute_query(query)
-            if result:
-                # Create CohortDefinition
-                cohort_def = CohortDefinition(
-                    name=cohort_name,
-                    description=description,
-                    created_date=datetime.now().date(),
-                    creation_info=clean_string(query),
-                    created_by=created_by,
-                )
-                cohort_def_id = self.bias_db.create_cohort_definition(cohort_def, progress_obj=tqdm)
-                progress.update(1)
+            return compute_cohort_fingerprint(definition, self.bias_db.get_omop_data_version())
+        except Exception as e:
+            # cohort reuse is an optimization, so cohorts are still created when the fingerprint is not available
+            notify_users(f"Failed to compute cohort definition fingerprint: {e}", level="warning")
+            return None
 
-                progress.set_postfix_str(stages[2])
-                # Store cohort_definition and cohort data into BiasDatabase
-                cohort_df = pd.DataFrame(result)
-                cohort_df["cohort_definition_id"] = cohort_def_id
-                cohort_df = cohort_df.rename(columns={"person_id": "subject_id"})
-                self.bias_db.create_cohort_in_bulk(cohort_df)
-                progress.update(1)
+    def get_cohort(self, cohort_id: int):
+        """
+        Get a CohortData object for an existing cohort in BiasDatabase
+        :param cohort_id: cohort definition id of the cohort
+        :return: CohortData object if the cohort definition exists; otherwise, return None
+        """
+        if not self.bias_db.get_cohort_definition(cohort_id):
+            notify_users(f"Cohort {cohort_id} does not exist")
+            return None
+        return CohortData(cohort_id=cohort_id, bias_db=self.bias_db, omop_db=self.omop_db)
 
-                tqdm.write(f"Cohort {cohort_name} successfully created.")
-                return CohortData(cohort_id=cohort_def_id, bias_db=self.bias_db, omop_db=self.omop_db)
-            else:
-                progress.update(2)
-                notify_users("No cohort is created due to empty results being returned from query")
-                return None
+    def _create_cohort_in_engine(self, cohort_def: CohortDefinition, query: str, progress):
+        try:
+            # Execute the query and insert its results into the cohort table within BiasDatabase
+            cohort_def_id = self.bias_db.create_cohort_from_query(cohort_def, query, progress_obj=tqdm)
+            progress.update(2)
         except Exception as e:
             progress.update(2)
             notify_users(f"Error executing query: {e}")
-            if omop_session is not None:
-                omop_session.close()
             return None
+        if cohort_def_id is None:
+            notify_users("No cohort is created due to empty results being returned from query")
+            return None
+        tqdm.write(f"Cohort {cohort_def.name} successfully created.")
+        return CohortData(cohort_id=cohort_def_id, bias_db=self.bias_db, omop_db=self.omop_db)
 
     def get_cohorts_concept_stats(
         self, cohorts: List[int], concept_type: str = "condition_occurrence", filter_count: int = 0, vocab=None
     ):
-        cohort_concept_stats = [
-            self.bias_db.get_cohort_concept_stats(
-                c, self._query_builder, concept_type=concept_type, filter_count=filter_count, vocab=vocab
-            )
-            for c in cohorts
-        ]
-        hierarchies = [
-            ConceptHierarchy.build_concept_hierarchy_from_results(
-                c, concept_type, c_stats.get(concept_type, []), filter_count=filter_count, vocab=vocab
-            )
-            for c, c_stats in zip(cohorts, cohort_concept_stats)
-        ]
-        return reduce(lambda h1, h2: h1.union(h2), hierarchies).to_dict()
+        cohort_concept_stats = self.bias_db.get_cohorts_concept_stats(
+            cohorts, self._query_builder, concept_type=concept_type, filter_count=filter_count, vocab=vocab
+        )
+        return ConceptHierarchy.build_concept_hierarchy_from_cohorts_results(
+            cohorts, concept_type, cohort_concept_stats[concept_type], filter_count=filter_count, vocab=vocab
+        ).to_dict()
+
+    def _validate_metrics(self, metrics: List[str]):
+        invalid_metrics = [metric for metric in metrics if metric not in DISTANCE_METRICS]
+        if invalid_metrics:
+            raise ValueError(f"invalid metrics {invalid_metrics}. Valid metrics are {list(DISTANCE_METRICS.keys())}")
 
-    def compare_cohorts(self, cohort_id_1: int, cohort_id_2: int):
+    def _get_cohorts_bin_counts(self, cohort_ids: List[int], variable: str, age_bins=None):
         """
-        Compare the distributions of two cohorts in BiasDatabase.
+        Get the raw bin counts of a distribution of multiple cohorts with one query
+        :return: pandas DataFrame with one row per cohort in the order of cohort_ids and one column per distribution
+        bin, e.g., age_bin or gender
         """
+        distr_df = self.bias_db.get_cohorts_distributions(
+            cohort_ids, variable=variable, output_format="df", age_bins=age_bins
+        )
+        # columns are cohort_definition_id, the distribution bin, and the bin count followed by the probability
+        bin_col, count_col = distr_df.columns[1], distr_df.columns[2]
+        counts = distr_df.pivot(index="cohort_definition_id", columns=bin_col, values=count_col)
+        # keep the bin order of the distribution query, e.g., age bins in increasing age for ordinal metrics
+        return counts.reindex(index=cohort_ids, columns=distr_df[bin_col].unique())
+
+    def compare_cohorts(
+        self,
+        cohort_id_1: int,
+        cohort_id_2: int,
+        age_bins=None,
+        metrics: List[str] = None,
+        confidence_level: float = None,
+        n_resamples: int = 1000,
+        seed=None,
+    ):
+        """
+        Compare the distributions of two cohorts in BiasDatabase from their raw bin counts.
+        :param cohort_id_1: id of the first cohort
+        :param cohort_id_2: id of the second cohort
+        :param age_bins: AgeBinSpec object or a dict of its fields defining the bins of the age distribution as in
+        get_cohort_distributions()
+        :param metrics: list of distance metric names in biasanalyzer.metrics.DISTANCE_METRICS, default is
+        ["hellinger"]
+        :param confidence_level: confidence level, e.g., 0.95, to also compute bootstrap confidence intervals of
+        the distances, default is None meaning no confidence intervals
+        :param n_resamples: number of bootstrap resamples for the confidence intervals, default is 1000
+        :param seed: seed for reproducible bootstrap resamples, default is None
+        :return: list of dicts keyed by <variable>_<metric>_distance, e.g., age_hellinger_distance, which also have
+        a <variable>_<metric>_distance_ci key with a (lower, upper) tuple if confidence_level is set
+        """
+        metrics = metrics or ["hellinger"]
+        if confidence_level is None:
+            distance_matrices = self.compare_cohort_matrix(
+                [cohort_id_1, cohort_id_2], metrics=metrics, age_bins=age_bins
+            )
+            return [{name: matrix.loc[cohort_id_1, cohort_id_2]} for name, matrix in distance_matrices.items()]
+
+        self._validate_metrics(metrics)
         results = []
         for variable in self.bias_db.cohort_distribution_variables:
-            cohort_1_stats = self.bias_db.get_cohort_distributions(cohort_id_1, variable=variable)
-            cohort_2_stats = self.bias_db.get_cohort_distributions(cohort_id_2, variable=variable)
-            cohort_1_probs = [entry["probability"] for entry in cohort_1_stats]
-            cohort_2_probs = [entry["probability"] for entry in cohort_2_stats]
-            dist = hellinger_distance(cohort_1_probs, cohort_2_probs)
-            results.append({f"{variable}_hellinger_distance": dist})
+            counts = self._get_cohorts_bin_counts(
+                list(dict.fromkeys([cohort_id_1, cohort_id_2])), variable, age_bins=age_bins
+            )
+            for metric in metrics:
+                distance = bootstrap_distance_ci(
+                    counts.loc[cohort_id_1].to_numpy(),
+                    counts.loc[cohort_id_2].to_numpy(),
+                    metric=metric,
+                    n_resamples=n_resamples,
+                    confidence_level=confidence_level,
+                    seed=seed,
+                )
+                name = f"{variable}_{metric}_distance"
+                results.append({name: distance["distance"], f"{name}_ci": (distance["ci_lower"], distance["ci_upper"])})
+        return results
 
+    def compare_cohort_matrix(self, cohort_ids: List[int], metrics: List[str] = None, age_bins=None):
+        """
+        Compare the distributions of all pairs of cohorts in BiasDatabase. The raw bin counts of all cohorts are
+        fetched with one query per variable, aligned by distribution bin, and compared with one array operation.
+        :param cohort_ids: list of cohort ids to compare
+        :param metrics: list of distance metric names in biasanalyzer.metrics.DISTANCE_METRICS, i.e., "hellinger",
+        "jensen_shannon", "total_variation", and "wasserstein", default is ["hellinger"]
+        :param age_bins: AgeBinSpec object or a dict of its fields defining the bins of the age distribution,
+        default is None meaning the decade age bins
+        :return: dict keyed by <variable>_<metric>_distance, e.g., age_hellinger_distance, with a pandas DataFrame
+        of the pairwise distances indexed by cohort ids in both rows and columns
+        """
+        metrics = metrics or ["hellinger"]
+        cohort_ids = list(dict.fromkeys(cohort_ids))
+        self._validate_metrics(metrics)
+
+        results = {}
+        for variable in self.bias_db.cohort_distribution_variables:
+            counts = self._get_cohorts_bin_counts(cohort_ids, variable, age_bins=age_bins)
+            for metric in metrics:
+                results[f"{variable}_{metric}_distance"] = pd.DataFrame(
+                    pairwise_distances(counts.to_numpy(), metric=metric),
+                    index=cohort_ids,
+                    columns=cohort_ids,
+                )
         return results
+
+    def compare_concept_prevalence(
+        self,
+        cohort_id_1: int,
+        cohort_id_2: int,
+        concept_type: str = "condition_occurrence",
+        filter_count: int = 0,
+        vocab=None,
+    ):
+        """
+        Compare the prevalence of every concept in a domain between two cohorts. The subject counts of both cohorts
+        are computed with one grouped query, and the effect sizes and significance tests of all concepts are
+        computed with vectorized array operations.
+        :param cohort_id_1: id of the first cohort
+        :param cohort_id_2: id of the second cohort
+        :param concept_type: OMOP domain of the concepts, default is condition_occurrence
+        :param filter_count: minimum count threshold in either cohort for concepts with 0 meaning no filtering
+        :param vocab: vocabulary id of the concepts, default is None meaning the default vocabulary of the domain
+        :return: pandas DataFrame with concept_id, concept_name, concept_code, count_1, prevalence_1, count_2,
+        prevalence_2, smd (standardized mean difference), chi_square, p_value, and p_value_adjusted (Benjamini-Hochberg
+        false discovery rate) columns with one row per concept sorted by decreasing absolute smd
+        """
+        counts = self.bias_db.get_cohorts_concept_counts(
+            cohort_id_1,
+            cohort_id_2,
+            self._query_builder,
+            concept_type=concept_type,
+            filter_count=filter_count,
+            vocab=vocab,
+        )
+        count_1, size_1 = counts["count_1"].to_numpy(dtype=float), counts["size_1"].to_numpy(dtype=float)
+        count_2, size_2 = counts["count_2"].to_numpy(dtype=float), counts["size_2"].to_numpy(dtype=float)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            prevalence_1 = count_1 / size_1
+            prevalence_2 = count_2 / size_2
+        chi_square, p_value = chi_square_test(count_1, size_1, count_2, size_2)
+        results = pd.DataFrame(
+            {
+                "concept_id": counts["concept_id"],
+                "concept_name": counts["concept_name"],
+                "concept_code": counts["concept_code"],
+                "count_1": counts["count_1"],
+                "prevalence_1": prevalence_1,
+                "count_2": counts["count_2"],
+                "prevalence_2": prevalence_2,
+                "smd": standardized_mean_difference(prevalence_1, prevalence_2),
+                "chi_square": chi_square,
+                "p_value": p_value,
+                "p_value_adjusted": benjamini_hochberg(p_value),
+            }
+        )
+        return results.sort_values("smd", key=lambda smd: smd.abs(), ascending=False, kind="stable", ignore_index=True)
@@ -27,6 +27,7 @@ class CohortQueryBuilder:
         if cohort_creation:
             self.env.globals.update(
                 demographics_filter=self._load_macro("demographics_filter"),
+                ranked_domain_events=self._load_macro("ranked_domain_events"),
                 temporal_event_filter=self.temporal_event_filter,
             )
 
@@ -39,6 +40,31 @@ class CohortQueryBuilder:
                 domains.update(self._extract_domains(event["events"]))
         return domains
 
+    def _collect_event_filters(self, events, event_filters=None):
+        """
+        Collect the concept ids and event instance directions referenced by events of each domain so that they can
+        be pushed down into the per-domain ranked CTEs.
+        :param events: list of temporal events or event groups
+        :param event_filters: dict keyed by domain to accumulate results into when called recursively
+        :return: dict keyed by domain with concept_ids, rank_asc, and rank_desc keys
+        """
+        if event_filters is None:
+            event_filters = {}
+        for event in events:
+            if "events" in event:
+                self._collect_event_filters(event["events"], event_filters)
+            elif event.get("event_type") and event["event_type"] != "date":
+                event_filter = event_filters.setdefault(
+                    event["event_type"], {"concept_ids": set(), "rank_asc": False, "rank_desc": False}
+                )
+                event_filter["concept_ids"].add(int(event["event_concept_id"]))
+                if event.get("event_instance") is not None:
+                    if int(event["event_instance"]) < 0:
+                        event_filter["rank_desc"] = True
+                    else:
+                        event_filter["rank_asc"] = True
+        return event_filters
+
     def _load_macro(self, macro_name):
         """
         Load a macro from macros.sql.j2 into the Jinja2 environment.
@@ -46,10 +72,53 @@ class CohortQueryBuilder:
         macros_template = self.env.get_template("macros.sql.j2")
         return macros_template.module.__dict__[macro_name]
 
-    def build_query_cohort_creation(self, cohort_config: dict) -> str:
+    @staticmethod
+    def _build_event_domains(event_filters):
+        """
+        Build the per-domain inputs of ranked domain events from collected event filters in DOMAIN_MAPPING order
+        so that the rendered query is deterministic
+        :param event_filters: dict keyed by domain as returned by _collect_event_filters
+        :return: dict keyed by domain with domain, concept_ids, rank_asc, and rank_desc keys
+        """
+        return {
+            dt: {
+                "domain": domain,
+                "concept_ids": sorted(event_filters[dt]["concept_ids"]),
+                "rank_asc": event_filters[dt]["rank_asc"],
+                "rank_desc": event_filters[dt]["rank_desc"],
+            }
+            for dt, domain in DOMAIN_MAPPING.items()
+            if domain.get("table") and dt in event_filters
+        }
+
+    def build_query_shared_event_domains(self, cohort_configs: list) -> dict:
+        """
+        Build SQL queries for ranked domain events shared by a batch of cohort creation configs, so that each
+        domain table is scanned and window-ranked once for all cohorts. Each query covers the union of concept ids
+        referenced by the configs for its domain. Event instances are ranked per person and concept, so the ranks
+        are the same as those computed for each cohort separately.
+        :param cohort_configs: list of dict objects loaded from cohort creation yaml files
+        :return: dict of ranked_<domain> table name to its SQL query
+        """
+        event_filters = {}
+        for cohort_config in cohort_configs:
+            inclusion_criteria = cohort_config.get("inclusion_criteria")
+            exclusion_criteria = cohort_config.get("exclusion_criteria") or {}
+            self._collect_event_filters(
+                inclusion_criteria.get("temporal_events", []) + exclusion_criteria.get("temporal_events", []),
+                event_filters,
+            )
+        return {
+            f"ranked_{dt}": str(self.env.globals["ranked_domain_events"](event_domain))
+            for dt, event_domain in self._build_event_domains(event_filters).items()
+        }
+
+    def build_query_cohort_creation(self, cohort_config: dict, shared_event_domains: bool = False) -> str:
         """
         Build a SQL query from the CohortCreationConfig object.
         :param cohort_config: dict object loaded from yaml file for building sql query.
+        :param shared_event_domains: if True, the query reads ranked domain events from ranked_<domain> tables
+        materialized from build_query_shared_event_domains() instead of computing them in CTEs. Default is False
         :return: The rendered SQL query.
         """
         inclusion_criteria = cohort_config.get("inclusion_criteria")
@@ -60,22 +129,45 @@ class CohortQueryBuilder:
         all_domains = self._extract_domains(inclusion_events + exclusion_events)
         # Filter DOMAIN_MAPPING to exclude domains with table: None
         valid_domains = {k: v for k, v in DOMAIN_MAPPING.items() if v.get("table")}
-        ranked_domains = {dt: valid_domains[dt] for dt in all_domains if dt in valid_domains}
+        # iterate DOMAIN_MAPPING order rather than the domain set so that the rendered query is deterministic
+        ranked_domains = {dt: domain for dt, domain in valid_domains.items() if dt in all_domains}
+
+        # concept ids and event instance directions referenced per domain are pushed down into the ranked CTEs
+        event_domains = self._build_event_domains(self._collect_event_filters(inclusion_events + exclusion_events))
 
         if not temporal_events:
             # For demographic only inclusion criteria, filter DOMAIN_MAPPING to exclude domains with table: None
             ranked_domains = valid_domains
 
+        # inclusion demographics restrict the persons whose events need to be ranked, so they can be applied as a
+        # semi-join on pre-filtered person rows in the ranked CTEs. Exclusion demographics cannot be pushed down
+        # since they remove persons from the cohort instead.
+        demographics = inclusion_criteria.get("demographics") or {}
+        pushdown_demographics = any(demographics.get(k) for k in ("gender", "min_birth_year", "max_birth_year"))
+
         template = self.env.get_template("cohort_creation_query.sql.j2")
         return template.render(
             inclusion_criteria=inclusion_criteria,
             exclusion_criteria=exclusion_criteria,
             ranked_domains=ranked_domains,
+            event_domains=event_domains,
+            pushdown_demographics=pushdown_demographics,
+            shared_event_domains=shared_event_domains,
             temporal_events=temporal_events,
         )
 
     def build_concept_prevalence_query(
-        self, db_schema: str, omop_alias: str, concept_type: str, cid: int, filter_count: int, vocab: str
+        self,
+        db_schema: str,
+        omop_alias: str,
+        concept_type: str,
+        cid: int,
+        filter_count: int,
+        vocab: str,
+        approximate: bool = False,
+        count_relative_error: float = 0.0,
+        vocab_tables: dict = None,
+        incidence_table: str = None,
     ) -> str:
         """
         Build a SQL query for concept prevalence statistics for a given domain and cohort.
@@ -85,29 +177,195 @@ class CohortQueryBuilder:
         :param cid: Cohort definition ID.
         :param filter_count: Minimum count threshold for concepts with 0 meaning no filtering
         :param vocab: Vocabulary ID. Defaults to domain-specific vocabulary as defined in DOMAIN_MAPPING if set to None
+        :param approximate: Whether to estimate distinct subject counts with approx_count_distinct instead of
+        COUNT(DISTINCT) along with lower and upper bounds of the counts and prevalences. Defaults to False
+        :param count_relative_error: Relative error of the approximate counts used for their bounds
+        :param vocab_tables: dict of the concept_ancestor and concept tables to join instead of the OMOP ones, e.g.,
+        local vocabulary tables from BiasDatabase.get_vocab_tables(). Defaults to the OMOP vocabulary tables
+        :param incidence_table: Incidence table of the domain from BiasDatabase.get_incidence_table() to read instead
+        of the domain event table. Defaults to None meaning the domain event table is read
         :return: The rendered SQL query
         :raises ValueError if concept_type is not invalid
         """
 
-        # Validate concept_type
+        effective_vocab = self.get_effective_vocab(concept_type, vocab)
+        # Load and render the template
+        template = self.env.get_template("cohort_concept_prevalence_query.sql.j2")
+        return template.render(
+            db_schema=db_schema,
+            omop=omop_alias,
+            **self._get_vocab_table_params(omop_alias, vocab_tables),
+            table_name=DOMAIN_MAPPING[concept_type]["table"],
+            concept_id_column=DOMAIN_MAPPING[concept_type]["concept_id"],
+            start_date_column=DOMAIN_MAPPING[concept_type]["start_date"],
+            cid=cid,
+            filter_count=filter_count,
+            vocab=effective_vocab,
+            incidence_table=incidence_table,
+            approximate=approximate,
+            count_relative_error=count_relative_error,
+        )
+
+    @staticmethod
+    def _validate_concept_type(concept_type: str):
         if concept_type not in DOMAIN_MAPPING or DOMAIN_MAPPING[concept_type]["table"] is None:
             valid_domains = [k for k in DOMAIN_MAPPING.keys() if DOMAIN_MAPPING[k]["table"] is not None]
             raise ValueError(f"Invalid concept_type: {concept_type}. Must be one of {valid_domains}")
 
-        # The provided vocab is assumed to be already validated if it is not set to None. Otherwise,
-        # if set to None, use domain-specific default vocabulary
-        effective_vocab = vocab if vocab is not None else DOMAIN_MAPPING[concept_type]["default_vocab"]
-        # Load and render the template
-        template = self.env.get_template("cohort_concept_prevalence_query.sql.j2")
+    @staticmethod
+    def get_effective_vocab(concept_type: str, vocab: str = None) -> str:
+        """
+        Get the vocabulary of concept prevalence queries of a domain.
+        :param concept_type: Domain from DOMAIN_MAPPING (e.g., 'condition_occurrence').
+        :param vocab: Vocabulary ID, which is assumed to be already validated if it is not set to None
+        :return: vocab, or the domain-specific default vocabulary as defined in DOMAIN_MAPPING if vocab is None
+        :raises ValueError if concept_type is not invalid
+        """
+        CohortQueryBuilder._validate_concept_type(concept_type)
+        return vocab if vocab is not None else DOMAIN_MAPPING[concept_type]["default_vocab"]
+
+    @staticmethod
+    def _get_vocab_table_params(omop_alias: str, vocab_tables: dict = None) -> dict:
+        vocab_tables = vocab_tables or {}
+        return {
+            "concept_ancestor_table": vocab_tables.get("concept_ancestor", f"{omop_alias}.concept_ancestor"),
+            "concept_table": vocab_tables.get("concept", f"{omop_alias}.concept"),
+        }
+
+    def build_concept_prevalence_comparison_query(
+        self,
+        db_schema: str,
+        omop_alias: str,
+        concept_type: str,
+        cid_1: int,
+        cid_2: int,
+        filter_count: int = 0,
+        vocab: str = None,
+        vocab_tables: dict = None,
+        incidence_table: str = None,
+    ) -> str:
+        """
+        Build a SQL query counting the distinct subjects of two cohorts with each concept in a domain in one
+        grouped pass over the cohort table.
+        :param db_schema: BiasDatabase database schema under which all tables are stored.
+        :param omop_alias: OMOP database alias attached to the BiasDataBase in-memory duckdb
+        :param concept_type: Domain from DOMAIN_MAPPING (e.g., 'condition_occurrence').
+        :param cid_1: Cohort definition ID of the first cohort.
+        :param cid_2: Cohort definition ID of the second cohort.
+        :param filter_count: Minimum count threshold in either cohort for concepts with 0 meaning no filtering
+        :param vocab: Vocabulary ID. Defaults to domain-specific vocabulary as defined in DOMAIN_MAPPING if set to None
+        :param vocab_tables: dict of the concept_ancestor and concept tables to join instead of the OMOP ones.
+        Defaults to the OMOP vocabulary tables
+        :param incidence_table: Incidence table of the domain to read instead of the domain event table. Defaults to
+        None meaning the domain event table is read
+        :return: The rendered SQL query
+        :raises ValueError if concept_type is not invalid
+        """
+        effective_vocab = self.get_effective_vocab(concept_type, vocab)
+        template = self.env.get_template("cohort_concept_prevalence_comparison_query.sql.j2")
         return template.render(
             db_schema=db_schema,
             omop=omop_alias,
+            **self._get_vocab_table_params(omop_alias, vocab_tables),
             table_name=DOMAIN_MAPPING[concept_type]["table"],
             concept_id_column=DOMAIN_MAPPING[concept_type]["concept_id"],
             start_date_column=DOMAIN_MAPPING[concept_type]["start_date"],
-            cid=cid,
+            cid_1=int(cid_1),
+            cid_2=int(cid_2),
+            filter_count=filter_count,
+            vocab=effective_vocab,
+            incidence_table=incidence_table,
+        )
+
+    def build_concept_rollup_queries(
+        self,
+        db_schema: str,
+        omop_alias: str,
+        concept_type: str,
+        cid: int,
+        vocab: str = None,
+        vocab_tables: dict = None,
+        incidence_table: str = None,
+    ) -> dict:
+        """
+        Build the SQL queries fetching the inputs of rolling up concept prevalence of a cohort with person bitmaps
+        instead of joining the cohort events with all of their ancestors.
+        :param db_schema: BiasDatabase database schema under which all tables are stored.
+        :param omop_alias: OMOP database alias attached to the BiasDataBase in-memory duckdb
+        :param concept_type: Domain from DOMAIN_MAPPING (e.g., 'condition_occurrence').
+        :param cid: Cohort definition ID.
+        :param vocab: Vocabulary ID. Defaults to domain-specific vocabulary as defined in DOMAIN_MAPPING if set to None
+        :param vocab_tables: dict of the concept_ancestor and concept tables to join instead of the OMOP ones.
+        Defaults to the OMOP vocabulary tables
+        :param incidence_table: Incidence table of the domain to read instead of the domain event table. Defaults to
+        None meaning the domain event table is read
+        :return: dict of the rendered SQL queries with an events key for the query of the distinct concept_id and
+        person_index pairs of the cohort events and a hierarchy key for the query of the ancestor-descendant pairs of
+        the event concepts and their vocabulary ancestors with is_rollup_edge flagging the edges of a transitive
+        reduction of the pairs, which takes the list of event concept ids as its parameter
+        :raises ValueError if concept_type is not invalid
+        """
+        effective_vocab = self.get_effective_vocab(concept_type, vocab)
+        events_template = self.env.get_template("cohort_concept_events_query.sql.j2")
+        hierarchy_template = self.env.get_template("concept_rollup_hierarchy_query.sql.j2")
+        return {
+            "events": events_template.render(
+                db_schema=db_schema,
+                omop=omop_alias,
+                table_name=DOMAIN_MAPPING[concept_type]["table"],
+                concept_id_column=DOMAIN_MAPPING[concept_type]["concept_id"],
+                start_date_column=DOMAIN_MAPPING[concept_type]["start_date"],
+                cid=int(cid),
+                incidence_table=incidence_table,
+            ),
+            "hierarchy": hierarchy_template.render(
+                **self._get_vocab_table_params(omop_alias, vocab_tables),
+                vocab=effective_vocab,
+            ),
+        }
+
+    def build_cohorts_concept_prevalence_query(
+        self,
+        db_schema: str,
+        omop_alias: str,
+        concept_type: str,
+        cids: list,
+        filter_count: int = 0,
+        vocab: str = None,
+        vocab_tables: dict = None,
+        incidence_table: str = None,
+    ) -> str:
+        """
+        Build a SQL query for concept prevalence statistics of multiple cohorts grouped by cohort definition id,
+        which rolls up the concepts of the events of all cohorts to their ancestors in one pass.
+        :param db_schema: BiasDatabase database schema under which all tables are stored.
+        :param omop_alias: OMOP database alias attached to the BiasDataBase in-memory duckdb
+        :param concept_type: Domain from DOMAIN_MAPPING (e.g., 'condition_occurrence').
+        :param cids: List of cohort definition IDs.
+        :param filter_count: Minimum count threshold for concepts in each cohort with 0 meaning no filtering
+        :param vocab: Vocabulary ID. Defaults to domain-specific vocabulary as defined in DOMAIN_MAPPING if set to None
+        :param vocab_tables: dict of the concept_ancestor and concept tables to join instead of the OMOP ones.
+        Defaults to the OMOP vocabulary tables
+        :param incidence_table: Incidence table of the domain to read instead of the domain event table. Defaults to
+        None meaning the domain event table is read
+        :return: The rendered SQL query
+        :raises ValueError if concept_type is not invalid or cids is empty
+        """
+        effective_vocab = self.get_effective_vocab(concept_type, vocab)
+        if not cids:
+            raise ValueError("cids must include at least one cohort definition id")
+        template = self.env.get_template("cohorts_concept_prevalence_query.sql.j2")
+        return template.render(
+            db_schema=db_schema,
+            omop=omop_alias,
+            **self._get_vocab_table_params(omop_alias, vocab_tables),
+            table_name=DOMAIN_MAPPING[concept_type]["table"],
+            concept_id_column=DOMAIN_MAPPING[concept_type]["concept_id"],
+            start_date_column=DOMAIN_MAPPING[concept_type]["start_date"],
+            cids=[int(cid) for cid in cids],
             filter_count=filter_count,
             vocab=effective_vocab,
+            incidence_table=incidence_table,
         )
 
     @staticmethod
@@ -126,13 +384,12 @@ class CohortQueryBuilder:
             return ""
 
         # Handle event_instance, including negative values
-        rank_table = f"ranked_asc_{event['event_type']}"
+        rank_table = f"ranked_{event['event_type']}"
         if "event_instance" in event and event["event_instance"] is not None:
             event_instance = int(event["event_instance"])
             abs_instance = abs(event_instance)
-            if event_instance < 0:
-                rank_table = f"ranked_desc_{event['event_type']}"
-            instance_condition = f" AND event_instance = {abs_instance}"
+            instance_column = "event_instance_desc" if event_instance < 0 else "event_instance_asc"
+            instance_condition = f" AND {instance_column} = {abs_instance}"
         else:
             instance_condition = ""
         # Handle offset for cohort window
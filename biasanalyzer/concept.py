@@ -89,7 +89,7 @@ class ConceptHierarchy:
 
     @classmethod
     def build_concept_hierarchy_from_results(
-        cls, cohort_id: int, concept_type: str, results: List[dict], filter_count=0, vocab=None
+        cls, cohort_id: int, concept_type: str, results: List[dict], filter_count=0, vocab=None, approximate=False
     ):
         """
         build concept hierarchy tree managed by networkx from list of dicts returned from the concept prevalence SQL
@@ -100,43 +100,74 @@ class ConceptHierarchy:
         :param concept_type: concept_type to get concept hierarchy for
         :param filer_count: filter_count to get concept hierarchy for with default value 0 meaning no filtering
         :param vocab: vocab to get concept hierarchy for with default value None meaning default vocab will be used
+        :param approximate: whether results are approximate concept stats, which are cached separately from exact
+        ones, with default value False
         :return: ConceptHierarchy object
         """
         identifer = f"{cohort_id}-{concept_type}-{filter_count}-{vocab}"
+        if approximate:
+            identifer = f"{identifer}-approx"
         if identifer in cls._graph_cache:
             return cls._graph_cache[identifer]
 
-        # node metrics
-        metrics_by_concept = {}
-        node_metadata = {}
+        hierarchy = ConceptHierarchy(cls._build_graph({cohort_id: results}), identifer)
+        cls._graph_cache[identifer] = hierarchy
+        return hierarchy
 
+    @classmethod
+    def build_concept_hierarchy_from_cohorts_results(
+        cls, cohort_ids: List[int], concept_type: str, results: List[dict], filter_count=0, vocab=None
+    ):
+        """
+        build the union concept hierarchy of multiple cohorts from list of dicts returned from the grouped concept
+        prevalence SQL of the cohorts in one pass, which is the same hierarchy with the same identifier as the union
+        of the concept hierarchies of the cohorts built one by one.
+        :param cohort_ids: list of cohort ids to get the union concept hierarchy for
+        :param concept_type: concept_type to get concept hierarchy for
+        :param results: list of dicts from the grouped prevalence SQL with a cohort_definition_id key
+        :param filer_count: filter_count to get concept hierarchy for with default value 0 meaning no filtering
+        :param vocab: vocab to get concept hierarchy for with default value None meaning default vocab will be used
+        :return: ConceptHierarchy object
+        """
+        cohort_ids = list(dict.fromkeys(cohort_ids))
+        identifier = cls._normalize_identifier(
+            "+".join(f"{cohort_id}-{concept_type}-{filter_count}-{vocab}" for cohort_id in cohort_ids)
+        )
+        if identifier in cls._graph_cache:
+            return cls._graph_cache[identifier]
+
+        results_by_cohort = {cohort_id: [] for cohort_id in cohort_ids}
         for row in results:
-            cid = row["descendant_concept_id"]
-            if cid not in node_metadata:
-                node_metadata[cid] = {
-                    "concept_name": row["concept_name"],
-                    "concept_code": row["concept_code"],
-                }
-                metrics_by_concept[cid] = {
-                    "count": row["count_in_cohort"],
-                    "prevalence": row["prevalence"],
-                }
+            results_by_cohort[row["cohort_definition_id"]].append(row)
+        hierarchy = ConceptHierarchy(cls._build_graph(results_by_cohort), identifier)
+        cls._graph_cache[identifier] = hierarchy
+        return hierarchy
 
+    @staticmethod
+    def _build_graph(results_by_cohort: dict) -> nx.DiGraph:
+        """
+        build the concept hierarchy graph with node metrics keyed by cohort id from prevalence SQL results keyed by
+        cohort id, adding the nodes and edges of the cohorts in order as composing the graphs of the cohorts does
+        """
         graph = nx.DiGraph()
         # add nodes with metadata + metrics
-        for cid, meta in node_metadata.items():
-            graph.add_node(cid, **meta, metrics={str(cohort_id): metrics_by_concept[cid]})
+        for cohort_id, results in results_by_cohort.items():
+            for row in results:
+                cid = row["descendant_concept_id"]
+                if cid not in graph:
+                    graph.add_node(cid, concept_name=row["concept_name"], concept_code=row["concept_code"], metrics={})
+                graph.nodes[cid]["metrics"].setdefault(
+                    str(cohort_id), {"count": row["count_in_cohort"], "prevalence": row["prevalence"]}
+                )
 
         # add parent-child edges
-        for row in results:
-            anc = row["ancestor_concept_id"]
-            desc = row["descendant_concept_id"]
-            if anc and desc and anc != desc:
-                graph.add_edge(anc, desc)
-
-        hierarchy = ConceptHierarchy(graph, identifer)
-        cls._graph_cache[identifer] = hierarchy
-        return hierarchy
+        for results in results_by_cohort.values():
+            for row in results:
+                anc = row["ancestor_concept_id"]
+                desc = row["descendant_concept_id"]
+                if anc and desc and anc != desc:
+                    graph.add_edge(anc, desc)
+        return graph
 
     @classmethod
     def clear_cache(cls):
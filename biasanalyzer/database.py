@@ -1,5 +1,11 @@
 # ruff: noqa: S608
 import gc
+import hashlib
+import importlib.util
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
 from datetime import datetime
 from typing import Optional
 
@@ -10,17 +16,203 @@ from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import sessionmaker
 from tqdm.auto import tqdm
 
-from biasanalyzer.models import CohortDefinition
+from biasanalyzer.background.threading_utils import get_cancellation_token, get_worker_scope
+from biasanalyzer.bitmap import rollup_concept_counts
+from biasanalyzer.catalog import OMOPCatalog
+from biasanalyzer.cohort_query_builder import CohortQueryBuilder
+from biasanalyzer.models import DOMAIN_MAPPING, AgeBinSpec, CohortDefinition
 from biasanalyzer.sql import (
     AGE_DISTRIBUTION_QUERY,
     AGE_STATS_QUERY,
+    COHORT_BASIC_STATS_QUERY,
     ETHNICITY_STATS_QUERY,
     GENDER_DISTRIBUTION_QUERY,
     GENDER_STATS_QUERY,
+    PROFILE_QUERY,
     RACE_STATS_QUERY,
+    STRATIFICATION_DIMENSIONS,
+    STRATIFIED_STATS_QUERY,
+    TEMPORAL_DISTRIBUTION_QUERY,
 )
 from biasanalyzer.utils import build_concept_hierarchy, find_roots, notify_users, print_hierarchy
 
+# supported output formats of query results: a list of dicts, a pandas DataFrame, or a pyarrow Table
+OUTPUT_FORMATS = ("records", "df", "arrow")
+
+# supported calendar periods of cohort temporal distributions
+TEMPORAL_GRANULARITIES = ("day", "week", "month", "quarter", "year")
+
+# rank band reported around the median computed by duckdb approx_quantile with t-digest as the approximate 0.48 and
+# 0.52 quantiles. It is an empirical heuristic for typical cohort sizes rather than a guaranteed maximum rank error,
+# since t-digest has no worst-case rank error bound
+APPROX_QUANTILE_RANK_ERROR = 0.02
+# relative standard error 1.04 / sqrt(64) of duckdb approx_count_distinct with its 64-register HyperLogLog
+APPROX_COUNT_DISTINCT_RELATIVE_ERROR = 0.13
+
+# strategies of rolling up cohort concept prevalence to ancestor concepts: joining the cohort events with all of
+# their ancestors in SQL, or ORing person bitmaps of the event concepts up the concept hierarchy
+CONCEPT_STATS_STRATEGIES = ("sql", "bitmap")
+
+
+def _raise_if_cancelled():
+    token = get_cancellation_token()
+    if token is not None:
+        token.raise_if_cancelled()
+
+
+def _validate_output_format(output_format: str):
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Invalid output_format: {output_format}. Must be one of {OUTPUT_FORMATS}")
+    # pyarrow is an optional dependency, so requesting Arrow tables without it fails before any query runs
+    if output_format == "arrow" and importlib.util.find_spec("pyarrow") is None:
+        raise ImportError(
+            'output_format "arrow" requires pyarrow, which can be installed with pip install "biasanalyzer[arrow]"'
+        )
+
+
+def _fetch_results(cursor, output_format="records"):
+    """
+    Fetch the results of a query already executed on a duckdb connection or cursor in the requested format.
+    The query is not re-executed. DataFrames and Arrow tables are fetched in columnar form directly from duckdb,
+    while records are built from the same result set as a thin list-of-dicts view.
+    :param cursor: duckdb connection or cursor on which the query has been executed
+    :param output_format: "records" for a list of dicts, "df" for a pandas DataFrame, or "arrow" for a
+    pyarrow Table which requires pyarrow to be installed
+    :return: query results in the requested format
+    """
+    if output_format == "df":
+        return cursor.df()
+    if output_format == "arrow":
+        return cursor.fetch_arrow_table()
+    headers = [desc[0] for desc in cursor.description]
+    return [dict(zip(headers, row)) for row in cursor.fetchall()]
+
+
+def _records_to_results(records, columns, output_format="records"):
+    """
+    Convert a list of dicts already fetched and reshaped in Python, e.g., sections of a combined query result, to
+    the requested output format
+    """
+    if output_format == "records":
+        return records
+    results_df = pd.DataFrame.from_records(records, columns=columns)
+    if output_format == "arrow":
+        import pyarrow as pa
+
+        return pa.Table.from_pandas(results_df, preserve_index=False)
+    return results_df
+
+
+def _copy_results(results):
+    """
+    Copy cached query results so that callers modifying the returned lists, dicts, or DataFrames in place do not
+    modify the cache. pyarrow Tables are immutable and returned as is.
+    """
+    if isinstance(results, list):
+        return [dict(row) for row in results]
+    if isinstance(results, dict):
+        return {key: _copy_results(value) for key, value in results.items()}
+    if isinstance(results, pd.DataFrame):
+        return results.copy()
+    return results
+
+
+def _empty_results(output_format="records"):
+    if output_format == "df":
+        return pd.DataFrame()
+    if output_format == "arrow":
+        import pyarrow as pa
+
+        return pa.table({})
+    return []
+
+
+class ThreadConnectionManager:
+    """
+    Hand out a duckdb connection to the thread that opened it and a separate cursor on the same database instance
+    to each other thread. A duckdb connection must not be used by multiple threads at the same time, while
+    cursors of one connection share its attached databases and can run queries concurrently. A thread running a task
+    in a worker scope registers its connection or cursor with the cancellation token of the task, so that cancelling
+    the task interrupts its queries, and closes the cursor when the task ends. Once the task is cancelled, getting a
+    connection raises OperationCancelledError, so that the task cannot start another statement.
+    """
+
+    def __init__(self, conn, cursor_init_queries=None):
+        """
+        :param conn: duckdb connection opened by the calling thread
+        :param cursor_init_queries: queries to run on each new cursor to set up its session state, e.g., the
+        default schema, since session state is not shared between cursors
+        """
+        self.conn = conn
+        self.cursor_init_queries = cursor_init_queries or []
+        self._owner_thread_id = threading.get_ident()
+        self._local = threading.local()
+        # cursors keyed by the id of the thread they are handed out to
+        self._cursors = {}
+        self._lock = threading.Lock()
+
+    def get(self):
+        """
+        :return: the connection for the owner thread, or the cursor of the calling thread otherwise
+        :raises OperationCancelledError if the task the calling thread is running has been cancelled
+        """
+        if self.conn is None:
+            return self.conn
+        scope = get_worker_scope()
+        if scope is not None and scope.token is not None:
+            # interrupting a cursor has no effect on the queries it runs later, so cancellation is checked before
+            # handing out the cursor for every statement
+            scope.token.raise_if_cancelled()
+        if threading.get_ident() == self._owner_thread_id:
+            conn = self.conn
+        else:
+            conn = getattr(self._local, "cursor", None)
+            if conn is None:
+                conn = self.conn.cursor()
+                for query in self.cursor_init_queries:
+                    conn.execute(query)
+                self._local.cursor = conn
+                with self._lock:
+                    self._cursors[threading.get_ident()] = conn
+                if scope is not None:
+                    scope.exit_callbacks.append(self.release)
+        if scope is not None and scope.token is not None and id(self) not in scope.registered:
+            # interrupts are keyed on the connection or cursor the task runs its queries on, not on its thread
+            key = scope.token.add_interrupt(conn.interrupt)
+            scope.registered.add(id(self))
+            scope.exit_callbacks.append(lambda: scope.token.remove_interrupt(key))
+        return conn
+
+    def release(self):
+        """
+        Close the cursor of the calling thread, if any, e.g., when a worker thread completes its task
+        """
+        cursor = getattr(self._local, "cursor", None)
+        if cursor is None:
+            return
+        self._local.cursor = None
+        with self._lock:
+            if self._cursors.get(threading.get_ident()) is cursor:
+                del self._cursors[threading.get_ident()]
+        try:
+            cursor.close()
+        except duckdb.Error:  # pragma: no cover
+            pass
+
+    def close_cursors(self):
+        with self._lock:
+            cursors, self._cursors = list(self._cursors.values()), {}
+        for cursor in cursors:
+            try:
+                cursor.close()
+            except duckdb.Error:  # pragma: no cover
+                pass
+
+    def close(self):
+        self.close_cursors()
+        if self.conn:
+            self.conn.close()
+
 
 class BiasDatabase:
     distribution_queries = {
@@ -41,6 +233,23 @@ class BiasDatabase:
             cls._instance._initialize(*args, **kwargs)  # Initialize only once
         return cls._instance
 
+    @property
+    def conn(self):
+        """
+        duckdb connection of the calling thread. Threads other than the one that opened BiasDatabase get their
+        own cursor on the same database so that queries can run from multiple threads concurrently.
+        """
+        connections = getattr(self, "_connections", None)
+        return connections.get() if connections is not None else None
+
+    @conn.setter
+    def conn(self, conn):
+        connections = getattr(self, "_connections", None)
+        if connections is not None:
+            connections.close_cursors()
+        # unqualified names in BiasDatabase queries are resolved against the BiasDatabase schema
+        self._connections = ThreadConnectionManager(conn, [f"SET schema '{self.schema}'"])
+
     def _safe_attach(self, alias: str, url: str, type_clause: str = ""):
         try:
             self.conn.execute(f"DETACH DATABASE {alias}")
@@ -52,18 +261,45 @@ class BiasDatabase:
             self.conn.execute(f"ATTACH '{url}' AS {alias} (READ_ONLY)")
 
     def _initialize(self, db_url, omop_db_url=None):
-        # by default, duckdb uses in memory database
-        self.conn = duckdb.connect(db_url)
+        # by default, duckdb uses in memory database. A database file path can be passed in instead to persist
+        # cohort definitions, cohorts, and derived tables across sessions, in which case an existing database file
+        # is reopened with its id_sequence and cohorts kept
+        self.db_url = db_url
         self.schema = "biasanalyzer"
         self.omop_alias = "omop"
-        self.conn.execute(f"CREATE SCHEMA IF NOT EXISTS {self.schema}")
+        # schema of the OMOP CDM tables in the attached OMOP database, used to resolve unqualified table names
+        self.omop_schema = "main"
         self.omop_cdm_db_url = omop_db_url
-        if omop_db_url is not None:
-            if omop_db_url.startswith("postgresql://"):
+        # cohort stats, profile, and distribution results keyed by cohort definition id, query kind, variable,
+        # age bin spec, and output format. Cohort rows are never updated after a cohort is created, so results are
+        # only invalidated when rows of the cohort are written or deleted
+        self._result_cache = {}
+        # number of writes of each cohort to keep results computed concurrently with a write out of the cache
+        self._cohort_write_counts = {}
+        self._cache_hits = 0
+        self._cache_misses = 0
+        self._cache_lock = threading.Lock()
+        # whether concept prevalence queries read the incidence tables of domains instead of raw domain event tables
+        self.use_incidence_tables = False
+        # names of the local tables derived from OMOP data such as vocabulary copies and incidence tables keyed by
+        # their OMOP data version, so that OMOP data is only scanned once per version
+        self._omop_derived_tables = {}
+        self._omop_derived_lock = threading.Lock()
+        self.omop_catalog = OMOPCatalog(self)
+        self._connect()
+        self._create_cohort_definition_table()
+        self._create_cohort_table()
+
+    def _connect(self):
+        self.conn = duckdb.connect(self.db_url)
+        self.conn.execute(f"CREATE SCHEMA IF NOT EXISTS {self.schema}")
+        if self.omop_cdm_db_url is not None:
+            if self.omop_cdm_db_url.startswith("postgresql://"):
                 # omop db is postgreSQL
                 self.load_postgres_extension()
+                self.omop_schema = "public"
                 self._safe_attach(self.omop_alias, self.omop_cdm_db_url, "(TYPE postgres)")
-            elif omop_db_url.endswith(".duckdb"):
+            elif self.omop_cdm_db_url.endswith(".duckdb"):
                 self._safe_attach(self.omop_alias, self.omop_cdm_db_url)
             else:
                 raise ValueError("Unsupported OMOP database backend")
@@ -71,8 +307,43 @@ class BiasDatabase:
             # Set self.schema as default schema
             self.conn.execute(f"SET schema '{self.schema}'")
 
-        self._create_cohort_definition_table()
-        self._create_cohort_table()
+    @property
+    def is_persistent(self):
+        return bool(self.db_url) and not self.db_url.startswith(":memory:")
+
+    def checkpoint(self, compact=False):
+        """
+        Checkpoint a file-backed BiasDatabase so that all changes are written from the write-ahead log into the
+        database file. Set compact to True to also rewrite the database file to reclaim space left behind by deleted
+        cohorts and derived tables, which exports the database, imports it into a fresh file, and reopens it.
+        :param compact: whether to rewrite the database file to keep it small. Default is False
+        """
+        if not self.is_persistent:
+            notify_users("BiasDatabase is in memory, there is nothing to checkpoint.")
+            return
+        self.conn.execute("FORCE CHECKPOINT")
+        if not compact:
+            notify_users(f"BiasDatabase {self.db_url} checkpointed.")
+            return
+
+        size_before = os.path.getsize(self.db_url)
+        compacted_db_url = f"{self.db_url}.compact"
+        if os.path.exists(compacted_db_url):
+            os.remove(compacted_db_url)
+        with tempfile.TemporaryDirectory() as export_dir:
+            database_name = self.conn.execute("SELECT current_database()").fetchone()[0]
+            self.conn.execute(f"EXPORT DATABASE {database_name} TO '{export_dir}' (FORMAT PARQUET)")
+            self._connections.close()
+            compacted_conn = duckdb.connect(compacted_db_url)
+            try:
+                compacted_conn.execute(f"IMPORT DATABASE '{export_dir}'")
+            finally:
+                compacted_conn.close()
+        os.replace(compacted_db_url, self.db_url)
+        self._connect()
+        notify_users(
+            f"BiasDatabase {self.db_url} compacted from {size_before} bytes to {os.path.getsize(self.db_url)} bytes."
+        )
 
     def _create_cohort_definition_table(self):
         try:
@@ -90,9 +361,12 @@ class BiasDatabase:
                       created_date DATE, 
                       creation_info VARCHAR, 
                       created_by VARCHAR,
+                      fingerprint VARCHAR,
                       PRIMARY KEY (id)
                       )
                 """)
+        # cohort definition tables in database files created before fingerprints were introduced need the column
+        self.conn.execute(f"ALTER TABLE {self.schema}.cohort_definition ADD COLUMN IF NOT EXISTS fingerprint VARCHAR")
         notify_users("Cohort Definition table created.")
 
     def _create_cohort_table(self):
@@ -121,11 +395,63 @@ class BiasDatabase:
         self.conn.execute("INSTALL postgres;")
         self.conn.execute("LOAD postgres;")
 
+    def cache_info(self):
+        """
+        Get the hit and miss counts of the cohort result cache used by get_cohort_basic_stats(),
+        get_cohort_profile(), and get_cohort_distributions(), whose results are cached per cohort and OMOP data version
+        :return: dict with hits, misses, and size, i.e., the number of cached results
+        """
+        with self._cache_lock:
+            return {"hits": self._cache_hits, "misses": self._cache_misses, "size": len(self._result_cache)}
+
+    def clear_cache(self):
+        """
+        Remove all cached cohort results and reset the cache hit and miss counts
+        """
+        with self._cache_lock:
+            self._result_cache.clear()
+            self._cache_hits = 0
+            self._cache_misses = 0
+
+    def invalidate_cohort_cache(self, cohort_definition_id: int):
+        """
+        Remove the cached results of a cohort, which is called whenever rows of the cohort are written or deleted
+        :param cohort_definition_id: cohort definition id of the cohort whose cached results are removed
+        """
+        cohort_definition_id = int(cohort_definition_id)
+        with self._cache_lock:
+            self._cohort_write_counts[cohort_definition_id] = self._cohort_write_counts.get(cohort_definition_id, 0) + 1
+            for key in [key for key in self._result_cache if key[0] == cohort_definition_id]:
+                del self._result_cache[key]
+
+    def _get_cached_cohort_results(self, cache_key: tuple, compute_results):
+        """
+        Get cohort results from the cache, or compute and cache them on a cache miss
+        :param cache_key: tuple starting with the cohort definition id followed by everything the results depend on
+        :param compute_results: function without arguments computing the results on a cache miss
+        :return: a copy of the cached or computed results
+        """
+        # cohort results join OMOP person data, so results of an earlier OMOP data version are not reused
+        cache_key = (cache_key[0], self.omop_catalog.get_data_version(), *cache_key[1:])
+        with self._cache_lock:
+            if cache_key in self._result_cache:
+                self._cache_hits += 1
+                return _copy_results(self._result_cache[cache_key])
+            self._cache_misses += 1
+            write_count = self._cohort_write_counts.get(cache_key[0], 0)
+        results = compute_results()
+        with self._cache_lock:
+            # results computed while the cohort was being written may be stale, so they are not cached
+            if self._cohort_write_counts.get(cache_key[0], 0) == write_count:
+                self._result_cache[cache_key] = results
+        return _copy_results(results)
+
     def create_cohort_definition(self, cohort_definition: CohortDefinition, progress_obj=None):
         self.conn.execute(
             f"""
-            INSERT INTO {self.schema}.cohort_definition (name, description, created_date, creation_info, created_by)
-            VALUES (?, ?, ?, ?, ?)
+            INSERT INTO {self.schema}.cohort_definition (name, description, created_date, creation_info, created_by,
+                                                         fingerprint)
+            VALUES (?, ?, ?, ?, ?, ?)
         """,
             (
                 cohort_definition.name,
@@ -133,6 +459,7 @@ class BiasDatabase:
                 cohort_definition.created_date or datetime.now(),
                 cohort_definition.creation_info,
                 cohort_definition.created_by,
+                cohort_definition.fingerprint,
             ),
         )
         if progress_obj is None:
@@ -144,6 +471,22 @@ class BiasDatabase:
         return created_cohort_id
 
     # Method to insert cohort data in bulk from a dataframe
+    @contextmanager
+    def transaction(self):
+        """
+        Run the BiasDatabase statements of the with block in one transaction, which is committed when the block
+        completes and rolled back when it raises, e.g., because the operation running it was cancelled
+        """
+        conn = self.conn
+        conn.execute("BEGIN TRANSACTION")
+        try:
+            yield
+            _raise_if_cancelled()
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
     def create_cohort_in_bulk(self, cohort_df: pd.DataFrame):
         # make duckdb to treat cohort_df dataframe as a virtual table named "cohort_df"
         self.conn.register("cohort_df", cohort_df)
@@ -151,11 +494,101 @@ class BiasDatabase:
             INSERT INTO {self.schema}.cohort (subject_id, cohort_definition_id, cohort_start_date, cohort_end_date)
             SELECT subject_id, cohort_definition_id, cohort_start_date, cohort_end_date FROM cohort_df
         """)
+        for cohort_definition_id in cohort_df["cohort_definition_id"].unique():
+            self.invalidate_cohort_cache(cohort_definition_id)
+
+    def create_cohort_from_query(self, cohort_definition: CohortDefinition, query: str, progress_obj=None):
+        """
+        Create a cohort in-engine by running the cohort query against the attached OMOP database and inserting
+        its results into the cohort table with a single INSERT ... SELECT statement, so that cohort rows never
+        leave duckdb. The cohort definition and its cohort rows are written in one transaction.
+        :param cohort_definition: CohortDefinition object of the cohort to create
+        :param query: cohort SQL query written against unqualified OMOP CDM table names and returning
+        person_id, cohort_start_date, and cohort_end_date columns
+        :param progress_obj: optional tqdm object to write progress messages to
+        :return: the created cohort definition id, or None if the query returns no rows
+        """
+        if self.omop_cdm_db_url is None:
+            raise ValueError("An OMOP CDM database must be attached to BiasDatabase to create cohorts in-engine")
+
+        cohort_query = query.strip().rstrip(";")
+        # the cohort table is fully qualified since unqualified names are resolved against OMOP tables below
+        # the transaction is rolled back on the same connection even if the operation is cancelled meanwhile
+        conn = self.conn
+        catalog = conn.execute("SELECT current_database()").fetchone()[0]
+        conn.execute("BEGIN TRANSACTION")
+        try:
+            cohort_def_id = self.create_cohort_definition(cohort_definition, progress_obj=progress_obj)
+            self.conn.execute(f"SET search_path = '{self.omop_alias}.{self.omop_schema}'")
+            try:
+                inserted_count = self.conn.execute(f"""
+                    INSERT INTO {catalog}.{self.schema}.cohort 
+                        (subject_id, cohort_definition_id, cohort_start_date, cohort_end_date)
+                    SELECT person_id, {cohort_def_id}, cohort_start_date, cohort_end_date 
+                    FROM ({cohort_query}) AS cohort_query
+                """).fetchone()[0]
+            finally:
+                conn.execute("RESET search_path")
+                conn.execute(f"SET schema '{self.schema}'")
+            _raise_if_cancelled()
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        if inserted_count == 0:
+            # do not keep a cohort definition without any cohort data
+            conn.execute("ROLLBACK")
+            return None
+        conn.execute("COMMIT")
+        self.invalidate_cohort_cache(cohort_def_id)
+        return cohort_def_id
+
+    def delete_cohort(self, cohort_definition_id: int):
+        """
+        Delete a cohort definition and all its cohort rows
+        :param cohort_definition_id: cohort definition id of the cohort to delete
+        :return: True if the cohort definition existed and is deleted, False otherwise
+        """
+        cohort_definition_id = int(cohort_definition_id)
+        try:
+            # duckdb checks foreign keys against rows deleted in the same transaction, so the cohort rows are
+            # deleted and committed before their cohort definition
+            self.conn.execute(
+                f"DELETE FROM {self.schema}.cohort WHERE cohort_definition_id = ?", (cohort_definition_id,)
+            )
+            deleted_count = self.conn.execute(
+                f"DELETE FROM {self.schema}.cohort_definition WHERE id = ?", (cohort_definition_id,)
+            ).fetchone()[0]
+        finally:
+            self.invalidate_cohort_cache(cohort_definition_id)
+        return deleted_count > 0
+
+    def create_temp_tables_from_queries(self, table_queries: dict):
+        """
+        Materialize query results against the attached OMOP database into temporary tables, which are visible to
+        queries run by create_cohort_from_query() under their unqualified names until they are dropped
+        :param table_queries: dict of temporary table name to the SQL query written against unqualified OMOP CDM
+        table names to materialize into it
+        """
+        if self.omop_cdm_db_url is None:
+            raise ValueError("An OMOP CDM database must be attached to BiasDatabase to create cohorts in-engine")
+
+        self.conn.execute(f"SET search_path = '{self.omop_alias}.{self.omop_schema}'")
+        try:
+            for table_name, query in table_queries.items():
+                self.conn.execute(f"CREATE OR REPLACE TEMP TABLE {table_name} AS {query}")
+        finally:
+            self.conn.execute("RESET search_path")
+            self.conn.execute(f"SET schema '{self.schema}'")
+
+    def drop_temp_tables(self, table_names):
+        for table_name in table_names:
+            self.conn.execute(f"DROP TABLE IF EXISTS temp.main.{table_name}")
 
     def get_cohort_definition(self, cohort_definition_id):
         results = self.conn.execute(f"""
-        SELECT id, name, description, created_date, creation_info, created_by FROM {self.schema}.cohort_definition 
-        WHERE id = {cohort_definition_id} 
+        SELECT id, name, description, created_date, creation_info, created_by, fingerprint 
+        FROM {self.schema}.cohort_definition WHERE id = {cohort_definition_id} 
         """)
         headers = [desc[0] for desc in results.description]
         row = results.fetchall()
@@ -164,97 +597,769 @@ class BiasDatabase:
         else:
             return dict(zip(headers, row[0]))
 
-    def get_cohort(self, cohort_definition_id):
-        results = self.conn.execute(f"""
+    def find_cohort_by_fingerprint(self, fingerprint: str):
+        """
+        Find an existing cohort with cohort data materialized from a cohort definition with the given fingerprint
+        :param fingerprint: cohort definition fingerprint computed by utils.compute_cohort_fingerprint
+        :return: cohort definition id of the most recently created matching cohort, or None if there is none
+        """
+        row = self.conn.execute(
+            f"""
+            SELECT cd.id FROM {self.schema}.cohort_definition cd
+            WHERE cd.fingerprint = ?
+            AND EXISTS (SELECT 1 FROM {self.schema}.cohort c WHERE c.cohort_definition_id = cd.id)
+            ORDER BY cd.id DESC LIMIT 1
+        """,
+            [fingerprint],
+        ).fetchone()
+        return row[0] if row else None
+
+    def get_omop_data_version(self):
+        """
+        Get a token identifying the version of the data in the attached OMOP database, which is used to tell
+        whether results derived from OMOP data such as cohorts are still valid. The cdm_source table is used when it
+        is populated. Otherwise, the modification time and size of a duckdb OMOP database file are used, and the
+        person row count is used as a last resort for a postgreSQL OMOP database. Concept statistics use the token
+        cached by omop_catalog.get_data_version() instead of looking it up on every call.
+        :return: OMOP data version token string, or None if no OMOP database is attached
+        """
+        if self.omop_cdm_db_url is None:
+            return None
+        try:
+            cdm_sources = self.conn.execute(f"""
+                SELECT cdm_source_name, cdm_version, cdm_release_date, vocabulary_version
+                FROM {self.omop_alias}.cdm_source ORDER BY ALL
+            """).fetchall()
+        except duckdb.Error:
+            cdm_sources = []
+        if cdm_sources:
+            return "cdm_source:" + ";".join("|".join(str(v) for v in row) for row in cdm_sources)
+        if self.omop_cdm_db_url.endswith(".duckdb"):
+            # the write-ahead log holds changes not yet checkpointed into the database file
+            db_files = [self.omop_cdm_db_url, f"{self.omop_cdm_db_url}.wal"]
+            stats = [os.stat(f) for f in db_files if os.path.exists(f)]
+            return "file:" + ";".join(f"{st.st_mtime_ns}-{st.st_size}" for st in stats)
+        person_count = self.conn.execute(f"SELECT COUNT(*) FROM {self.omop_alias}.person").fetchone()[0]
+        return f"person_count:{person_count}"
+
+    def get_cohort_definitions(self):
+        """
+        Get all cohort definitions stored in BiasDatabase, which includes cohorts created in previous sessions
+        when BiasDatabase is file-backed.
+        :return: list of cohort definition dicts ordered by cohort definition id
+        """
+        return self._execute_query(f"""
+        SELECT id, name, description, created_date, creation_info, created_by, fingerprint 
+        FROM {self.schema}.cohort_definition ORDER BY id
+        """)
+
+    def get_cohort(self, cohort_definition_id, output_format="records"):
+        """
+        Get cohort data of a cohort from the cohort table.
+        :param cohort_definition_id: cohort definition id representing the cohort
+        :param output_format: "records" (default) for a list of dicts, "df" for a pandas DataFrame,
+        or "arrow" for a pyarrow Table
+        :return: cohort data in the requested format
+        """
+        return self._execute_query(
+            f"""
         SELECT subject_id, cohort_definition_id, cohort_start_date, cohort_end_date FROM {self.schema}.cohort 
         WHERE cohort_definition_id = {cohort_definition_id}
-        """)
-        headers = [desc[0] for desc in results.description]
-        rows = results.fetchall()
-        return [dict(zip(headers, row)) for row in rows]
+        """,
+            output_format=output_format,
+        )
 
-    def _execute_query(self, query_str):
-        results = self.conn.execute(query_str)
+    def _execute_query(self, query_str, output_format="records"):
+        _validate_output_format(output_format)
+        return _fetch_results(self.conn.execute(query_str), output_format)
 
-        headers = [desc[0] for desc in results.description]
-        rows = results.fetchall()
-        return [dict(zip(headers, row)) for row in rows]
+    def _format_cohorts_query(self, query_str: str, cohort_definition_ids, **query_params):
+        cohort_definition_ids = sorted({int(cid) for cid in cohort_definition_ids})
+        if not cohort_definition_ids:
+            raise ValueError("At least one cohort definition id must be provided")
+        return query_str.format(
+            ba_schema=self.schema,
+            omop=self.omop_alias,
+            cohort_definition_ids=", ".join(str(cid) for cid in cohort_definition_ids),
+            **query_params,
+        )
+
+    def _get_stats_query(self, variable: str):
+        if not variable:
+            return COHORT_BASIC_STATS_QUERY
+        query_str = self.__class__.stats_queries.get(variable)
+        if query_str is None:
+            raise ValueError(
+                f"Statistics for variable '{variable}' is not available. "
+                f"Valid variables are {self.__class__.stats_queries.keys()}"
+            )
+        return query_str
+
+    def _get_distribution_query(self, variable: str):
+        query_str = self.__class__.distribution_queries.get(variable)
+        if not query_str:
+            raise ValueError(
+                f"Distribution for variable '{variable}' is not available. "
+                f"Valid variables are {self.__class__.distribution_queries.keys()}"
+            )
+        return query_str
+
+    @staticmethod
+    def _get_age_bin_params(age_bins=None):
+        """
+        Get the age distribution query parameters of an age bin spec
+        :param age_bins: AgeBinSpec object or a dict of its fields, default is None meaning the decade age bins
+        :return: dict of age_bin_index, age_bins, age_bin_labels, and max_age query parameters
+        """
+        if age_bins is None:
+            age_bins = AgeBinSpec()
+        elif isinstance(age_bins, dict):
+            age_bins = AgeBinSpec(**age_bins)
+        return {
+            "age_bin_index": age_bins.get_bin_index_sql(),
+            "age_bins": ", ".join(f"({idx}, '{label}')" for idx, label in enumerate(age_bins.get_labels())),
+            "age_bin_labels": ", ".join(f"'{label}'" for label in age_bins.get_labels()),
+            "max_age": age_bins.max_age,
+        }
+
+    def _get_person_columns(self):
+        rows = self.conn.execute(
+            "SELECT column_name FROM duckdb_columns() "
+            "WHERE database_name = ? AND schema_name = ? AND table_name = 'person' ORDER BY column_index",
+            (self.omop_alias, self.omop_schema),
+        ).fetchall()
+        return [row[0] for row in rows]
 
-    def get_cohort_basic_stats(self, cohort_definition_id: int, variable=""):
+    def _get_stratified_stats_params(self, dimensions, grouping_sets=None, age_bins=None):
+        """
+        Get the query parameters of STRATIFIED_STATS_QUERY for the requested stratification dimensions
+        :param dimensions: list of dimension names, each either a key of STRATIFICATION_DIMENSIONS or an OMOP person
+        column name
+        :param grouping_sets: list of lists of dimensions to cross-tabulate, which together include all dimensions,
+        default is None meaning all combinations of the dimensions with CUBE
+        :param age_bins: AgeBinSpec object or a dict of its fields defining the age_bin dimension
+        :return: dict of dimensions, dimension_columns, dimensions_label, grouping, and dimensions_order query
+        parameters
+        """
+        dimensions = list(dict.fromkeys(dimensions or []))
+        if not dimensions:
+            raise ValueError("At least one stratification dimension must be provided")
+        person_columns = None
+        dimension_columns = []
+        for dimension in dimensions:
+            if dimension == "age_bin":
+                expression = STRATIFICATION_DIMENSIONS[dimension].format(**self._get_age_bin_params(age_bins))
+            elif dimension in STRATIFICATION_DIMENSIONS:
+                expression = STRATIFICATION_DIMENSIONS[dimension]
+            else:
+                if person_columns is None:
+                    person_columns = self._get_person_columns()
+                if dimension not in person_columns:
+                    raise ValueError(
+                        f"Stratification dimension '{dimension}' is not available. Valid dimensions are "
+                        f"{list(STRATIFICATION_DIMENSIONS.keys())} and the OMOP person columns {person_columns}"
+                    )
+                expression = f'"{dimension}"'
+            dimension_columns.append(f'{expression} AS "{dimension}"')
+
+        quoted_dimensions = {dimension: f'"{dimension}"' for dimension in dimensions}
+        if grouping_sets is None:
+            grouping = f"CUBE({', '.join(quoted_dimensions.values())})"
+        else:
+            grouping_dimensions = {dim for grouping_set in grouping_sets for dim in grouping_set}
+            invalid_dimensions = grouping_dimensions - set(dimensions)
+            if invalid_dimensions:
+                raise ValueError(f"Grouping sets dimensions {sorted(invalid_dimensions)} are not in {dimensions}")
+            ungrouped_dimensions = [dim for dim in dimensions if dim not in grouping_dimensions]
+            if ungrouped_dimensions:
+                raise ValueError(f"Dimensions {ungrouped_dimensions} are not in any of the grouping sets")
+            sets_sql = [", ".join(quoted_dimensions[dim] for dim in grouping_set) for grouping_set in grouping_sets]
+            grouping = f"GROUPING SETS ({', '.join(f'({set_sql})' for set_sql in sets_sql)})"
+        dimension_labels = [f"CASE WHEN GROUPING({qd}) = 0 THEN '{dim}' END" for dim, qd in quoted_dimensions.items()]
+        return {
+            "dimensions": ", ".join(quoted_dimensions.values()),
+            "dimension_columns": ", ".join(dimension_columns),
+            "dimensions_label": f"concat_ws(',', {', '.join(dimension_labels)})",
+            "grouping": grouping,
+            "dimensions_order": ", ".join(f"{qd} NULLS FIRST" for qd in quoted_dimensions.values()),
+        }
+
+    @staticmethod
+    def _get_median_params(approximate=False):
+        """
+        Get the median column query parameters of the basic and age stats queries
+        :param approximate: if True, medians are computed with approx_quantile along with <median>_lower and
+        <median>_upper columns of the heuristic rank band around the approximate median. Otherwise, medians are exact
+        :return: dict of median_duration and median_age query parameters
+        """
+
+        def get_median_columns(value_column, median_column):
+            if not approximate:
+                return f"CAST(PERCENTILE_CONT(0.5) WITHIN GROUP (ORDER BY {value_column}) AS INT) AS {median_column}"
+            return (
+                f"CAST(approx_quantile({value_column}, 0.5) AS INT) AS {median_column}, "
+                f"CAST(approx_quantile({value_column}, {0.5 - APPROX_QUANTILE_RANK_ERROR}) AS INT) "
+                f"AS {median_column}_lower, "
+                f"CAST(approx_quantile({value_column}, {0.5 + APPROX_QUANTILE_RANK_ERROR}) AS INT) "
+                f"AS {median_column}_upper"
+            )
+
+        return {
+            "median_duration": get_median_columns("cd.duration_days", "median_duration"),
+            "median_age": get_median_columns("ac.age", "median_age"),
+        }
+
+    def _execute_single_cohort_query(
+        self, query_str: str, cohort_definition_id: int, output_format="records", **query_params
+    ):
+        """
+        Run a cohorts query grouped by cohort_definition_id for a single cohort without the cohort_definition_id
+        column in the results
+        """
+        query = self._format_cohorts_query(query_str, [cohort_definition_id], **query_params)
+        results = self._execute_query(query, output_format=output_format)
+        if output_format == "records":
+            return [{k: v for k, v in row.items() if k != "cohort_definition_id"} for row in results]
+        if output_format == "arrow":
+            return results.drop(["cohort_definition_id"])
+        return results.drop(columns=["cohort_definition_id"])
+
+    def get_cohort_basic_stats(
+        self, cohort_definition_id: int, variable="", output_format="records", approximate=False
+    ):
         """
         Get aggregation statistics for a cohort from the cohort table.
         :param cohort_definition_id: cohort definition id representing the cohort
         :param variable: optional with an empty string as default. If empty, basic stats of
         the cohort are returned; If set to a specific variable such as age, gender, race,
         the stats of the specified variable in the cohort are returned
+        :param output_format: "records" (default) for a list of dicts, "df" for a pandas DataFrame,
+        or "arrow" for a pyarrow Table
+        :param approximate: if True, medians of very large cohorts are estimated with approx_quantile, and each
+        approximate median column is followed by <median>_lower and <median>_upper columns of a heuristic rank band
+        around the median. Default is False for exact statistics
         :return: cohort stats corresponding to the specified variable
         """
+        _validate_output_format(output_format)
         try:
-            if variable:
-                query_str = self.__class__.stats_queries.get(variable)
-                if query_str is None:
-                    raise ValueError(
-                        f"Statistics for variable '{variable}' is not available. "
-                        f"Valid variables are {self.__class__.stats_queries.keys()}"
-                    )
-                stats_query = query_str.format(
-                    ba_schema=self.schema, omop=self.omop_alias, cohort_definition_id=cohort_definition_id
-                )
-            else:
-                # Query the cohort data to get basic statistics
-                stats_query = f"""
-                    WITH cohort_Duration AS (
-                        SELECT
-                            subject_id,
-                            cohort_start_date,
-                            cohort_end_date,
-                            cohort_end_date - cohort_start_date AS duration_days
-                        FROM
-                            {self.schema}.cohort
-                        WHERE cohort_definition_id = {cohort_definition_id}    
-                    )
-                    SELECT
-                        COUNT(*) AS total_count,
-                        MIN(cohort_start_date) AS earliest_start_date,
-                        MAX(cohort_start_date) AS latest_start_date,
-                        MIN(cohort_end_date) AS earliest_end_date,
-                        MAX(cohort_end_date) AS latest_end_date,
-                        MIN(duration_days) AS min_duration_days,
-                        MAX(duration_days) AS max_duration_days,
-                        ROUND(AVG(duration_days), 2) AS avg_duration_days,
-                        CAST(PERCENTILE_CONT(0.5) WITHIN GROUP (ORDER BY duration_days) AS INT) AS median_duration,
-                        ROUND(STDDEV(duration_days), 2) AS stddev_duration
-                    FROM cohort_Duration                    
-                """
-            return self._execute_query(stats_query)
-
+            query_str = self._get_stats_query(variable)
+            return self._get_cached_cohort_results(
+                (int(cohort_definition_id), "stats", variable, bool(approximate), output_format),
+                lambda: self._execute_single_cohort_query(
+                    query_str, cohort_definition_id, output_format=output_format, **self._get_median_params(approximate)
+                ),
+            )
         except Exception as e:
             notify_users(f"Error computing cohort basic statistics: {e}", level="error")
             return None
 
+    def get_cohorts_basic_stats(self, cohort_definition_ids, variable="", output_format="df", approximate=False):
+        """
+        Get aggregation statistics for multiple cohorts in one query grouped by cohort, e.g., for showing many
+        cohorts side by side, instead of calling get_cohort_basic_stats() for each cohort.
+        :param cohort_definition_ids: list of cohort definition ids representing the cohorts
+        :param variable: optional with an empty string as default. If empty, basic stats of the cohorts are
+        returned; If set to a specific variable such as age, gender, race, the stats of the specified variable
+        in the cohorts are returned
+        :param output_format: "df" (default) for a pandas DataFrame, "records" for a list of dicts,
+        or "arrow" for a pyarrow Table
+        :param approximate: if True, medians are estimated with error bounds as in get_cohort_basic_stats()
+        :return: cohort stats in tidy form with a cohort_definition_id column followed by the same columns as
+        returned by get_cohort_basic_stats(), with one row per cohort or per cohort and variable category
+        """
+        _validate_output_format(output_format)
+        try:
+            query = self._format_cohorts_query(
+                self._get_stats_query(variable), cohort_definition_ids, **self._get_median_params(approximate)
+            )
+            return self._execute_query(query, output_format=output_format)
+        except Exception as e:
+            notify_users(f"Error computing cohorts basic statistics: {e}", level="error")
+            return None
+
+    def get_cohort_profile(self, cohort_definition_id: int, output_format="records"):
+        """
+        Get basic, age, gender, race, and ethnicity statistics of a cohort from a single scan of the cohort rows
+        joined with OMOP person rows using grouping sets, instead of joining the cohort to the person table again
+        for each variable as get_cohort_basic_stats() does
+        :param cohort_definition_id: cohort definition id representing the cohort
+        :param output_format: "records" (default) for a list of dicts, "df" for a pandas DataFrame,
+        or "arrow" for a pyarrow Table for the statistics of each variable
+        :return: dict keyed by basic, age, gender, race, and ethnicity with the same statistics as returned by
+        get_cohort_basic_stats() for each variable, or None if the statistics cannot be computed
+        """
+        _validate_output_format(output_format)
+        try:
+            return self._get_cached_cohort_results(
+                (int(cohort_definition_id), "profile", None, None, output_format),
+                lambda: self._compute_cohort_profile(cohort_definition_id, output_format),
+            )
+        except Exception as e:
+            notify_users(f"Error computing cohort profile: {e}", level="error")
+            return None
+
+    def _compute_cohort_profile(self, cohort_definition_id: int, output_format="records"):
+        profile_query = PROFILE_QUERY.format(
+            ba_schema=self.schema, omop=self.omop_alias, cohort_definition_id=cohort_definition_id
+        )
+        profile_rows = _fetch_results(self.conn.execute(profile_query))
+
+        # the grouping set over all cohort rows always has exactly one row, even for an empty cohort
+        overall = next(row for row in profile_rows if row["grouping_id"] == 7)
+        basic_columns = [
+            "total_count",
+            "earliest_start_date",
+            "latest_start_date",
+            "earliest_end_date",
+            "latest_end_date",
+            "min_duration_days",
+            "max_duration_days",
+            "avg_duration_days",
+            "median_duration",
+            "stddev_duration",
+        ]
+        age_columns = ["total_count", "min_age", "max_age", "avg_age", "median_age", "stddev_age"]
+        profile = {
+            "basic": _records_to_results([{col: overall[col] for col in basic_columns}], basic_columns, output_format),
+            "age": _records_to_results(
+                [{**{col: overall[col] for col in age_columns}, "total_count": overall["person_count"]}],
+                age_columns,
+                output_format,
+            ),
+        }
+        for variable, grouping_id in (("gender", 3), ("race", 5), ("ethnicity", 6)):
+            columns = [variable, f"{variable}_count", "probability"]
+            # groups made up of cohort rows without a matching person only are not part of the variable stats
+            records = [
+                {variable: row[variable], f"{variable}_count": row["person_count"], "probability": row["probability"]}
+                for row in profile_rows
+                if row["grouping_id"] == grouping_id and row["person_count"] > 0
+            ]
+            profile[variable] = _records_to_results(records, columns, output_format)
+        return profile
+
     @property
     def cohort_distribution_variables(self):
         return self.__class__.distribution_queries.keys()
 
-    def get_cohort_distributions(self, cohort_definition_id: int, variable: str):
+    def get_cohort_distributions(
+        self, cohort_definition_id: int, variable: str, output_format="records", age_bins=None
+    ):
         """
         Get distribution statistics for a cohort from the cohort table.
+        :param output_format: "records" (default) for a list of dicts, "df" for a pandas DataFrame,
+        or "arrow" for a pyarrow Table
+        :param age_bins: AgeBinSpec object or a dict of its fields defining the bins of the age distribution,
+        default is None meaning the decade age bins 0-10, 11-20, ..., 81-90, 91+
         """
+        _validate_output_format(output_format)
         try:
-            query_str = self.__class__.distribution_queries.get(variable)
-            if not query_str:
-                raise ValueError(
-                    f"Distribution for variable '{variable}' is not available. "
-                    f"Valid variables are {self.__class__.distribution_queries.keys()}"
-                )
-            query = query_str.format(
-                ba_schema=self.schema, omop=self.omop_alias, cohort_definition_id=cohort_definition_id
+            query_str = self._get_distribution_query(variable)
+            age_bin_params = self._get_age_bin_params(age_bins)
+            # only the age distribution depends on the age bin spec
+            bin_spec = tuple(age_bin_params.items()) if variable == "age" else None
+            return self._get_cached_cohort_results(
+                (int(cohort_definition_id), "distributions", variable, bin_spec, output_format),
+                lambda: self._execute_single_cohort_query(
+                    query_str, cohort_definition_id, output_format=output_format, **age_bin_params
+                ),
             )
-            return self._execute_query(query)
         except Exception as e:
             notify_users(f"Error computing cohort {variable} distributions: {e}", level="error")
             return None
 
+    def get_cohorts_distributions(self, cohort_definition_ids, variable: str, output_format="df", age_bins=None):
+        """
+        Get distribution statistics of a variable such as age or gender for multiple cohorts in one query grouped
+        by cohort instead of calling get_cohort_distributions() for each cohort.
+        :param cohort_definition_ids: list of cohort definition ids representing the cohorts
+        :param variable: variable to get the distribution of as listed in cohort_distribution_variables
+        :param output_format: "df" (default) for a pandas DataFrame, "records" for a list of dicts,
+        or "arrow" for a pyarrow Table
+        :param age_bins: AgeBinSpec object or a dict of its fields defining the bins of the age distribution,
+        default is None meaning the decade age bins
+        :return: distributions in tidy form with a cohort_definition_id column followed by the same columns as
+        returned by get_cohort_distributions(), with one row per cohort and distribution bin
+        """
+        _validate_output_format(output_format)
+        try:
+            query = self._format_cohorts_query(
+                self._get_distribution_query(variable), cohort_definition_ids, **self._get_age_bin_params(age_bins)
+            )
+            return self._execute_query(query, output_format=output_format)
+        except Exception as e:
+            notify_users(f"Error computing cohorts {variable} distributions: {e}", level="error")
+            return None
+
+    def get_cohort_stratified_stats(
+        self, cohort_definition_id: int, dimensions, grouping_sets=None, age_bins=None, output_format="records"
+    ):
+        """
+        Get the number of persons in each stratum of cross-tabulations of person attributes in a cohort computed in
+        one pass over the cohort with GROUP BY CUBE or GROUPING SETS
+        :param cohort_definition_id: cohort definition id representing the cohort
+        :param dimensions: list of dimensions to stratify by, i.e., age_bin, gender, race, ethnicity, birth_decade, or
+        any OMOP person column such as location_id
+        :param grouping_sets: list of lists of dimensions to cross-tabulate, e.g., [["gender"], ["gender", "race"]],
+        default is None meaning all combinations of the dimensions including the whole cohort
+        :param age_bins: AgeBinSpec object or a dict of its fields defining the age_bin dimension, default is None
+        meaning the decade age bins. Persons with ages outside the age bins have a NULL age_bin
+        :param output_format: "records" (default) for a list of dicts, "df" for a pandas DataFrame,
+        or "arrow" for a pyarrow Table
+        :return: one row per stratum with a dimensions column listing the dimensions grouped by comma-separated in
+        the order of the dimensions parameter, a column per dimension which is NULL for dimensions not grouped by,
+        person_count, and probability of the stratum in the cohort. Only strata with persons are returned
+        """
+        _validate_output_format(output_format)
+        try:
+            query_params = self._get_stratified_stats_params(dimensions, grouping_sets=grouping_sets, age_bins=age_bins)
+            return self._get_cached_cohort_results(
+                (int(cohort_definition_id), "stratified", tuple(query_params.items()), None, output_format),
+                lambda: self._execute_single_cohort_query(
+                    STRATIFIED_STATS_QUERY, cohort_definition_id, output_format=output_format, **query_params
+                ),
+            )
+        except Exception as e:
+            notify_users(f"Error computing cohort stratified statistics: {e}", level="error")
+            return None
+
+    def get_cohorts_stratified_stats(
+        self, cohort_definition_ids, dimensions, grouping_sets=None, age_bins=None, output_format="df"
+    ):
+        """
+        Get stratified statistics of multiple cohorts in one query grouped by cohort instead of calling
+        get_cohort_stratified_stats() for each cohort.
+        :param cohort_definition_ids: list of cohort definition ids representing the cohorts
+        :param dimensions: list of dimensions to stratify by as in get_cohort_stratified_stats()
+        :param grouping_sets: list of lists of dimensions to cross-tabulate, default is None meaning all combinations
+        :param age_bins: AgeBinSpec object or a dict of its fields defining the age_bin dimension
+        :param output_format: "df" (default) for a pandas DataFrame, "records" for a list of dicts,
+        or "arrow" for a pyarrow Table
+        :return: stratified stats in tidy form with a cohort_definition_id column followed by the same columns as
+        returned by get_cohort_stratified_stats()
+        """
+        _validate_output_format(output_format)
+        try:
+            query = self._format_cohorts_query(
+                STRATIFIED_STATS_QUERY,
+                cohort_definition_ids,
+                **self._get_stratified_stats_params(dimensions, grouping_sets=grouping_sets, age_bins=age_bins),
+            )
+            return self._execute_query(query, output_format=output_format)
+        except Exception as e:
+            notify_users(f"Error computing cohorts stratified statistics: {e}", level="error")
+            return None
+
+    @staticmethod
+    def _get_temporal_params(granularity: str):
+        if granularity not in TEMPORAL_GRANULARITIES:
+            raise ValueError(f"Invalid granularity: {granularity}. Must be one of {TEMPORAL_GRANULARITIES}")
+        return {"granularity": granularity}
+
+    def get_cohort_temporal_distribution(
+        self, cohort_definition_id: int, granularity: str = "month", output_format="records"
+    ):
+        """
+        Get the number of cohort entries in each calendar period of cohort_start_date aggregated in duckdb
+        :param cohort_definition_id: cohort definition id representing the cohort
+        :param granularity: calendar period to count entries by, i.e., day, week, month (default), quarter, or year
+        :param output_format: "records" (default) for a list of dicts, "df" for a pandas DataFrame,
+        or "arrow" for a pyarrow Table
+        :return: one row per period from the earliest to the latest cohort entry with period, i.e., the first date of
+        the period, entry_count, and probability columns, where periods without entries have zero counts
+        """
+        _validate_output_format(output_format)
+        try:
+            query_params = self._get_temporal_params(granularity)
+            return self._get_cached_cohort_results(
+                (int(cohort_definition_id), "temporal", granularity, None, output_format),
+                lambda: self._execute_single_cohort_query(
+                    TEMPORAL_DISTRIBUTION_QUERY, cohort_definition_id, output_format=output_format, **query_params
+                ),
+            )
+        except Exception as e:
+            notify_users(f"Error computing cohort temporal distribution: {e}", level="error")
+            return None
+
+    def get_cohorts_temporal_distribution(self, cohort_definition_ids, granularity: str = "month", output_format="df"):
+        """
+        Get the temporal distributions of cohort entries of multiple cohorts in one query grouped by cohort instead
+        of calling get_cohort_temporal_distribution() for each cohort. All cohorts share the same periods from the
+        earliest to the latest entry of any of the cohorts.
+        :param cohort_definition_ids: list of cohort definition ids representing the cohorts
+        :param granularity: calendar period to count entries by, i.e., day, week, month (default), quarter, or year
+        :param output_format: "df" (default) for a pandas DataFrame, "records" for a list of dicts,
+        or "arrow" for a pyarrow Table
+        :return: temporal distributions in tidy form with a cohort_definition_id column followed by the same columns
+        as returned by get_cohort_temporal_distribution()
+        """
+        _validate_output_format(output_format)
+        try:
+            query = self._format_cohorts_query(
+                TEMPORAL_DISTRIBUTION_QUERY, cohort_definition_ids, **self._get_temporal_params(granularity)
+            )
+            return self._execute_query(query, output_format=output_format)
+        except Exception as e:
+            notify_users(f"Error computing cohorts temporal distribution: {e}", level="error")
+            return None
+
+    def _validate_vocab(self, vocab, omop_version=None):
+        # validate input vocab if it is not None
+        if vocab is not None:
+            if not self.omop_catalog.is_valid_vocabulary(vocab, omop_version):
+                valid_vocab_ids = self.omop_catalog.get_vocabularies(omop_version)
+                err_msg = (
+                    f"input {vocab} is not a valid vocabulary in OMOP. Supported vocabulary ids are: {valid_vocab_ids}"
+                )
+                notify_users(err_msg, level="error")
+                raise ValueError(err_msg)
+
+    def _get_omop_derived_tables(self, table_queries: dict, omop_version, description: str):
+        """
+        Get tables derived from OMOP data, which are built from their queries on first use and kept in BiasDatabase
+        keyed by the OMOP data version they were built from, so a file-backed BiasDatabase keeps them across sessions
+        until the OMOP data version changes.
+        :param table_queries: dict of qualified table names to tuples of their SELECT query and query parameters in
+        the order the tables are built
+        :param omop_version: OMOP data version token from get_omop_data_version()
+        :param description: description of the tables in the message notified when they are built
+        :return: list of the qualified table names
+        """
+        table_names = list(table_queries)
+        cache_key = (tuple(table_names), omop_version)
+        with self._omop_derived_lock:
+            if cache_key in self._omop_derived_tables:
+                return self._omop_derived_tables[cache_key]
+            self.conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {self.schema}.omop_derived_table (
+                    table_name VARCHAR PRIMARY KEY,
+                    omop_version VARCHAR
+                )
+            """)
+            built_versions = dict(
+                self.conn.execute(
+                    f"SELECT table_name, omop_version FROM {self.schema}.omop_derived_table "
+                    f"WHERE table_name IN ({', '.join('?' for _ in table_names)})",
+                    table_names,
+                ).fetchall()
+            )
+            if any(built_versions.get(name) != omop_version for name in table_names):
+                with self.transaction():
+                    for name, (query, params) in table_queries.items():
+                        self.conn.execute(f"CREATE OR REPLACE TABLE {name} AS {query}", params)
+                        self.conn.execute(
+                            f"INSERT OR REPLACE INTO {self.schema}.omop_derived_table VALUES (?, ?)",
+                            [name, omop_version],
+                        )
+                notify_users(f"Local {description} created.")
+            self._omop_derived_tables[cache_key] = table_names
+            return table_names
+
+    def get_vocab_tables(self, vocab: str, omop_version=None):
+        """
+        Get local copies of the OMOP concept_ancestor and concept tables restricted to the ancestor concepts of a
+        vocabulary, which concept prevalence queries join instead of the OMOP vocabulary tables. The copies are
+        built on first use, sorted by their join keys, and rebuilt when the OMOP data version changes, so repeated
+        queries never scan the OMOP vocabulary again.
+        :param vocab: vocabulary id, e.g., SNOMED
+        :param omop_version: OMOP data version token, default is None meaning the cached token of the OMOP catalog
+        :return: dict with the qualified names of the local concept_ancestor and concept tables
+        """
+        table_suffix = hashlib.sha256(vocab.encode("utf-8")).hexdigest()[:16]
+        concept_table = f"{self.schema}.vocab_concept_{table_suffix}"
+        concept_ancestor_table = f"{self.schema}.vocab_concept_ancestor_{table_suffix}"
+        table_queries = {
+            concept_table: (
+                f"""
+                SELECT concept_id, concept_name, concept_code, vocabulary_id
+                FROM {self.omop_alias}.concept
+                WHERE vocabulary_id = ?
+                ORDER BY concept_id
+                """,
+                [vocab],
+            ),
+            # prevalence queries join the pairs on descendant concepts of cohort events
+            concept_ancestor_table: (
+                f"""
+                SELECT ca.ancestor_concept_id, ca.descendant_concept_id, ca.min_levels_of_separation
+                FROM {self.omop_alias}.concept_ancestor ca
+                JOIN {concept_table} c ON ca.ancestor_concept_id = c.concept_id
+                ORDER BY ca.descendant_concept_id, ca.ancestor_concept_id
+                """,
+                [],
+            ),
+        }
+        self._get_omop_derived_tables(
+            table_queries, omop_version or self.omop_catalog.get_data_version(), f"{vocab} vocabulary tables"
+        )
+        return {"concept_ancestor": concept_ancestor_table, "concept": concept_table}
+
+    def get_incidence_table(self, concept_type: str, omop_version=None):
+        """
+        Get the incidence table of an OMOP domain with one row per person and concept holding the first and last
+        start dates and the distinct start dates of the person's events of the concept. Concept prevalence queries
+        read it instead of the raw domain event table when use_incidence_tables is True, which collapses repeated
+        events of a concept into one row. The table is built on first use, sorted by person and concept so that its
+        zone maps prune scans of cohort subjects, and rebuilt when the OMOP data version changes.
+        :param concept_type: OMOP domain from DOMAIN_MAPPING, e.g., condition_occurrence
+        :param omop_version: OMOP data version token, default is None meaning the cached token of the OMOP catalog
+        :return: qualified name of the incidence table
+        """
+        CohortQueryBuilder._validate_concept_type(concept_type)
+        domain = DOMAIN_MAPPING[concept_type]
+        incidence_table = f"{self.schema}.incidence_{domain['table']}"
+        table_queries = {
+            incidence_table: (
+                f"""
+                SELECT
+                    person_id,
+                    {domain["concept_id"]} AS concept_id,
+                    MIN({domain["start_date"]}) AS first_date,
+                    MAX({domain["start_date"]}) AS last_date,
+                    list_sort(list_distinct(list({domain["start_date"]}))) AS occurrence_dates
+                FROM {self.omop_alias}.{domain["table"]}
+                WHERE {domain["start_date"]} IS NOT NULL
+                GROUP BY person_id, {domain["concept_id"]}
+                ORDER BY person_id, concept_id
+                """,
+                [],
+            ),
+        }
+        self._get_omop_derived_tables(
+            table_queries, omop_version or self.omop_catalog.get_data_version(), f"{concept_type} incidence table"
+        )
+        return incidence_table
+
+    def _get_concept_incidence_table(self, concept_type: str, omop_version):
+        return self.get_incidence_table(concept_type, omop_version) if self.use_incidence_tables else None
+
+    def get_cohorts_concept_counts(
+        self,
+        cohort_definition_id_1: int,
+        cohort_definition_id_2: int,
+        qry_builder,
+        concept_type="condition_occurrence",
+        filter_count=0,
+        vocab=None,
+    ):
+        """
+        Get the number of distinct subjects of two cohorts with each concept or any of its descendants in a domain
+        computed in one grouped query over the cohort table
+        :param cohort_definition_id_1: cohort definition id of the first cohort
+        :param cohort_definition_id_2: cohort definition id of the second cohort
+        :param qry_builder: CohortQueryBuilder object to build the query with
+        :param concept_type: OMOP domain of the concepts, default is condition_occurrence
+        :param filter_count: minimum count threshold in either cohort for concepts with 0 meaning no filtering
+        :param vocab: vocabulary id of the concepts, default is None meaning the default vocabulary of the domain
+        :return: pandas DataFrame with concept_id, concept_name, concept_code, count_1, size_1, count_2, and size_2
+        columns, where size_1 and size_2 are the number of distinct subjects of each cohort
+        """
+        try:
+            omop_version = self.omop_catalog.get_data_version()
+            self._validate_vocab(vocab, omop_version)
+            query = qry_builder.build_concept_prevalence_comparison_query(
+                self.schema,
+                self.omop_alias,
+                concept_type,
+                cohort_definition_id_1,
+                cohort_definition_id_2,
+                filter_count=filter_count,
+                vocab=vocab,
+                vocab_tables=self.get_vocab_tables(qry_builder.get_effective_vocab(concept_type, vocab), omop_version),
+                incidence_table=self._get_concept_incidence_table(concept_type, omop_version),
+            )
+            return self._execute_query(query, output_format="df")
+        except Exception as e:
+            raise ValueError("Error computing cohorts concept counts") from e
+
+    def get_cohorts_concept_stats(
+        self,
+        cohort_definition_ids,
+        qry_builder,
+        concept_type="condition_occurrence",
+        filter_count=0,
+        vocab=None,
+    ):
+        """
+        Get concept statistics of multiple cohorts from the cohort table with one query grouped by cohort
+        definition id, which rolls up the concepts of all cohorts to their ancestors in one pass
+        :param cohort_definition_ids: list of cohort definition ids
+        :param qry_builder: CohortQueryBuilder object to build the query with
+        :param concept_type: OMOP domain of the concepts, default is condition_occurrence
+        :param filter_count: minimum count threshold for concepts in each cohort with 0 meaning no filtering
+        :param vocab: vocabulary id of the concepts, default is None meaning the default vocabulary of the domain
+        :return: dict keyed by concept_type with a list of dicts of the concept statistics, each with a
+        cohort_definition_id key in addition to the keys of get_cohort_concept_stats() results
+        """
+        try:
+            omop_version = self.omop_catalog.get_data_version()
+            self._validate_vocab(vocab, omop_version)
+            query = qry_builder.build_cohorts_concept_prevalence_query(
+                self.schema,
+                self.omop_alias,
+                concept_type,
+                cohort_definition_ids,
+                filter_count=filter_count,
+                vocab=vocab,
+                vocab_tables=self.get_vocab_tables(qry_builder.get_effective_vocab(concept_type, vocab), omop_version),
+                incidence_table=self._get_concept_incidence_table(concept_type, omop_version),
+            )
+            cs_df = self._execute_query(query, output_format="df")
+            return {concept_type: cs_df.to_dict(orient="records")}
+        except Exception as e:
+            raise ValueError("Error computing cohorts concept stats") from e
+
+    def _get_cohort_concept_stats_with_bitmaps(
+        self, cohort_definition_id, qry_builder, concept_type, filter_count, vocab, vocab_tables, incidence_table
+    ):
+        """
+        Compute the concept statistics of get_cohort_concept_stats() by building one person bitmap per concept of the
+        cohort events and ORing the bitmaps up the concept hierarchy in topological order, so that the events are
+        read once rather than joined with every ancestor of their concepts
+        :return: pandas DataFrame with the columns of the concept prevalence query results
+        """
+        queries = qry_builder.build_concept_rollup_queries(
+            self.schema,
+            self.omop_alias,
+            concept_type,
+            cohort_definition_id,
+            vocab=vocab,
+            vocab_tables=vocab_tables,
+            incidence_table=incidence_table,
+        )
+        cohort_size = self.conn.execute(
+            f"SELECT COUNT(DISTINCT subject_id) FROM {self.schema}.cohort WHERE cohort_definition_id = ?",
+            [int(cohort_definition_id)],
+        ).fetchone()[0]
+        events_df = self._execute_query(queries["events"], output_format="df")
+        pairs_df = _fetch_results(
+            self.conn.execute(queries["hierarchy"], [events_df["concept_id"].unique().tolist()]), output_format="df"
+        )
+        edges_df = pairs_df[pairs_df["is_rollup_edge"]]
+        counts = rollup_concept_counts(
+            events_df["concept_id"].to_numpy(),
+            events_df["person_index"].to_numpy(),
+            cohort_size,
+            edges_df["ancestor_concept_id"].to_numpy(),
+            edges_df["descendant_concept_id"].to_numpy(),
+        )
+        # the ancestors of the pairs are the vocabulary concepts with any cohort events of them or their descendants
+        concept_counts = pd.Series(
+            {concept_id: counts[concept_id] for concept_id in pairs_df["ancestor_concept_id"].unique().tolist()},
+            dtype="int64",
+        )
+        concept_counts = concept_counts[concept_counts > filter_count]
+        cs_df = pairs_df[
+            (pairs_df["min_levels_of_separation"] <= 1)
+            & pairs_df["ancestor_concept_id"].isin(concept_counts.index)
+            & pairs_df["descendant_concept_id"].isin(concept_counts.index)
+        ].rename(columns={"descendant_concept_name": "concept_name", "descendant_concept_code": "concept_code"})
+        cs_df = cs_df.assign(count_in_cohort=cs_df["descendant_concept_id"].map(concept_counts).astype("int64"))
+        cs_df["prevalence"] = cs_df["count_in_cohort"] * 1.0 / cohort_size
+        columns = ["concept_name", "concept_code", "count_in_cohort", "prevalence"]
+        cs_df = cs_df[[*columns, "ancestor_concept_id", "descendant_concept_id"]].drop_duplicates()
+        return cs_df.sort_values("prevalence", ascending=False, kind="stable").reset_index(drop=True)
+
     def get_cohort_concept_stats(
         self,
         cohort_definition_id: int,
@@ -263,36 +1368,55 @@ class BiasDatabase:
         filter_count=0,
         vocab=None,
         print_concept_hierarchy=False,
+        approximate=False,
+        strategy="sql",
     ):
         """
-        Get concept statistics for a cohort from the cohort table.
+        Get concept statistics for a cohort from the cohort table. If approximate is True, the number of distinct
+        cohort subjects with each concept is estimated with approx_count_distinct, and count_in_cohort_lower,
+        count_in_cohort_upper, prevalence_lower, and prevalence_upper columns bound the estimates. If strategy is
+        bitmap, the exact counts are rolled up to ancestor concepts with person bitmaps instead of SQL joins.
         """
+        if strategy not in CONCEPT_STATS_STRATEGIES:
+            raise ValueError(f"Invalid strategy: {strategy}. Must be one of {CONCEPT_STATS_STRATEGIES}")
+        if approximate and strategy != "sql":
+            raise ValueError(f"approximate concept stats are not supported by the {strategy} strategy")
         concept_stats = {}
 
         try:
-            # validate input vocab if it is not None
-            if vocab is not None:
-                valid_vocabs = self._execute_query(f"SELECT distinct vocabulary_id FROM {self.omop_alias}.concept")
-                valid_vocab_ids = [row["vocabulary_id"] for row in valid_vocabs]
-                if vocab not in valid_vocab_ids:
-                    err_msg = (
-                        f"input {vocab} is not a valid vocabulary in OMOP. "
-                        f"Supported vocabulary ids are: {valid_vocab_ids}"
-                    )
-                    notify_users(err_msg, level="error")
-                    raise ValueError(err_msg)
-
-            query = qry_builder.build_concept_prevalence_query(
-                self.schema, self.omop_alias, concept_type, cohort_definition_id, filter_count, vocab
-            )
-            concept_stats[concept_type] = self._execute_query(query)
-            cs_df = pd.DataFrame(concept_stats[concept_type])
+            omop_version = self.omop_catalog.get_data_version()
+            self._validate_vocab(vocab, omop_version)
+            vocab_tables = self.get_vocab_tables(qry_builder.get_effective_vocab(concept_type, vocab), omop_version)
+            incidence_table = self._get_concept_incidence_table(concept_type, omop_version)
+            if strategy == "bitmap":
+                cs_df = self._get_cohort_concept_stats_with_bitmaps(
+                    cohort_definition_id, qry_builder, concept_type, filter_count, vocab, vocab_tables, incidence_table
+                )
+            else:
+                query = qry_builder.build_concept_prevalence_query(
+                    self.schema,
+                    self.omop_alias,
+                    concept_type,
+                    cohort_definition_id,
+                    filter_count,
+                    vocab,
+                    approximate=approximate,
+                    # bounds of two standard errors of approx_count_distinct
+                    count_relative_error=2 * APPROX_COUNT_DISTINCT_RELATIVE_ERROR,
+                    vocab_tables=vocab_tables,
+                    incidence_table=incidence_table,
+                )
+                # fetch the results in columnar form once and expose the list-of-dicts view from the same DataFrame
+                cs_df = self._execute_query(query, output_format="df")
+            concept_stats[concept_type] = cs_df.to_dict(orient="records")
 
             if not cs_df.empty:
                 # Combine concept_name and prevalence into a "details" column
                 cs_df["details"] = cs_df.apply(
-                    lambda row: f"{row['concept_name']} (Code: {row['concept_code']}, "
-                    f"Count: {row['count_in_cohort']}, Prevalence: {row['prevalence']:.3%})",
+                    lambda row: (
+                        f"{row['concept_name']} (Code: {row['concept_code']}, "
+                        f"Count: {row['count_in_cohort']}, Prevalence: {row['prevalence']:.3%})"
+                    ),
                     axis=1,
                 )
 
@@ -311,8 +1435,10 @@ class BiasDatabase:
             raise ValueError("Error computing cohort concept stats") from e
 
     def close(self):
-        if self.conn:
-            self.conn.close()
+        self._connections.close()
+        self.clear_cache()
+        self._omop_derived_tables.clear()
+        self.omop_catalog.clear()
         BiasDatabase._instance = None
         notify_users("Connection to BiasDatabase closed.")
 
@@ -327,6 +1453,22 @@ class OMOPCDMDatabase:
             cls._instance._initialize(db_url, read_only=read_only)  # Initialize only once
         return cls._instance
 
+    @property
+    def engine(self):
+        """
+        duckdb connection of the calling thread for a duckdb OMOP database, where threads other than the one that
+        opened the database get their own cursor, or the thread-safe SQLAlchemy engine for a postgreSQL database
+        """
+        engine = getattr(self, "_engine", None)
+        return engine.get() if isinstance(engine, ThreadConnectionManager) else engine
+
+    @engine.setter
+    def engine(self, engine):
+        current_engine = getattr(self, "_engine", None)
+        if isinstance(current_engine, ThreadConnectionManager):
+            current_engine.close_cursors()
+        self._engine = ThreadConnectionManager(engine) if isinstance(engine, duckdb.DuckDBPyConnection) else engine
+
     def _initialize(self, db_url, read_only=True):
         if db_url.endswith(".duckdb"):
             # close any potential global connections if any
@@ -367,31 +1509,57 @@ class OMOPCDMDatabase:
             # postgresql connection: provide a new session for read-only queries
             return self.Session()
 
-    def execute_query(self, query, params=None):
+    def execute_query(self, query, params=None, output_format="records"):
+        """
+        Execute a read-only query on the OMOP CDM database. The query is executed only once for all output formats.
+        :param query: SQL query string
+        :param params: optional query parameters
+        :param output_format: "records" (default) for a list of dicts, "df" for a pandas DataFrame,
+        or "arrow" for a pyarrow Table which requires pyarrow to be installed
+        :return: query results in the requested format, or an empty result if the query fails
+        """
+        _validate_output_format(output_format)
+        omop_session = None
         try:
             if self._database_type == "duckdb":
                 # DuckDB query execution
-                results = self.engine.execute(query, params).fetchall()
-                headers = [desc[0] for desc in self.engine.execute(query, params).description]
+                return _fetch_results(self.engine.execute(query, params), output_format)
             else:  # pragma: no cover
                 # PostgreSQL query execution
                 omop_session = self.get_session()
                 query = text(query)
-                results = omop_session.execute(query, params) if params else omop_session.execute(query)
-                headers = results.keys()
-                results = results.fetchall()
+                # cancelling the task running the query cancels the statement on the postgreSQL backend, e.g., with
+                # psycopg2 connection.cancel()
+                token = get_cancellation_token()
+                dbapi_conn = omop_session.connection().connection.dbapi_connection
+                interrupt_key = None
+                if token is not None and hasattr(dbapi_conn, "cancel"):
+                    interrupt_key = token.add_interrupt(dbapi_conn.cancel)
+                try:
+                    results = omop_session.execute(query, params) if params else omop_session.execute(query)
+                    headers = list(results.keys())
+                    rows = results.fetchall()
+                finally:
+                    if interrupt_key is not None:
+                        token.remove_interrupt(interrupt_key)
                 omop_session.close()
+                if output_format == "records":
+                    return [dict(zip(headers, row)) for row in rows]
+                results_df = pd.DataFrame.from_records(rows, columns=headers)
+                if output_format == "arrow":
+                    import pyarrow as pa
 
-            return [dict(zip(headers, row)) for row in results]
+                    return pa.Table.from_pandas(results_df, preserve_index=False)
+                return results_df
 
         except duckdb.Error as e:
             notify_users(f"Error executing query: {e}", level="error")
-            return []
+            return _empty_results(output_format)
         except SQLAlchemyError as e:  # pragma: no cover
             notify_users(f"Error executing query: {e}", level="error")
             if omop_session:
                 omop_session.close()
-            return []
+            return _empty_results(output_format)
 
     def get_domains_and_vocabularies(self) -> list:
         # find a concept ID based on a search term
@@ -564,8 +1732,8 @@ class OMOPCDMDatabase:
         return reverse_hierarchy[concept_id], hierarchy[concept_id]
 
     def close(self):
-        if isinstance(self.engine, duckdb.DuckDBPyConnection):
-            self.engine.close()
+        if isinstance(self._engine, ThreadConnectionManager):
+            self._engine.close()
         else:
             self.engine.dispose()  # pragma: no cover
         OMOPCDMDatabase._instance = None
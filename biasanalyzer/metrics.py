@@ -0,0 +1,231 @@
+import numpy as np
+from scipy.stats import chi2
+
+
+def normalize_counts(counts):
+    """
+    Normalize bin counts into probability distributions along the last axis.
+    :param counts: array-like of non-negative bin counts with the distribution bins in the last axis
+    :return: float array of the same shape with each distribution summing to 1, or NaN for a distribution
+    without any counts
+    """
+    counts = np.asarray(counts, dtype=float)
+    totals = np.sum(counts, axis=-1, keepdims=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(totals > 0, counts / totals, np.nan)
+
+
+def hellinger_distance(p, q):
+    """
+    Compute the Hellinger distance between probability distributions in the last axis of p and q, which are
+    broadcast against each other. The distance is in [0, 1].
+    """
+    return np.sqrt(0.5 * np.sum((np.sqrt(p) - np.sqrt(q)) ** 2, axis=-1))
+
+
+def jensen_shannon_distance(p, q):
+    """
+    Compute the Jensen-Shannon distance, i.e., the square root of the base-2 Jensen-Shannon divergence, between
+    probability distributions in the last axis of p and q, which are broadcast against each other. The distance
+    is in [0, 1].
+    """
+    m = 0.5 * (p + q)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        # bins with zero probability do not contribute to the divergence
+        kl_pm = np.where(p > 0, p * np.log2(p / m), 0.0)
+        kl_qm = np.where(q > 0, q * np.log2(q / m), 0.0)
+    divergence = 0.5 * np.sum(kl_pm, axis=-1) + 0.5 * np.sum(kl_qm, axis=-1)
+    # clip tiny negative values caused by floating point rounding before taking the square root
+    return np.sqrt(np.clip(divergence, 0.0, None))
+
+
+def total_variation_distance(p, q):
+    """
+    Compute the total variation distance between probability distributions in the last axis of p and q, which
+    are broadcast against each other. The distance is in [0, 1].
+    """
+    return 0.5 * np.sum(np.abs(p - q), axis=-1)
+
+
+def wasserstein_distance(p, q):
+    """
+    Compute the Wasserstein (earth mover's) distance between probability distributions over ordinal bins in the
+    last axis of p and q, which are broadcast against each other. Adjacent bins are one unit apart, so the
+    distance is the number of bins probability mass has to move on average and is in [0, number of bins - 1].
+    """
+    return np.sum(np.abs(np.cumsum(p, axis=-1) - np.cumsum(q, axis=-1)), axis=-1)
+
+
+DISTANCE_METRICS = {
+    "hellinger": hellinger_distance,
+    "jensen_shannon": jensen_shannon_distance,
+    "total_variation": total_variation_distance,
+    "wasserstein": wasserstein_distance,
+}
+
+
+def _get_distance_metric(metric: str):
+    if metric not in DISTANCE_METRICS:
+        raise ValueError(f"invalid metric {metric}. Valid metrics are {list(DISTANCE_METRICS.keys())}")
+    return DISTANCE_METRICS[metric]
+
+
+def distance(counts_p, counts_q, metric: str = "hellinger"):
+    """
+    Compute the distance between distributions given as raw bin counts.
+    :param counts_p: bin counts of the first distribution, or a 2-D array with one distribution per row
+    :param counts_q: bin counts of the second distribution aligned with counts_p by bin
+    :param metric: one of the metric names in DISTANCE_METRICS, default is "hellinger"
+    :return: distance as a float, or an array of distances with one per row for 2-D inputs
+    """
+    return _get_distance_metric(metric)(normalize_counts(counts_p), normalize_counts(counts_q))
+
+
+def pairwise_distances(counts, metric: str = "hellinger"):
+    """
+    Compute the distances between all pairs of distributions at once with NumPy broadcasting.
+    :param counts: 2-D array-like of raw bin counts with one distribution per row over the same aligned bins
+    :param metric: one of the metric names in DISTANCE_METRICS, default is "hellinger"
+    :return: symmetric 2-D array of the distance between each pair of rows
+    """
+    p = normalize_counts(counts)
+    return _get_distance_metric(metric)(p[:, np.newaxis, :], p[np.newaxis, :, :])
+
+
+def _resample_counts(rng, counts, n_resamples):
+    """
+    Draw n_resamples multinomial resamples of each distribution in counts with its own total count in one call.
+    :return: array of shape (number of distributions, n_resamples, number of bins)
+    """
+    totals = counts.sum(axis=-1).astype(np.int64)
+    p = normalize_counts(counts)
+    # distributions without counts draw zero counts from placeholder uniform probabilities
+    p = np.where(np.isnan(p), 1.0 / counts.shape[-1], p)
+    return rng.multinomial(totals[:, np.newaxis], p[:, np.newaxis, :], size=(counts.shape[0], n_resamples))
+
+
+def bootstrap_distance_ci(
+    counts_p,
+    counts_q,
+    metric: str = "hellinger",
+    n_resamples: int = 1000,
+    confidence_level: float = 0.95,
+    seed=None,
+):
+    """
+    Compute distances between distributions given as raw bin counts along with percentile bootstrap confidence
+    intervals. Each distribution is resampled from its observed bin proportions with its observed total count,
+    and all resamples of all distribution pairs are drawn and compared with vectorized NumPy operations.
+    :param counts_p: bin counts of the first distribution, or a 2-D array with one distribution per row to
+    compute the distances of many distribution pairs at once
+    :param counts_q: bin counts of the second distribution aligned with counts_p by row and bin
+    :param metric: one of the metric names in DISTANCE_METRICS, default is "hellinger"
+    :param n_resamples: number of bootstrap resamples, default is 1000
+    :param confidence_level: confidence level of the intervals in (0, 1), default is 0.95
+    :param seed: seed or numpy random Generator for reproducible resamples, default is None
+    :return: dict with distance, ci_lower, and ci_upper, each a float for 1-D inputs or an array with one value
+    per row for 2-D inputs
+    """
+    if not 0 < confidence_level < 1:
+        raise ValueError(f"confidence_level must be between 0 and 1, got {confidence_level}")
+    if n_resamples < 1:
+        raise ValueError(f"n_resamples must be a positive integer, got {n_resamples}")
+    metric_func = _get_distance_metric(metric)
+    counts_p = np.asarray(counts_p)
+    counts_q = np.asarray(counts_q)
+    if counts_p.shape != counts_q.shape:
+        raise ValueError(f"counts_p of shape {counts_p.shape} and counts_q of shape {counts_q.shape} do not match")
+    single_pair = counts_p.ndim == 1
+    counts_p = np.atleast_2d(counts_p)
+    counts_q = np.atleast_2d(counts_q)
+
+    rng = np.random.default_rng(seed)
+    resampled_distances = metric_func(
+        normalize_counts(_resample_counts(rng, counts_p, n_resamples)),
+        normalize_counts(_resample_counts(rng, counts_q, n_resamples)),
+    )
+    alpha = (1 - confidence_level) / 2
+    ci_lower, ci_upper = np.quantile(resampled_distances, [alpha, 1 - alpha], axis=-1)
+    results = {
+        "distance": metric_func(normalize_counts(counts_p), normalize_counts(counts_q)),
+        "ci_lower": ci_lower,
+        "ci_upper": ci_upper,
+    }
+    if single_pair:
+        return {key: float(value[0]) for key, value in results.items()}
+    return results
+
+
+def standardized_mean_difference(p1, p2):
+    """
+    Compute the standardized mean differences of binary variables such as concept presence between two groups from
+    their prevalences, vectorized over all variables.
+    :param p1: array-like of prevalences in the first group
+    :param p2: array-like of prevalences in the second group
+    :return: array of (p1 - p2) / sqrt((p1 * (1 - p1) + p2 * (1 - p2)) / 2), which is 0 for equal prevalences and
+    infinite for different prevalences without variance, i.e., 0 in one group and 1 in the other
+    """
+    p1 = np.asarray(p1, dtype=float)
+    p2 = np.asarray(p2, dtype=float)
+    pooled_sd = np.sqrt((p1 * (1 - p1) + p2 * (1 - p2)) / 2)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        smd = (p1 - p2) / pooled_sd
+    return np.where(p1 == p2, 0.0, smd)
+
+
+def chi_square_test(count_1, size_1, count_2, size_2, correction: bool = True):
+    """
+    Run chi-square tests of independence of the 2x2 contingency tables of the number of subjects with and without
+    a binary variable such as concept presence in two groups, vectorized over all variables. The results are the
+    same as those of scipy.stats.chi2_contingency for each table.
+    :param count_1: array-like of the number of subjects with each variable in the first group
+    :param size_1: number of subjects in the first group
+    :param count_2: array-like of the number of subjects with each variable in the second group
+    :param size_2: number of subjects in the second group
+    :param correction: whether to apply Yates' continuity correction, default is True
+    :return: tuple of arrays of chi-square statistics and p-values, which are NaN for tables with a zero expected
+    count, e.g., a variable all or none of the subjects have
+    """
+    observed = np.stack(
+        np.broadcast_arrays(
+            np.asarray(count_1, dtype=float),
+            np.asarray(size_1, dtype=float) - count_1,
+            np.asarray(count_2, dtype=float),
+            np.asarray(size_2, dtype=float) - count_2,
+        ),
+        axis=-1,
+    ).reshape(-1, 2, 2)
+    total = observed.sum(axis=(1, 2), keepdims=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        expected = observed.sum(axis=2, keepdims=True) * observed.sum(axis=1, keepdims=True) / total
+        # all cells of a 2x2 table deviate from their expected counts by the same absolute difference
+        deviation = np.abs(observed[:, 0, 0] - expected[:, 0, 0])
+        if correction:
+            deviation = np.maximum(deviation - 0.5, 0.0)
+        statistic = deviation**2 * np.sum(1.0 / expected, axis=(1, 2))
+    statistic = np.where(np.all(expected > 0, axis=(1, 2)), statistic, np.nan)
+    shape = np.broadcast(np.asarray(count_1), np.asarray(count_2)).shape
+    return statistic.reshape(shape), chi2.sf(statistic, df=1).reshape(shape)
+
+
+def benjamini_hochberg(p_values):
+    """
+    Adjust p-values of multiple tests for the false discovery rate with the Benjamini-Hochberg procedure.
+    :param p_values: array-like of p-values, where NaN p-values of tests that could not be run are ignored
+    :return: array of adjusted p-values in the order of p_values with NaN for NaN p-values
+    """
+    p_values = np.asarray(p_values, dtype=float)
+    adjusted = np.full(p_values.shape, np.nan)
+    valid = ~np.isnan(p_values)
+    valid_p_values = p_values[valid]
+    n_tests = valid_p_values.size
+    if n_tests == 0:
+        return adjusted
+    order = np.argsort(valid_p_values)
+    scaled = valid_p_values[order] * n_tests / np.arange(1, n_tests + 1)
+    # the adjusted p-value of a rank is the smallest scaled p-value of this and all larger ranks
+    scaled = np.minimum.accumulate(scaled[::-1])[::-1]
+    valid_adjusted = np.empty(n_tests)
+    valid_adjusted[order] = np.minimum(scaled, 1.0)
+    adjusted[valid] = valid_adjusted
+    return adjusted
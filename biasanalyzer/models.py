@@ -1,7 +1,7 @@
 from datetime import date
 from typing import List, Literal, Optional, Union
 
-from pydantic import BaseModel, ConfigDict, StrictStr, field_validator, model_validator
+from pydantic import BaseModel, ConfigDict, Field, StrictStr, field_validator, model_validator
 
 DOMAIN_MAPPING = {
     "condition_occurrence": {
@@ -66,6 +66,10 @@ class RootOMOPCDM(BaseModel):
     hostname: StrictStr
     database: StrictStr
     port: int
+    # optional path to a file-backed BiasAnalyzer database to persist cohorts across sessions, in-memory if not set
+    bias_database: Optional[StrictStr] = None
+    # whether concept prevalence queries read per-domain person-concept incidence tables built from the OMOP data
+    use_incidence_tables: bool = False
 
 
 class Configuration(BaseModel):
@@ -84,6 +88,8 @@ class CohortDefinition(BaseModel):
     created_date: date
     creation_info: str
     created_by: str
+    # fingerprint of the cohort definition and OMOP data version used to reuse already materialized cohorts
+    fingerprint: Optional[str] = None
 
 
 ###===========CohortDefinition Model==============###
@@ -101,6 +107,47 @@ class Cohort(BaseModel):
 ###===========Cohort Model====================###
 
 
+###===========AgeBinSpec Model====================###
+class AgeBinSpec(BaseModel):
+    # Fixed-width age bins 0-width, width+1 - 2*width, ..., with the last of num_bins bins open-ended up to max_age,
+    # which gives the decade bins 0-10, 11-20, ..., 81-90, 91+ by default
+    width: int = Field(default=10, gt=0)
+    num_bins: int = Field(default=10, gt=0)
+    # Optional inclusive upper edges of all but the last open-ended bin, e.g., [17, 44, 64] for 0-17, 18-44, 45-64,
+    # and 65+, which override width and num_bins if set
+    edges: Optional[List[int]] = None
+    # Ages outside of [0, max_age] are not assigned to any bin
+    max_age: int = Field(default=150, ge=0)
+
+    @field_validator("edges")
+    def validate_edges(cls, edges):
+        if edges is not None:
+            if not edges:
+                raise ValueError("edges must not be empty")
+            if edges[0] < 0 or any(e2 <= e1 for e1, e2 in zip(edges, edges[1:])):
+                raise ValueError("edges must be non-negative and strictly increasing")
+        return edges
+
+    def get_labels(self) -> List[str]:
+        """Get the age bin labels in bin index order."""
+        upper_edges = self.edges if self.edges else [(i + 1) * self.width for i in range(self.num_bins - 1)]
+        lower_edges = [0] + [edge + 1 for edge in upper_edges]
+        return [f"{lower}-{upper}" for lower, upper in zip(lower_edges, upper_edges)] + [f"{lower_edges[-1]}+"]
+
+    def get_bin_index_sql(self, age_col="age") -> str:
+        """
+        Generate the SQL expression computing the 0-based bin index of an age arithmetically, i.e., without a range
+        join against a table of age bins.
+        """
+        if self.edges:
+            # the number of edges below the age is the index of the bin the age falls in
+            return f"len(list_filter([{', '.join(str(e) for e in self.edges)}], e -> e < {age_col}))"
+        return f"LEAST(GREATEST(CAST(FLOOR(({age_col} - 1) / {self.width}) AS INTEGER), 0), {self.num_bins - 1})"
+
+
+###===========AgeBinSpec Model====================###
+
+
 ###=========CohortCreationConfig==================###
 class DemographicsCriteria(BaseModel):
     # Gender with "male" and "female" as valid input
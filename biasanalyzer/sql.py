@@ -1,8 +1,50 @@
 # SQL templates for querying in OMOP database
 
+# All queries below compute statistics for a list of cohorts in one pass grouped by cohort_definition_id, where
+# {cohort_definition_ids} is a comma-separated list of cohort definition ids. Cohort_Ids lists every requested cohort
+# so that zero-count bins and categories are kept for each cohort. {median_duration} and {median_age} are the median
+# columns, computed either exactly or approximately along with their error bounds.
+
+COHORT_BASIC_STATS_QUERY = """
+    WITH Cohort_Ids AS (
+        SELECT UNNEST([{cohort_definition_ids}]) AS cohort_definition_id
+    ),
+    Cohort_Duration AS (
+        SELECT
+            cohort_definition_id,
+            subject_id,
+            cohort_start_date,
+            cohort_end_date,
+            cohort_end_date - cohort_start_date AS duration_days
+        FROM {ba_schema}.cohort
+        WHERE cohort_definition_id IN ({cohort_definition_ids})
+    )
+    SELECT
+        ci.cohort_definition_id,
+        COUNT(cd.subject_id) AS total_count,
+        MIN(cd.cohort_start_date) AS earliest_start_date,
+        MAX(cd.cohort_start_date) AS latest_start_date,
+        MIN(cd.cohort_end_date) AS earliest_end_date,
+        MAX(cd.cohort_end_date) AS latest_end_date,
+        MIN(cd.duration_days) AS min_duration_days,
+        MAX(cd.duration_days) AS max_duration_days,
+        ROUND(AVG(cd.duration_days), 2) AS avg_duration_days,
+        {median_duration},
+        ROUND(STDDEV(cd.duration_days), 2) AS stddev_duration
+    FROM Cohort_Ids ci LEFT JOIN Cohort_Duration cd ON ci.cohort_definition_id = cd.cohort_definition_id
+    GROUP BY ci.cohort_definition_id
+    ORDER BY ci.cohort_definition_id
+"""
+
+# {age_bin_index} is the arithmetic expression computing the bin index of an age from an AgeBinSpec, and {age_bins}
+# lists its (bin_index, age_bin) label pairs, so that ages are binned per row without a range join against age bins
 AGE_DISTRIBUTION_QUERY = """
-    WITH Age_Cohort AS (
-        SELECT p.person_id, 
+    WITH Cohort_Ids AS (
+        SELECT UNNEST([{cohort_definition_ids}]) AS cohort_definition_id
+    ),
+    Age_Cohort AS (
+        SELECT c.cohort_definition_id,
+               p.person_id, 
                EXTRACT(YEAR FROM
                    COALESCE(
                        c.cohort_start_date,
@@ -11,52 +53,61 @@ AGE_DISTRIBUTION_QUERY = """
                    )
                 ) - p.year_of_birth AS age 
         FROM {ba_schema}.cohort c JOIN {omop}.person p ON c.subject_id = p.person_id
-        WHERE c.cohort_definition_id = {cohort_definition_id}
+        WHERE c.cohort_definition_id IN ({cohort_definition_ids})
         ),
-    -- Define age bins manually using SELECT statements and UNION ALL
     Age_Bins AS (
-        SELECT '0-10' AS age_bin, 0 AS min_age, 10 AS max_age
-        UNION ALL SELECT '11-20', 11, 20
-        UNION ALL SELECT '21-30', 21, 30
-        UNION ALL SELECT '31-40', 31, 40
-        UNION ALL SELECT '41-50', 41, 50
-        UNION ALL SELECT '51-60', 51, 60
-        UNION ALL SELECT '61-70', 61, 70
-        UNION ALL SELECT '71-80', 71, 80
-        UNION ALL SELECT '81-90', 81, 90
-        UNION ALL SELECT '91+', 91, 150  -- Max age is 150 for the last bin
+        SELECT * FROM (VALUES {age_bins}) AS b(bin_index, age_bin)
+    ),
+    -- Count individuals in each age bin of each cohort
+    Age_Bin_Counts AS (
+        SELECT
+            cohort_definition_id,
+            {age_bin_index} AS bin_index,
+            COUNT(person_id) AS bin_count
+        FROM Age_Cohort
+        WHERE age BETWEEN 0 AND {max_age}
+        GROUP BY ALL
     ),
-    -- Define age bins and count individuals in each bin
+    -- Keep empty age bins of each cohort
     Age_Distribution AS (    
         SELECT
+            ci.cohort_definition_id,
+            b.bin_index,
             b.age_bin,
-            COUNT(ac.person_id) AS bin_count
-        FROM Age_Bins b
-        LEFT JOIN Age_Cohort ac on ac.age BETWEEN b.min_age AND b.max_age
-        GROUP BY age_bin  
+            COALESCE(abc.bin_count, 0) AS bin_count
+        FROM Cohort_Ids ci CROSS JOIN Age_Bins b
+        LEFT JOIN Age_Bin_Counts abc 
+            ON abc.cohort_definition_id = ci.cohort_definition_id AND abc.bin_index = b.bin_index
     )
     -- Calculate total cohort size and normalize to get probability distribution
     SELECT 
+        cohort_definition_id,
         age_bin,
         bin_count,
-        ROUND(bin_count * 1.0 / SUM(bin_count) OVER (), 2) AS probability -- Normalize to get probability
+        -- Normalize to get probability
+        ROUND(bin_count * 1.0 / SUM(bin_count) OVER (PARTITION BY cohort_definition_id), 2) AS probability
     FROM Age_Distribution
-    ORDER BY age_bin                  
+    ORDER BY cohort_definition_id, bin_index                  
 """
 
 GENDER_DISTRIBUTION_QUERY = """
-    WITH Gender_Categories AS (
+    WITH Cohort_Ids AS (
+        SELECT UNNEST([{cohort_definition_ids}]) AS cohort_definition_id
+    ),
+    Gender_Categories AS (
         SELECT 'male' AS gender, 8507 AS gender_concept_id
         UNION ALL SELECT 'female', 8532
         UNION ALL SELECT 'other', NULL  -- NULL to represent any non-male/female cases
     ),
     Gender_Distribution AS (
         SELECT
+            ci.cohort_definition_id,
             gc.gender,
             COUNT(cd.person_id) AS gender_count
-        FROM Gender_Categories gc
+        FROM Cohort_Ids ci CROSS JOIN Gender_Categories gc
         LEFT JOIN (
             SELECT
+                c.cohort_definition_id,
                 CASE
                     WHEN p.gender_concept_id = 8507 THEN 'male'
                     WHEN p.gender_concept_id = 8532 THEN 'female'
@@ -65,22 +116,30 @@ GENDER_DISTRIBUTION_QUERY = """
                 p.person_id
             FROM {ba_schema}.cohort c 
             JOIN {omop}.person p ON c.subject_id = p.person_id 
-            WHERE c.cohort_definition_id = {cohort_definition_id}
-        ) cd ON gc.gender = cd.gender
-        GROUP BY gc.gender
+            WHERE c.cohort_definition_id IN ({cohort_definition_ids})
+        ) cd ON cd.cohort_definition_id = ci.cohort_definition_id AND gc.gender = cd.gender
+        GROUP BY ci.cohort_definition_id, gc.gender
     )
     -- Calculate total cohort size and normalize to get probability distribution
     SELECT 
+        cohort_definition_id,
         gender,
         COALESCE(gender_count, 0) AS gender_count,  -- Ensure that NULL gender counts are treated as 0
-        ROUND(COALESCE(gender_count, 0) * 1.0 / SUM(COALESCE(gender_count, 0)) OVER (), 2) AS probability
+        ROUND(
+            COALESCE(gender_count, 0) * 1.0 
+            / SUM(COALESCE(gender_count, 0)) OVER (PARTITION BY cohort_definition_id), 2
+        ) AS probability
     FROM Gender_Distribution
-    ORDER BY gender;
+    ORDER BY cohort_definition_id, gender;
 """
 
 AGE_STATS_QUERY = """
-    WITH Age_Cohort AS (
-        SELECT p.person_id,
+    WITH Cohort_Ids AS (
+        SELECT UNNEST([{cohort_definition_ids}]) AS cohort_definition_id
+    ),
+    Age_Cohort AS (
+        SELECT c.cohort_definition_id,
+            p.person_id,
             EXTRACT(YEAR FROM
                    COALESCE(
                        c.cohort_start_date,
@@ -89,35 +148,41 @@ AGE_STATS_QUERY = """
                    )
                 ) - p.year_of_birth AS age 
         FROM {ba_schema}.cohort c JOIN {omop}.person p ON c.subject_id = p.person_id
-        WHERE c.cohort_definition_id = {cohort_definition_id}
+        WHERE c.cohort_definition_id IN ({cohort_definition_ids})
         )
     -- Calculate age distribution statistics    
     SELECT
-        COUNT(*) AS total_count,
-        MIN(age) AS min_age,
-        MAX(age) AS max_age,
-        ROUND(AVG(age), 2) AS avg_age,
-        CAST(PERCENTILE_CONT(0.5) WITHIN GROUP (ORDER BY age) AS INT) AS median_age,
-        ROUND(STDDEV(age), 2) as stddev_age
-    FROM Age_Cohort                
+        ci.cohort_definition_id,
+        COUNT(ac.person_id) AS total_count,
+        MIN(ac.age) AS min_age,
+        MAX(ac.age) AS max_age,
+        ROUND(AVG(ac.age), 2) AS avg_age,
+        {median_age},
+        ROUND(STDDEV(ac.age), 2) as stddev_age
+    FROM Cohort_Ids ci LEFT JOIN Age_Cohort ac ON ci.cohort_definition_id = ac.cohort_definition_id
+    GROUP BY ci.cohort_definition_id
+    ORDER BY ci.cohort_definition_id
 """
 
 GENDER_STATS_QUERY = """
     SELECT
+        c.cohort_definition_id,
         CASE
             WHEN p.gender_concept_id = 8507 THEN 'male'
             WHEN p.gender_concept_id = 8532 THEN 'female'
             ELSE 'other'
         END AS gender,     
         COUNT(*) AS gender_count,
-        ROUND(COUNT(*) / SUM(COUNT(*)) OVER (), 2) as probability
+        ROUND(COUNT(*) / SUM(COUNT(*)) OVER (PARTITION BY c.cohort_definition_id), 2) as probability
     FROM {ba_schema}.cohort c JOIN {omop}.person p ON c.subject_id = p.person_id 
-    WHERE c.cohort_definition_id = {cohort_definition_id}
-    GROUP BY p.gender_concept_id
+    WHERE c.cohort_definition_id IN ({cohort_definition_ids})
+    GROUP BY c.cohort_definition_id, p.gender_concept_id
+    ORDER BY c.cohort_definition_id
 """
 
 RACE_STATS_QUERY = """
         SELECT
+            c.cohort_definition_id,
             CASE
                 WHEN p.race_concept_id = 8516 THEN 'Black or African American'
                 WHEN p.race_concept_id = 8515 THEN 'Asian'
@@ -127,22 +192,203 @@ RACE_STATS_QUERY = """
                 ELSE 'Other'
             END AS race,     
             COUNT(*) AS race_count,
-            ROUND(COUNT(*) / SUM(COUNT(*)) OVER (), 2) AS probability
+            ROUND(COUNT(*) / SUM(COUNT(*)) OVER (PARTITION BY c.cohort_definition_id), 2) AS probability
         FROM {ba_schema}.cohort c JOIN {omop}.person p ON c.subject_id = p.person_id
-        WHERE c.cohort_definition_id = {cohort_definition_id}
-        GROUP BY p.race_concept_id 
+        WHERE c.cohort_definition_id IN ({cohort_definition_ids})
+        GROUP BY c.cohort_definition_id, p.race_concept_id 
+        ORDER BY c.cohort_definition_id
 """
 
 ETHNICITY_STATS_QUERY = """
     SELECT
+        c.cohort_definition_id,
         CASE
             WHEN p.ethnicity_concept_id = 38003563 THEN 'Hispanic or Latino'
             WHEN p.ethnicity_concept_id = 38003564 THEN 'Not Hispanic or Latino'
             ELSE 'other'
         END AS ethnicity,     
         COUNT(*) AS ethnicity_count,
-        ROUND(COUNT(*) / SUM(COUNT(*)) OVER (), 2) AS probability
+        ROUND(COUNT(*) / SUM(COUNT(*)) OVER (PARTITION BY c.cohort_definition_id), 2) AS probability
     FROM {ba_schema}.cohort c JOIN {omop}.person p ON c.subject_id = p.person_id
-    WHERE c.cohort_definition_id = {cohort_definition_id}
-    GROUP BY p.ethnicity_concept_id
+    WHERE c.cohort_definition_id IN ({cohort_definition_ids})
+    GROUP BY c.cohort_definition_id, p.ethnicity_concept_id
+    ORDER BY c.cohort_definition_id
+"""
+
+# all basic, age, gender, race, and ethnicity stats of a cohort in one scan of the joined cohort and person rows,
+# where GROUPING(gender_concept_id, race_concept_id, ethnicity_concept_id) is 7 for the basic and age stats,
+# 3 for gender, 5 for race, and 6 for ethnicity stats. Cohort rows without a matching person only count towards
+# the basic stats in line with the per-variable stats queries above
+PROFILE_QUERY = """
+    WITH Cohort_Person AS (
+        SELECT
+            c.cohort_start_date,
+            c.cohort_end_date,
+            c.cohort_end_date - c.cohort_start_date AS duration_days,
+            p.person_id IS NOT NULL AS has_person,
+            EXTRACT(YEAR FROM
+                   COALESCE(
+                       c.cohort_start_date,
+                       c.cohort_end_date,
+                       CURRENT_DATE
+                   )
+                ) - p.year_of_birth AS age,
+            p.gender_concept_id,
+            p.race_concept_id,
+            p.ethnicity_concept_id
+        FROM {ba_schema}.cohort c LEFT JOIN {omop}.person p ON c.subject_id = p.person_id
+        WHERE c.cohort_definition_id = {cohort_definition_id}
+    ),
+    Profile AS (
+        SELECT
+            GROUPING(gender_concept_id, race_concept_id, ethnicity_concept_id) AS grouping_id,
+            gender_concept_id,
+            race_concept_id,
+            ethnicity_concept_id,
+            COUNT(*) AS total_count,
+            COUNT(*) FILTER (WHERE has_person) AS person_count,
+            MIN(cohort_start_date) AS earliest_start_date,
+            MAX(cohort_start_date) AS latest_start_date,
+            MIN(cohort_end_date) AS earliest_end_date,
+            MAX(cohort_end_date) AS latest_end_date,
+            MIN(duration_days) AS min_duration_days,
+            MAX(duration_days) AS max_duration_days,
+            ROUND(AVG(duration_days), 2) AS avg_duration_days,
+            CAST(PERCENTILE_CONT(0.5) WITHIN GROUP (ORDER BY duration_days) AS INT) AS median_duration,
+            ROUND(STDDEV(duration_days), 2) AS stddev_duration,
+            MIN(age) AS min_age,
+            MAX(age) AS max_age,
+            ROUND(AVG(age), 2) AS avg_age,
+            CAST(PERCENTILE_CONT(0.5) WITHIN GROUP (ORDER BY age) AS INT) AS median_age,
+            ROUND(STDDEV(age), 2) AS stddev_age
+        FROM Cohort_Person
+        GROUP BY GROUPING SETS ((), (gender_concept_id), (race_concept_id), (ethnicity_concept_id))
+    )
+    SELECT
+        *,
+        CASE
+            WHEN gender_concept_id = 8507 THEN 'male'
+            WHEN gender_concept_id = 8532 THEN 'female'
+            ELSE 'other'
+        END AS gender,
+        CASE
+            WHEN race_concept_id = 8516 THEN 'Black or African American'
+            WHEN race_concept_id = 8515 THEN 'Asian'
+            WHEN race_concept_id = 8657 THEN 'American Indian or Alaska Native'
+            WHEN race_concept_id = 8527 THEN 'White'
+            WHEN race_concept_id = 8557 THEN 'Native Hawaiian or Other Pacific Islander'
+            ELSE 'Other'
+        END AS race,
+        CASE
+            WHEN ethnicity_concept_id = 38003563 THEN 'Hispanic or Latino'
+            WHEN ethnicity_concept_id = 38003564 THEN 'Not Hispanic or Latino'
+            ELSE 'other'
+        END AS ethnicity,
+        ROUND(person_count / SUM(person_count) OVER (PARTITION BY grouping_id), 2) AS probability
+    FROM Profile
+    ORDER BY grouping_id, gender_concept_id, race_concept_id, ethnicity_concept_id
+"""
+
+# expressions of the named stratification dimensions of STRATIFIED_STATS_QUERY over Cohort_Person columns, which
+# are all person columns along with the age of the person at cohort start
+STRATIFICATION_DIMENSIONS = {
+    "gender": """
+        CASE
+            WHEN gender_concept_id = 8507 THEN 'male'
+            WHEN gender_concept_id = 8532 THEN 'female'
+            ELSE 'other'
+        END""",
+    "race": """
+        CASE
+            WHEN race_concept_id = 8516 THEN 'Black or African American'
+            WHEN race_concept_id = 8515 THEN 'Asian'
+            WHEN race_concept_id = 8657 THEN 'American Indian or Alaska Native'
+            WHEN race_concept_id = 8527 THEN 'White'
+            WHEN race_concept_id = 8557 THEN 'Native Hawaiian or Other Pacific Islander'
+            ELSE 'Other'
+        END""",
+    "ethnicity": """
+        CASE
+            WHEN ethnicity_concept_id = 38003563 THEN 'Hispanic or Latino'
+            WHEN ethnicity_concept_id = 38003564 THEN 'Not Hispanic or Latino'
+            ELSE 'other'
+        END""",
+    "birth_decade": "CAST(FLOOR(year_of_birth / 10) * 10 AS INTEGER)",
+    # {age_bin_labels} is a list of the age bin labels of an AgeBinSpec indexed by {age_bin_index}, where ages
+    # outside 0 to {max_age} are not in any age bin
+    "age_bin": "CASE WHEN age BETWEEN 0 AND {max_age} THEN [{age_bin_labels}][{age_bin_index} + 1] END",
+}
+
+# counts of cohort persons in each stratum of all cross-tabulations of the {dimensions} columns in one pass, where
+# {dimension_columns} computes each dimension column from Cohort_Person, {grouping} is a CUBE or GROUPING SETS clause
+# of the dimensions, and {dimensions_label} names the dimensions grouped by in each row. The probability of a stratum
+# is its share of the cohort persons as the counts of each grouping set add up to the number of cohort persons
+STRATIFIED_STATS_QUERY = """
+    WITH Cohort_Person AS (
+        SELECT
+            c.cohort_definition_id,
+            p.*,
+            EXTRACT(YEAR FROM
+                   COALESCE(
+                       c.cohort_start_date,
+                       c.cohort_end_date,
+                       CURRENT_DATE
+                   )
+                ) - p.year_of_birth AS age
+        FROM {ba_schema}.cohort c JOIN {omop}.person p ON c.subject_id = p.person_id
+        WHERE c.cohort_definition_id IN ({cohort_definition_ids})
+    ),
+    Cohort_Strata AS (
+        SELECT cohort_definition_id, {dimension_columns}
+        FROM Cohort_Person
+    ),
+    Strata_Counts AS (
+        SELECT
+            cohort_definition_id,
+            {dimensions_label} AS dimensions,
+            {dimensions},
+            COUNT(*) AS person_count
+        FROM Cohort_Strata
+        GROUP BY cohort_definition_id, {grouping}
+    )
+    SELECT
+        *,
+        person_count / SUM(person_count) OVER (PARTITION BY cohort_definition_id, dimensions) AS probability
+    FROM Strata_Counts
+    ORDER BY cohort_definition_id, dimensions, {dimensions_order}
+"""
+
+# number of cohort entries in each calendar period of cohort_start_date truncated to {granularity}, e.g., month, where
+# Periods lists every period from the earliest to the latest entry of all requested cohorts so that periods without
+# entries are kept with zero counts for each cohort
+TEMPORAL_DISTRIBUTION_QUERY = """
+    WITH Cohort_Ids AS (
+        SELECT UNNEST([{cohort_definition_ids}]) AS cohort_definition_id
+    ),
+    Period_Counts AS (
+        SELECT
+            cohort_definition_id,
+            CAST(date_trunc('{granularity}', cohort_start_date) AS DATE) AS period,
+            COUNT(*) AS entry_count
+        FROM {ba_schema}.cohort
+        WHERE cohort_definition_id IN ({cohort_definition_ids}) AND cohort_start_date IS NOT NULL
+        GROUP BY ALL
+    ),
+    Periods AS (
+        SELECT CAST(UNNEST(range(
+            CAST(MIN(period) AS TIMESTAMP),
+            CAST(MAX(period) AS TIMESTAMP) + INTERVAL 1 {granularity},
+            INTERVAL 1 {granularity}
+        )) AS DATE) AS period
+        FROM Period_Counts
+    )
+    SELECT
+        ci.cohort_definition_id,
+        p.period,
+        COALESCE(pc.entry_count, 0) AS entry_count,
+        COALESCE(pc.entry_count, 0) / SUM(COALESCE(pc.entry_count, 0)) OVER (PARTITION BY ci.cohort_definition_id)
+            AS probability
+    FROM Cohort_Ids ci CROSS JOIN Periods p
+    LEFT JOIN Period_Counts pc ON pc.cohort_definition_id = ci.cohort_definition_id AND pc.period = p.period
+    ORDER BY ci.cohort_definition_id, p.period
 """
@@ -1,3 +1,5 @@
+import hashlib
+import json
 import logging
 import re
 
@@ -41,6 +43,22 @@ def clean_string(text):
     return text.strip()
 
 
+def compute_cohort_fingerprint(definition, data_version=None):
+    """
+    Compute a canonical fingerprint of a cohort definition so that cohorts created from the same definition
+    against the same OMOP data can be reused instead of being recreated.
+    :param definition: normalized cohort creation config dict or a SQL query string, which is fingerprinted as is
+    apart from leading and trailing whitespace since whitespace inside SQL string literals changes the query
+    :param data_version: OMOP data version token the cohort is created against
+    :return: sha256 hex digest string
+    """
+    if isinstance(definition, dict):
+        canonical = json.dumps(definition, sort_keys=True, separators=(",", ":"), default=str)
+    else:
+        canonical = definition.strip()
+    return hashlib.sha256(f"{canonical}\n{data_version}".encode()).hexdigest()
+
+
 def hellinger_distance(p, q):
     """
     Compute the Hellinger distance between two probability distributions.
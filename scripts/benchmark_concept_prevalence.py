@@ -0,0 +1,86 @@
+"""
+This script benchmarks the SQL and bitmap strategies of rolling up cohort concept prevalence to ancestor concepts
+on a cohort, either an existing cohort of a BiasAnalyzer database or one created from a SQL query, and checks that
+both strategies give the same results.
+Example for running this script:
+    python scripts/benchmark_concept_prevalence.py \
+        --config config.yaml \
+        --cohort-query "SELECT person_id, MIN(condition_start_date) AS cohort_start_date, \
+            NULL AS cohort_end_date FROM condition_occurrence GROUP BY person_id" \
+        --concept-type condition_occurrence \
+        --repeats 5
+"""
+
+import argparse
+import sys
+import time
+
+from biasanalyzer.api import BIAS
+from biasanalyzer.cohort_query_builder import CohortQueryBuilder
+from biasanalyzer.database import CONCEPT_STATS_STRATEGIES
+
+
+def time_strategy(bias, cohort_id, concept_type, vocab, filter_count, strategy, repeats):
+    """
+    Time computing the concept stats of a cohort with a strategy, where the first run, which also builds the local
+    vocabulary tables, is timed separately as a warm-up run
+    :return: tuple of the concept stats, the warm-up seconds, and the list of seconds of the repeated runs
+    """
+    qry_builder = CohortQueryBuilder(cohort_creation=False)
+    timings = []
+    for _ in range(repeats + 1):
+        start = time.perf_counter()
+        stats = bias.bias_db.get_cohort_concept_stats(
+            cohort_id, qry_builder, concept_type=concept_type, filter_count=filter_count, vocab=vocab, strategy=strategy
+        )
+        timings.append(time.perf_counter() - start)
+    return stats[concept_type], timings[0], timings[1:]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark concept prevalence roll-up strategies")
+    parser.add_argument("--config", required=True, help="BiasAnalyzer configuration yaml file")
+    cohort_group = parser.add_mutually_exclusive_group(required=True)
+    cohort_group.add_argument("--cohort-id", type=int, help="Cohort definition id of an existing cohort")
+    cohort_group.add_argument("--cohort-query", help="SQL query over the OMOP CDM database to create the cohort")
+    parser.add_argument("--concept-type", default="condition_occurrence", help="OMOP domain of the concepts")
+    parser.add_argument("--vocab", default=None, help="Vocabulary id, default is the vocabulary of the domain")
+    parser.add_argument("--filter-count", type=int, default=0, help="Minimum count threshold for concepts")
+    parser.add_argument("--repeats", type=int, default=3, help="Number of timed runs of each strategy")
+    args = parser.parse_args()
+
+    bias = BIAS(config_file_path=args.config)
+    bias.set_root_omop()
+    if bias.bias_db is None:
+        print("Error: no BiasAnalyzer database could be set up from the configuration file.")
+        sys.exit(1)
+    try:
+        cohort_id = args.cohort_id
+        if args.cohort_query:
+            cohort = bias.create_cohort(
+                "Benchmark cohort", "Concept prevalence benchmark cohort", args.cohort_query, "benchmark"
+            )
+            if cohort is None:
+                print("Error: the cohort could not be created from the cohort query.")
+                sys.exit(1)
+            cohort_id = cohort.cohort_id
+        results = {}
+        for strategy in CONCEPT_STATS_STRATEGIES:
+            stats, warm_up, timings = time_strategy(
+                bias, cohort_id, args.concept_type, args.vocab, args.filter_count, strategy, args.repeats
+            )
+            results[strategy] = sorted(stats, key=lambda s: (s["ancestor_concept_id"], s["descendant_concept_id"]))
+            print(
+                f"{strategy}: {len(stats)} rows, warm-up {warm_up:.3f}s, "
+                f"best {min(timings):.3f}s, mean {sum(timings) / len(timings):.3f}s over {len(timings)} runs"
+            )
+        if results["bitmap"] != results["sql"]:
+            print("Error: the bitmap strategy results differ from the sql strategy results.")
+            sys.exit(1)
+        print("The bitmap and sql strategy results are the same.")
+    finally:
+        bias.cleanup()
+
+
+if __name__ == "__main__":
+    main()
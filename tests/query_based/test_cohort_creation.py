@@ -2,8 +2,9 @@ import datetime
 import logging
 import os
 
+import pandas as pd
 import pytest
-from biasanalyzer.models import DemographicsCriteria, TemporalEvent, TemporalEventGroup
+from biasanalyzer.models import AgeBinSpec, DemographicsCriteria, TemporalEvent, TemporalEventGroup
 from numpy.ma.testutils import assert_equal
 from sqlalchemy.exc import SQLAlchemyError
 
@@ -277,6 +278,45 @@ def test_cohort_comparison(test_db):
     assert {"gender_hellinger_distance": 0.0} in results
     assert any("age_hellinger_distance" in r for r in results)
 
+    from biasanalyzer.utils import hellinger_distance
+
+    cohort_ids = [cohort_study.cohort_id, cohort_base.cohort_id]
+    matrices = bias.compare_cohort_matrix(cohort_ids)
+    assert set(matrices.keys()) == {"age_hellinger_distance", "gender_hellinger_distance"}
+    for variable in ("age", "gender"):
+        matrix = matrices[f"{variable}_hellinger_distance"]
+        assert matrix.index.tolist() == cohort_ids and matrix.columns.tolist() == cohort_ids
+        assert_equal(matrix.to_numpy().diagonal(), [0.0, 0.0])
+        for id1 in cohort_ids:
+            for id2 in cohort_ids:
+                # distances are computed from raw bin counts instead of the rounded probabilities
+                count_col = "bin_count" if variable == "age" else "gender_count"
+                expected = hellinger_distance(
+                    [d[count_col] for d in bias.bias_db.get_cohort_distributions(id1, variable)],
+                    [d[count_col] for d in bias.bias_db.get_cohort_distributions(id2, variable)],
+                )
+                assert abs(matrix.loc[id1, id2] - expected) < 1e-12
+                assert matrix.loc[id1, id2] == matrix.loc[id2, id1]
+    with pytest.raises(ValueError):
+        bias.compare_cohort_matrix(cohort_ids, metrics=["invalid"])
+
+    metrics = ["hellinger", "jensen_shannon", "total_variation", "wasserstein"]
+    matrices = bias.compare_cohort_matrix(cohort_ids, metrics=metrics)
+    assert len(matrices) == 8
+    results = bias.compare_cohorts(
+        cohort_base.cohort_id, cohort_study.cohort_id, metrics=metrics, confidence_level=0.95, seed=0
+    )
+    assert len(results) == 8
+    for result in results:
+        name, ci_name = result.keys()
+        assert ci_name == f"{name}_ci"
+        assert abs(result[name] - matrices[name].loc[cohort_base.cohort_id, cohort_study.cohort_id]) < 1e-12
+        ci_lower, ci_upper = result[ci_name]
+        assert ci_lower <= ci_upper
+    assert {"gender_total_variation_distance": 0.0, "gender_total_variation_distance_ci": (0.0, 0.0)} in results
+    with pytest.raises(ValueError):
+        bias.compare_cohorts(cohort_base.cohort_id, cohort_study.cohort_id, metrics=["invalid"], confidence_level=0.9)
+
 
 def test_cohort_invalid(caplog, test_db):
     caplog.clear()
@@ -312,7 +352,7 @@ def test_create_cohort_sqlalchemy_error(monkeypatch, fresh_bias_obj):
         def get_session(self):
             return self  # not used after error
 
-        def execute_query(self, query):
+        def execute_query(self, query, params=None, output_format="records"):
             raise SQLAlchemyError("Mocked SQLAlchemy error")
 
         def close(self):
@@ -450,3 +490,823 @@ def test_cohort_creation_negative_instance_offset(test_db):
         datetime.date(2020, 11, 28),
         "Incorrect cohort_end_date for patient 1 (last diabetes with +180 day offset)",
     )
+
+
+def test_cohort_columnar_results(test_db):
+    bias = test_db
+    cohort = bias.create_cohort(
+        "COVID-19 patient",
+        "Cohort of young female patients with COVID-19",
+        os.path.join(
+            os.path.dirname(__file__),
+            "..",
+            "assets",
+            "cohort_creation",
+            "test_cohort_creation_condition_occurrence_config_study.yaml",
+        ),
+        "test_user",
+    )
+    assert cohort is not None, "Cohort creation failed"
+    cohort_df = cohort.get_data(output_format="df")
+    assert list(cohort_df.columns) == ["subject_id", "cohort_definition_id", "cohort_start_date", "cohort_end_date"]
+    assert_equal(set(cohort_df["subject_id"]), {item["subject_id"] for item in cohort.data})
+
+    stats_df = cohort.get_stats(output_format="df")
+    assert_equal(stats_df["total_count"].iloc[0], cohort.get_stats()[0]["total_count"])
+    gender_df = cohort.get_distributions("gender", output_format="df")
+    assert_equal(gender_df.to_dict(orient="records"), cohort.get_distributions("gender"))
+
+    omop_df = bias.omop_cdm_db.execute_query("SELECT person_id FROM person ORDER BY person_id", output_format="df")
+    assert_equal(
+        omop_df["person_id"].tolist(),
+        [row["person_id"] for row in bias.omop_cdm_db.execute_query("SELECT person_id FROM person ORDER BY person_id")],
+    )
+    with pytest.raises(ValueError):
+        bias.omop_cdm_db.execute_query("SELECT person_id FROM person", output_format="invalid")
+    with pytest.raises(ValueError):
+        cohort.get_stats(output_format="invalid")
+    with pytest.raises(ValueError):
+        cohort.get_distributions("gender", output_format="invalid")
+
+
+def test_cohort_arrow_results(test_db):
+    pa = pytest.importorskip("pyarrow")
+    bias = test_db
+    cohort = bias.create_cohort(
+        "arrow cohort",
+        "arrow cohort",
+        os.path.join(os.path.dirname(__file__), "..", "assets", "cohort_creation", "test_cohort_creation_config.yaml"),
+        "test_user",
+    )
+    for arrow_results, records in [
+        (cohort.get_data(output_format="arrow"), cohort.get_data()),
+        (cohort.get_stats(output_format="arrow"), cohort.get_stats()),
+        (cohort.get_distributions("gender", output_format="arrow"), cohort.get_distributions("gender")),
+        (
+            bias.omop_cdm_db.execute_query("SELECT person_id FROM person", output_format="arrow"),
+            bias.omop_cdm_db.execute_query("SELECT person_id FROM person"),
+        ),
+    ]:
+        assert isinstance(arrow_results, pa.Table)
+        assert arrow_results.to_pylist() == records
+    profile = cohort.get_profile(output_format="arrow")
+    assert all(isinstance(section, pa.Table) for section in profile.values())
+
+
+def test_cohort_creation_in_engine(caplog, test_db):
+    bias = test_db
+    yaml_file = os.path.join(
+        os.path.dirname(__file__), "..", "assets", "cohort_creation", "test_cohort_creation_config.yaml"
+    )
+    cohort = bias.create_cohort("in-engine cohort", "in-engine cohort", yaml_file, "test_user")
+    in_engine_cohort = bias.create_cohort(
+        "in-engine cohort", "in-engine cohort", yaml_file, "test_user", in_engine=True
+    )
+    assert in_engine_cohort is not None, "In-engine cohort creation failed"
+    assert in_engine_cohort.cohort_id != cohort.cohort_id
+    assert_equal(
+        sorted((item["subject_id"], item["cohort_start_date"], item["cohort_end_date"]) for item in cohort.data),
+        sorted(
+            (item["subject_id"], item["cohort_start_date"], item["cohort_end_date"]) for item in in_engine_cohort.data
+        ),
+    )
+    assert in_engine_cohort.metadata["creation_info"] == cohort.metadata["creation_info"]
+
+    sql_cohort = bias.create_cohort(
+        "in-engine SQL cohort",
+        "in-engine SQL cohort",
+        "SELECT person_id, condition_start_date AS cohort_start_date, condition_end_date AS cohort_end_date "
+        "FROM condition_occurrence WHERE condition_concept_id = 37311061;",
+        "test_user",
+        in_engine=True,
+    )
+    assert_equal({item["subject_id"] for item in sql_cohort.data}, {"108", "110", "111", "112"})
+    # the OMOP tables must not stay visible as unqualified names after in-engine creation
+    assert bias.bias_db.conn.execute("SELECT current_schema()").fetchone()[0] == "biasanalyzer"
+
+    max_id = bias.bias_db.conn.execute("SELECT MAX(id) FROM biasanalyzer.cohort_definition").fetchone()[0]
+    caplog.clear()
+    with caplog.at_level(logging.INFO):
+        empty_cohort = bias.create_cohort(
+            "empty cohort",
+            "empty cohort",
+            "SELECT person_id, condition_start_date AS cohort_start_date, condition_end_date AS cohort_end_date "
+            "FROM condition_occurrence WHERE condition_concept_id = -1",
+            "test_user",
+            in_engine=True,
+        )
+    assert empty_cohort is None
+    assert "No cohort is created" in caplog.text
+    assert bias.bias_db.get_cohort_definition(max_id + 1) == {}
+
+    caplog.clear()
+    with caplog.at_level(logging.INFO):
+        invalid_cohort = bias.create_cohort(
+            "invalid_cohort", "invalid_cohort", "INVALID SQL QUERY STRING", "test_user", in_engine=True
+        )
+    assert invalid_cohort is None
+    assert "Error executing query:" in caplog.text
+
+
+def test_cohort_creation_reuse(caplog, test_db):
+    bias = test_db
+    yaml_file = os.path.join(
+        os.path.dirname(__file__), "..", "assets", "cohort_creation", "test_cohort_creation_offset.yaml"
+    )
+    cohort = bias.create_cohort("reuse cohort", "reuse cohort", yaml_file, "test_user")
+    assert cohort.metadata["fingerprint"] is not None
+    caplog.clear()
+    with caplog.at_level(logging.INFO):
+        reused_cohort = bias.create_cohort(
+            "reuse cohort 2", "reuse cohort 2", yaml_file, "test_user", in_engine=True, reuse_existing=True
+        )
+    assert reused_cohort.cohort_id == cohort.cohort_id
+    assert "reusing it" in caplog.text
+
+    # cohorts are recreated unless reuse is requested
+    new_cohort = bias.create_cohort("reuse cohort 3", "reuse cohort 3", yaml_file, "test_user")
+    assert new_cohort.cohort_id != cohort.cohort_id
+    assert new_cohort.metadata["fingerprint"] == cohort.metadata["fingerprint"]
+
+    query = (
+        "SELECT person_id, condition_start_date AS cohort_start_date, condition_end_date AS cohort_end_date "
+        "FROM condition_occurrence WHERE condition_concept_id = 37311061"
+    )
+    sql_cohort = bias.create_cohort("reuse SQL cohort", "reuse SQL cohort", query, "test_user")
+    # leading and trailing whitespace does not change the cohort definition
+    reused_sql_cohort = bias.create_cohort(
+        "reuse SQL cohort", "reuse SQL cohort", f"  {query}\n", "test_user", reuse_existing=True
+    )
+    assert reused_sql_cohort.cohort_id == sql_cohort.cohort_id
+    assert sql_cohort.metadata["fingerprint"] != cohort.metadata["fingerprint"]
+
+    # whitespace inside SQL string literals changes the cohort definition, so such queries are never reused
+    literal_cohort = bias.create_cohort(
+        "literal cohort", "literal cohort", f"{query} AND 'a  b' <> 'x'", "test_user", reuse_existing=True
+    )
+    other_literal_cohort = bias.create_cohort(
+        "literal cohort", "literal cohort", f"{query} AND 'a b' <> 'x'", "test_user", reuse_existing=True
+    )
+    assert other_literal_cohort.cohort_id != literal_cohort.cohort_id
+    assert other_literal_cohort.metadata["fingerprint"] != literal_cohort.metadata["fingerprint"]
+
+
+def test_cohort_profile(test_db):
+    bias = test_db
+    cohort = bias.create_cohort(
+        "profile cohort",
+        "profile cohort",
+        os.path.join(os.path.dirname(__file__), "..", "assets", "cohort_creation", "test_cohort_creation_config.yaml"),
+        "test_user",
+    )
+    profile = cohort.get_profile()
+    assert set(profile.keys()) == {"basic", "age", "gender", "race", "ethnicity"}
+    assert profile["basic"] == cohort.get_stats()
+    for variable in ("age", "gender", "race", "ethnicity"):
+        assert_equal(
+            sorted(profile[variable], key=lambda r: str(r.get(variable))),
+            sorted(cohort.get_stats(variable), key=lambda r: str(r.get(variable))),
+        )
+    profile_df = cohort.get_profile(output_format="df")
+    assert_equal(profile_df["gender"]["gender_count"].sum(), profile["basic"][0]["total_count"])
+    assert list(profile_df["race"].columns) == ["race", "race_count", "probability"]
+
+    # cohort rows without a matching person only count towards the basic stats
+    bias.bias_db.conn.execute(
+        "INSERT INTO biasanalyzer.cohort (subject_id, cohort_definition_id, cohort_start_date, cohort_end_date) "
+        "VALUES (-1, ?, DATE '2020-01-01', DATE '2020-01-02')",
+        [cohort.cohort_id],
+    )
+    bias.bias_db.invalidate_cohort_cache(cohort.cohort_id)
+    try:
+        profile = cohort.get_profile()
+        assert profile["basic"] == cohort.get_stats()
+        assert sorted(profile["gender"], key=lambda r: r["gender"]) == sorted(
+            cohort.get_stats("gender"), key=lambda r: r["gender"]
+        )
+        assert profile["age"] == cohort.get_stats("age")
+    finally:
+        bias.bias_db.conn.execute(
+            "DELETE FROM biasanalyzer.cohort WHERE subject_id = -1 AND cohort_definition_id = ?", [cohort.cohort_id]
+        )
+        bias.bias_db.invalidate_cohort_cache(cohort.cohort_id)
+
+
+def test_cohort_result_cache(caplog, test_db):
+    bias = test_db
+    cohort = bias.create_cohort(
+        "cached baseline",
+        "cached baseline",
+        os.path.join(
+            os.path.dirname(__file__),
+            "..",
+            "assets",
+            "cohort_creation",
+            "test_cohort_creation_condition_occurrence_config_baseline.yaml",
+        ),
+        "test_user",
+    )
+    bias_db = bias.bias_db
+    bias_db.clear_cache()
+    assert bias_db.cache_info() == {"hits": 0, "misses": 0, "size": 0}
+
+    stats = cohort.get_stats()
+    total_count = stats[0]["total_count"]
+    age_distr = cohort.get_distributions("age")
+    profile = cohort.get_profile()
+    assert bias_db.cache_info() == {"hits": 0, "misses": 3, "size": 3}
+    assert cohort.get_stats() == stats
+    assert cohort.get_distributions("age") == age_distr
+    assert cohort.get_profile() == profile
+    assert bias_db.cache_info() == {"hits": 3, "misses": 3, "size": 3}
+
+    # returned results are copies that can be modified without modifying the cache
+    stats[0]["total_count"] = -1
+    cohort.get_stats(output_format="df").drop(columns=["total_count"], inplace=True)
+    assert cohort.get_stats()[0]["total_count"] == total_count
+    assert "total_count" in cohort.get_stats(output_format="df").columns
+    # variables, age bin specs, and output formats are cached separately
+    cohort.get_distributions("age", age_bins={"edges": [17, 44, 64]})
+    cohort.get_distributions("age", age_bins={"edges": [17, 44, 64]})
+    cohort.get_distributions("gender")
+    assert bias_db.cache_info() == {"hits": 6, "misses": 6, "size": 6}
+
+    # results are cached per OMOP data version
+    data_version = bias_db.omop_catalog.get_data_version()
+    bias_db.omop_catalog._cached_data_version = "new-version"
+    assert cohort.get_stats()[0]["total_count"] == total_count
+    assert bias_db.cache_info() == {"hits": 6, "misses": 7, "size": 7}
+    bias_db.omop_catalog._cached_data_version = data_version
+
+    # writing rows of the cohort invalidates its cached results only
+    other_cohort_key = (cohort.cohort_id + 1000, data_version, "stats", "", None, "records")
+    bias_db._result_cache[other_cohort_key] = []
+    cohort_df = cohort.get_data(output_format="df")
+    bias_db.create_cohort_in_bulk(cohort_df)
+    assert bias_db.cache_info()["size"] == 1
+    assert cohort.get_stats()[0]["total_count"] == 2 * total_count
+
+    caplog.clear()
+    with caplog.at_level(logging.INFO):
+        assert bias.delete_cohort(cohort.cohort_id) is True
+        assert bias.delete_cohort(cohort.cohort_id) is False
+    assert "does not exist" in caplog.text
+    assert bias_db.get_cohort_definition(cohort.cohort_id) == {}
+    assert cohort.get_stats()[0]["total_count"] == 0
+    bias_db.clear_cache()
+
+
+def test_multiple_cohorts_stats(caplog, test_db):
+    bias = test_db
+    asset_dir = os.path.join(os.path.dirname(__file__), "..", "assets", "cohort_creation")
+    cohorts = [
+        bias.create_cohort(name, name, os.path.join(asset_dir, yaml_file), "test_user")
+        for name, yaml_file in [
+            ("multi baseline", "test_cohort_creation_condition_occurrence_config_baseline.yaml"),
+            ("multi study", "test_cohort_creation_condition_occurrence_config_study.yaml"),
+            ("multi config", "test_cohort_creation_config.yaml"),
+        ]
+    ]
+    cohort_ids = [cohort.cohort_id for cohort in cohorts]
+    # a cohort id without any cohort data is kept with zero counts
+    missing_id = max(cohort_ids) + 1000
+
+    for variable in ("", "age", "gender", "race", "ethnicity"):
+        stats_df = bias.get_cohorts_stats(cohort_ids + [missing_id], variable=variable)
+        assert list(stats_df.columns)[0] == "cohort_definition_id"
+        for cohort in cohorts:
+            cohort_df = stats_df[stats_df["cohort_definition_id"] == cohort.cohort_id].drop(
+                columns=["cohort_definition_id"]
+            )
+            single_df = cohort.get_stats(variable=variable, output_format="df")
+            sort_cols = [variable] if variable in ("gender", "race", "ethnicity") else list(single_df.columns[:1])
+            pd.testing.assert_frame_equal(
+                cohort_df.sort_values(sort_cols).reset_index(drop=True),
+                single_df.sort_values(sort_cols).reset_index(drop=True),
+                # columns of the cohort without data are NULL, which makes integer columns float in the batch
+                check_dtype=False,
+            )
+    basic_stats_df = bias.get_cohorts_stats(cohort_ids + [missing_id])
+    assert basic_stats_df["cohort_definition_id"].tolist() == sorted(cohort_ids + [missing_id])
+    assert basic_stats_df["total_count"].tolist()[-1] == 0
+
+    for variable in ("age", "gender"):
+        distr_df = bias.get_cohorts_distributions(cohort_ids + [missing_id], variable)
+        for cohort in cohorts:
+            pd.testing.assert_frame_equal(
+                distr_df[distr_df["cohort_definition_id"] == cohort.cohort_id]
+                .drop(columns=["cohort_definition_id"])
+                .reset_index(drop=True),
+                cohort.get_distributions(variable, output_format="df"),
+            )
+        assert distr_df[distr_df["cohort_definition_id"] == missing_id].iloc[:, 2].sum() == 0
+
+    assert bias.get_cohorts_stats(cohort_ids, output_format="records")[0]["cohort_definition_id"] == min(cohort_ids)
+    caplog.clear()
+    with caplog.at_level(logging.ERROR):
+        assert bias.get_cohorts_stats(cohort_ids, variable="address") is None
+        assert bias.get_cohorts_distributions([], "age") is None
+    assert "is not available" in caplog.text
+    assert "At least one cohort definition id" in caplog.text
+
+
+def test_age_bin_spec():
+    assert AgeBinSpec().get_labels() == [
+        "0-10",
+        "11-20",
+        "21-30",
+        "31-40",
+        "41-50",
+        "51-60",
+        "61-70",
+        "71-80",
+        "81-90",
+        "91+",
+    ]
+    assert AgeBinSpec(width=5, num_bins=3).get_labels() == ["0-5", "6-10", "11+"]
+    assert AgeBinSpec(edges=[17, 44, 64]).get_labels() == ["0-17", "18-44", "45-64", "65+"]
+    for invalid_spec in ({"edges": [44, 17]}, {"edges": []}, {"edges": [-1, 10]}, {"width": 0}, {"num_bins": -1}):
+        with pytest.raises(ValueError):
+            AgeBinSpec(**invalid_spec)
+
+
+def test_cohort_age_bins(caplog, test_db):
+    bias = test_db
+    cohort = bias.create_cohort(
+        "age bins baseline",
+        "age bins baseline",
+        os.path.join(
+            os.path.dirname(__file__),
+            "..",
+            "assets",
+            "cohort_creation",
+            "test_cohort_creation_condition_occurrence_config_baseline.yaml",
+        ),
+        "test_user",
+    )
+    default_distr = cohort.get_distributions("age")
+    assert [item["age_bin"] for item in default_distr] == AgeBinSpec().get_labels()
+    assert cohort.get_distributions("age", age_bins=AgeBinSpec()) == default_distr
+
+    edges_distr = cohort.get_distributions("age", age_bins={"edges": [17, 44, 64]})
+    assert [item["age_bin"] for item in edges_distr] == ["0-17", "18-44", "45-64", "65+"]
+    assert sum(item["bin_count"] for item in edges_distr) == sum(item["bin_count"] for item in default_distr)
+    assert sum(item["probability"] for item in edges_distr) == pytest.approx(1.0)
+    # bins are ignored for non-age variables
+    assert cohort.get_distributions("gender", age_bins={"width": 5}) == cohort.get_distributions("gender")
+
+    width_df = bias.get_cohorts_distributions([cohort.cohort_id], "age", age_bins={"width": 5, "num_bins": 20})
+    assert width_df["age_bin"].tolist() == AgeBinSpec(width=5, num_bins=20).get_labels()
+
+    matrix = bias.compare_cohort_matrix([cohort.cohort_id], age_bins={"edges": [17, 44, 64]})
+    assert matrix["age_hellinger_distance"].shape == (1, 1)
+    assert bias.compare_cohorts(cohort.cohort_id, cohort.cohort_id, age_bins={"width": 20, "num_bins": 5}) == [
+        {"age_hellinger_distance": 0.0},
+        {"gender_hellinger_distance": 0.0},
+    ]
+    caplog.clear()
+    with caplog.at_level(logging.ERROR):
+        assert cohort.get_distributions("age", age_bins={"edges": [10, 10]}) is None
+    assert "strictly increasing" in caplog.text
+
+
+def test_cohort_approximate_stats(test_db):
+    bias = test_db
+    cohort = bias.create_cohort(
+        "approximate baseline",
+        "approximate baseline",
+        os.path.join(
+            os.path.dirname(__file__),
+            "..",
+            "assets",
+            "cohort_creation",
+            "test_cohort_creation_condition_occurrence_config_baseline.yaml",
+        ),
+        "test_user",
+    )
+    for variable, median_col in (("", "median_duration"), ("age", "median_age")):
+        exact_stats = cohort.get_stats(variable)[0]
+        approx_stats = cohort.get_stats(variable, approximate=True)[0]
+        assert f"{median_col}_lower" not in exact_stats
+        assert list(approx_stats.keys()) == [
+            key
+            for col in exact_stats
+            for key in ((col, f"{col}_lower", f"{col}_upper") if col == median_col else (col,))
+        ]
+        for col, value in exact_stats.items():
+            if col != median_col:
+                assert approx_stats[col] == value
+        assert approx_stats[f"{median_col}_lower"] <= approx_stats[median_col] <= approx_stats[f"{median_col}_upper"]
+        assert all(isinstance(approx_stats[f"{median_col}_{bound}"], int) for bound in ("lower", "upper"))
+        assert approx_stats[f"{median_col}_lower"] <= exact_stats[median_col] <= approx_stats[f"{median_col}_upper"]
+
+    approx_df = bias.get_cohorts_stats([cohort.cohort_id], variable="age", approximate=True)
+    assert (
+        approx_df.to_dict(orient="records")[0]["median_age"]
+        == cohort.get_stats("age", approximate=True)[0]["median_age"]
+    )
+
+
+def test_cohort_stratified_stats(caplog, test_db):
+    bias = test_db
+    asset_dir = os.path.join(os.path.dirname(__file__), "..", "assets", "cohort_creation")
+    cohorts = [
+        bias.create_cohort(name, name, os.path.join(asset_dir, yaml_file), "test_user")
+        for name, yaml_file in [
+            ("stratified baseline", "test_cohort_creation_condition_occurrence_config_baseline.yaml"),
+            ("stratified config", "test_cohort_creation_config.yaml"),
+        ]
+    ]
+    cohort = cohorts[0]
+    strata = cohort.get_stratified_stats(["age_bin", "gender", "race"])
+    assert list(strata[0].keys()) == ["dimensions", "age_bin", "gender", "race", "person_count", "probability"]
+    # CUBE cross-tabulates all 8 combinations of the 3 dimensions including the whole cohort
+    assert {row["dimensions"] for row in strata} == {
+        "",
+        "age_bin",
+        "gender",
+        "race",
+        "age_bin,gender",
+        "age_bin,race",
+        "gender,race",
+        "age_bin,gender,race",
+    }
+    total = cohort.get_stats("age")[0]["total_count"]
+    assert [row["person_count"] for row in strata if row["dimensions"] == ""] == [total]
+    for dimensions in {row["dimensions"] for row in strata}:
+        rows = [row for row in strata if row["dimensions"] == dimensions]
+        assert sum(row["person_count"] for row in rows) == total
+        assert abs(sum(row["probability"] for row in rows) - 1) < 1e-9
+
+    # strata of a single dimension match the per-variable stats and distributions
+    for variable in ("gender", "race"):
+        assert {row[variable]: row["person_count"] for row in strata if row["dimensions"] == variable} == {
+            row[variable]: row[f"{variable}_count"] for row in cohort.get_stats(variable)
+        }
+    assert {row["age_bin"]: row["person_count"] for row in strata if row["dimensions"] == "age_bin"} == {
+        row["age_bin"]: row["bin_count"] for row in cohort.get_distributions("age") if row["bin_count"] > 0
+    }
+
+    # grouping sets, named dimensions, person columns, and custom age bins
+    strata_df = cohort.get_stratified_stats(
+        ["birth_decade", "year_of_birth", "age_bin"],
+        grouping_sets=[["birth_decade"], ["year_of_birth", "age_bin"]],
+        age_bins={"edges": [17, 44, 64]},
+        output_format="df",
+    )
+    assert set(strata_df["dimensions"]) == {"birth_decade", "year_of_birth,age_bin"}
+    decade_df = strata_df[strata_df["dimensions"] == "birth_decade"]
+    assert (decade_df["birth_decade"] % 10 == 0).all()
+    assert set(strata_df["age_bin"].dropna()) <= {"0-17", "18-44", "45-64", "65+"}
+
+    cohort_ids = [c.cohort_id for c in cohorts]
+    grouping_sets = [["gender"], ["gender", "ethnicity"]]
+    cohorts_df = bias.get_cohorts_stratified_stats(cohort_ids, ["gender", "ethnicity"], grouping_sets=grouping_sets)
+    assert list(cohorts_df.columns) == [
+        "cohort_definition_id",
+        "dimensions",
+        "gender",
+        "ethnicity",
+        "person_count",
+        "probability",
+    ]
+    pd.testing.assert_frame_equal(
+        cohorts_df[cohorts_df["cohort_definition_id"] == cohort.cohort_id]
+        .drop(columns=["cohort_definition_id"])
+        .reset_index(drop=True),
+        cohort.get_stratified_stats(["gender", "ethnicity"], grouping_sets=grouping_sets, output_format="df"),
+    )
+
+    caplog.clear()
+    with caplog.at_level(logging.ERROR):
+        assert cohort.get_stratified_stats([]) is None
+        assert cohort.get_stratified_stats(['gender" FROM person; --']) is None
+        assert cohort.get_stratified_stats(["gender"], grouping_sets=[["race"]]) is None
+        assert cohort.get_stratified_stats(["gender", "race"], grouping_sets=[["race"]]) is None
+    assert "At least one stratification dimension" in caplog.text
+    assert "is not available" in caplog.text
+    assert "are not in ['gender']" in caplog.text
+    assert "are not in any of the grouping sets" in caplog.text
+    with pytest.raises(ValueError, match="Invalid output_format"):
+        cohort.get_stratified_stats(["gender"], output_format="bogus")
+
+
+def test_cohort_temporal_distribution(caplog, test_db):
+    bias = test_db
+    asset_dir = os.path.join(os.path.dirname(__file__), "..", "assets", "cohort_creation")
+    cohorts = [
+        bias.create_cohort(name, name, os.path.join(asset_dir, yaml_file), "test_user")
+        for name, yaml_file in [
+            ("temporal baseline", "test_cohort_creation_condition_occurrence_config_baseline.yaml"),
+            ("temporal config", "test_cohort_creation_config.yaml"),
+        ]
+    ]
+    cohort = cohorts[0]
+    cohort_df = cohort.get_data(output_format="df")
+    start_dates = pd.to_datetime(cohort_df["cohort_start_date"])
+    for granularity, period_freq in (("month", "M"), ("quarter", "Q"), ("year", "Y")):
+        distr = cohort.get_temporal_distribution(granularity)
+        assert list(distr[0].keys()) == ["period", "entry_count", "probability"]
+        expected_counts = start_dates.dt.to_period(period_freq).dt.start_time.dt.date.value_counts()
+        periods = [row["period"] for row in distr]
+        # periods are contiguous from the earliest to the latest entry with zero counts in between
+        assert periods == sorted(periods)
+        assert periods[0] == min(expected_counts.index) and periods[-1] == max(expected_counts.index)
+        assert len(periods) == len(pd.period_range(start_dates.min(), start_dates.max(), freq=period_freq))
+        assert {
+            row["period"]: row["entry_count"] for row in distr if row["entry_count"] > 0
+        } == expected_counts.to_dict()
+        assert sum(row["entry_count"] for row in distr) == len(cohort_df)
+        assert abs(sum(row["probability"] for row in distr) - 1) < 1e-9
+
+    cohort_ids = [c.cohort_id for c in cohorts]
+    distr_df = bias.get_cohorts_temporal_distribution(cohort_ids, granularity="year")
+    assert list(distr_df.columns) == ["cohort_definition_id", "period", "entry_count", "probability"]
+    # all cohorts share the same periods
+    periods_by_cohort = distr_df.groupby("cohort_definition_id")["period"].apply(list)
+    assert periods_by_cohort[cohort_ids[0]] == periods_by_cohort[cohort_ids[1]]
+    for c in cohorts:
+        assert distr_df[distr_df["cohort_definition_id"] == c.cohort_id]["entry_count"].sum() == len(c.data)
+
+    caplog.clear()
+    with caplog.at_level(logging.ERROR):
+        assert cohort.get_temporal_distribution("decade") is None
+        assert bias.get_cohorts_temporal_distribution(cohort_ids, granularity="hour") is None
+    assert "Invalid granularity" in caplog.text
+    with pytest.raises(ValueError, match="Invalid output_format"):
+        cohort.get_temporal_distribution(output_format="bogus")
+
+
+def test_cohort_creation_batch(caplog, test_db):
+    bias = test_db
+    asset_dir = os.path.join(os.path.dirname(__file__), "..", "assets", "cohort_creation")
+    query_or_yaml_files = [
+        os.path.join(asset_dir, "test_cohort_creation_condition_occurrence_config_baseline.yaml"),
+        os.path.join(asset_dir, "test_cohort_creation_condition_occurrence_config_study.yaml"),
+        os.path.join(asset_dir, "test_cohort_creation_config.yaml"),
+        os.path.join(asset_dir, "test_cohort_creation_negative_instance_offset.yaml"),
+        "SELECT person_id, condition_start_date AS cohort_start_date, condition_end_date AS cohort_end_date "
+        "FROM condition_occurrence WHERE condition_concept_id = 37311061",
+    ]
+    cohort_specs = [
+        {
+            "cohort_name": f"batch cohort {idx}",
+            "cohort_desc": f"batch cohort {idx}",
+            "query_or_yaml_file": query_or_yaml_file,
+            "created_by": "test_user",
+        }
+        for idx, query_or_yaml_file in enumerate(query_or_yaml_files)
+    ]
+
+    def cohort_rows(cohort):
+        return sorted((item["subject_id"], item["cohort_start_date"], item["cohort_end_date"]) for item in cohort.data)
+
+    single_cohorts = [bias.create_cohort(**spec) for spec in cohort_specs]
+    batch_cohorts = bias.create_cohorts(cohort_specs)
+    assert len(batch_cohorts) == len(cohort_specs)
+    for single_cohort, batch_cohort in zip(single_cohorts, batch_cohorts):
+        assert batch_cohort.cohort_id != single_cohort.cohort_id
+        assert_equal(cohort_rows(batch_cohort), cohort_rows(single_cohort))
+        assert batch_cohort.metadata["creation_info"] == single_cohort.metadata["creation_info"]
+    # shared domain event tables are dropped after the batch is created
+    assert bias.bias_db.conn.execute("SELECT COUNT(*) FROM duckdb_tables() WHERE temporary").fetchone()[0] == 0
+
+    caplog.clear()
+    with caplog.at_level(logging.INFO):
+        reused_cohorts = bias.create_cohorts(
+            cohort_specs[:2]
+            + [cohort_specs[0], {**cohort_specs[0], "query_or_yaml_file": os.path.join(asset_dir, "missing.yaml")}],
+            reuse_existing=True,
+        )
+    assert [cohort.cohort_id for cohort in reused_cohorts[:3]] == [
+        batch_cohorts[0].cohort_id,
+        batch_cohorts[1].cohort_id,
+        batch_cohorts[0].cohort_id,
+    ]
+    assert reused_cohorts[3] is None
+    assert "does not exist" in caplog.text
+
+
+def test_cohort_queries_in_parallel(test_db):
+    import threading
+
+    from biasanalyzer.background.threading_utils import run_in_parallel
+
+    bias = test_db
+    cohort = bias.create_cohort(
+        "parallel cohort",
+        "parallel cohort",
+        os.path.join(os.path.dirname(__file__), "..", "assets", "cohort_creation", "test_cohort_creation_config.yaml"),
+        "test_user",
+    )
+    tasks = [
+        cohort.get_stats,
+        (cohort.get_stats, ("gender",)),
+        (cohort.get_distributions, ("age",)),
+        (cohort.get_distributions, (), {"variable": "gender"}),
+        lambda: cohort.get_concept_stats(concept_type="condition_occurrence")[0],
+        lambda: bias.omop_cdm_db.execute_query("SELECT COUNT(*) AS n FROM person"),
+    ]
+    serial_results = [
+        cohort.get_stats(),
+        cohort.get_stats("gender"),
+        cohort.get_distributions("age"),
+        cohort.get_distributions(variable="gender"),
+        cohort.get_concept_stats(concept_type="condition_occurrence")[0],
+        bias.omop_cdm_db.execute_query("SELECT COUNT(*) AS n FROM person"),
+    ]
+    assert run_in_parallel(tasks, max_workers=4) == serial_results
+    assert run_in_parallel([]) == []
+    with pytest.raises(ValueError):
+        run_in_parallel([cohort.get_stats, (cohort.get_concept_stats, ("dummy_invalid",))])
+
+    # worker threads get their own cursor on the shared database rather than the connection of the main thread
+    worker_conns = []
+    worker = threading.Thread(target=lambda: worker_conns.append((bias.bias_db.conn, bias.bias_db.conn)))
+    worker.start()
+    worker.join()
+    worker_conn, same_worker_conn = worker_conns[0]
+    assert worker_conn is same_worker_conn
+    assert worker_conn is not bias.bias_db.conn
+    assert worker_conn.execute("SELECT current_schema()").fetchone()[0] == "biasanalyzer"
+
+
+def test_cohort_async_api(test_db):
+    import asyncio
+    import time
+
+    from biasanalyzer.background.threading_utils import get_cancellation_token, run_async, set_async_max_workers
+
+    bias = test_db
+    yaml_file = os.path.join(
+        os.path.dirname(__file__), "..", "assets", "cohort_creation", "test_cohort_creation_config.yaml"
+    )
+
+    async def fan_out():
+        cohort = await bias.acreate_cohort("async cohort", "async cohort", yaml_file, "test_user")
+        return cohort, await asyncio.gather(
+            cohort.aget_stats(),
+            cohort.aget_distributions("age"),
+            cohort.aget_data(),
+            cohort.aget_concept_stats(concept_type="condition_occurrence"),
+            bias.acompare_cohorts(cohort.cohort_id, cohort.cohort_id),
+            bias.acompare_cohorts(cohort.cohort_id, cohort.cohort_id, confidence_level=0.95, n_resamples=50, seed=0),
+        )
+
+    cohort, (stats, age_distr, data, concept_stats, comparison, ci_comparison) = asyncio.run(fan_out())
+    assert stats == cohort.get_stats()
+    assert age_distr == cohort.get_distributions("age")
+    assert data == cohort.get_data()
+    assert concept_stats[0] == cohort.get_concept_stats(concept_type="condition_occurrence")[0]
+    assert comparison == bias.compare_cohorts(cohort.cohort_id, cohort.cohort_id)
+    assert ci_comparison == bias.compare_cohorts(
+        cohort.cohort_id, cohort.cohort_id, confidence_level=0.95, n_resamples=50, seed=0
+    )
+
+    async def cancel_long_query():
+        long_query = asyncio.ensure_future(
+            run_async(
+                bias.omop_cdm_db.execute_query,
+                "SELECT SUM(i) AS total FROM range(1000000000000) t(i)",
+            )
+        )
+        await asyncio.sleep(0.5)
+        long_query.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await long_query
+        # the only worker thread is available again once the cancelled query is interrupted
+        return await asyncio.wait_for(bias.aget_cohort(cohort.cohort_id), timeout=30)
+
+    def count_persons(tokens):
+        tokens.append(get_cancellation_token())
+        return bias.omop_cdm_db.execute_query("SELECT COUNT(*) AS n FROM person")
+
+    async def cancel_after_return():
+        tokens = []
+        expected = await run_async(count_persons, tokens)
+        # cancelling a call whose function has returned must not interrupt the next call on the same pool thread
+        tokens[0].cancel()
+        assert not tokens[0]._interrupts
+        return expected, await run_async(count_persons, tokens), tokens
+
+    set_async_max_workers(1)
+    try:
+        start = time.time()
+        assert asyncio.run(cancel_long_query()).cohort_id == cohort.cohort_id
+        assert time.time() - start < 30
+        expected, result, tokens = asyncio.run(cancel_after_return())
+        assert result == expected
+        assert tokens[0] is not tokens[1] and not tokens[1].cancelled
+    finally:
+        set_async_max_workers(None)
+
+
+def test_cohort_creation_timeout_and_cancel(caplog, test_db):
+    import threading
+    import time
+
+    from biasanalyzer.background.threading_utils import CancellableTask
+
+    bias = test_db
+    runaway_query = (
+        "SELECT i % 100 AS person_id, DATE '2020-01-01' AS cohort_start_date, "
+        "DATE '2020-01-01' + CAST(SUM(i) % 10 AS INTEGER) AS cohort_end_date "
+        "FROM range(1000000000000) t(i) GROUP BY i % 100"
+    )
+    max_id = bias.bias_db.conn.execute("SELECT COALESCE(MAX(id), 0) FROM biasanalyzer.cohort_definition").fetchone()[0]
+    caplog.clear()
+    start = time.time()
+    with caplog.at_level(logging.INFO):
+        cohort = bias.create_cohort("runaway", "runaway", runaway_query, "test_user", in_engine=True, timeout=0.5)
+    assert cohort is None
+    assert time.time() - start < 30
+    assert "timed out" in caplog.text
+    # the interrupted cohort creation is rolled back
+    assert bias.bias_db.get_cohort_definition(max_id + 1) == {}
+
+    handle = bias.create_cohort("runaway", "runaway", runaway_query, "test_user", return_handle=True)
+    time.sleep(0.5)
+    assert not handle.done()
+    assert handle.cancel()
+    assert handle.result(timeout=30) is None
+    assert handle.cancelled and not handle.timed_out
+    assert not handle.cancel()
+
+    yaml_file = os.path.join(
+        os.path.dirname(__file__), "..", "assets", "cohort_creation", "test_cohort_creation_config.yaml"
+    )
+    # cancelling before the cohort query starts stops the cohort creation and writes nothing
+    cohort_def_count = len(bias.bias_db.get_cohort_definitions())
+    for in_engine in (False, True):
+        cohort = bias.create_cohort("cancelled", "cancelled", yaml_file, "test_user", in_engine=in_engine, timeout=1e-6)
+        assert cohort is None
+    started = threading.Event()
+    handle = CancellableTask(
+        lambda: started.wait(30) and bias.create_cohort("cancelled", "cancelled", yaml_file, "test_user")
+    )
+    assert handle.cancel()
+    started.set()
+    assert handle.result(timeout=30) is None
+    assert handle.cancelled
+    assert len(bias.bias_db.get_cohort_definitions()) == cohort_def_count
+
+    # a cancellation arriving after the operation completed does not discard its result
+    started.clear()
+    handle = CancellableTask(lambda: started.wait(30) and "done")
+    assert handle.cancel()
+    started.set()
+    assert handle.result(timeout=30) == "done"
+    assert not handle.cancelled
+
+    handle = bias.create_cohort("handle cohort", "handle cohort", yaml_file, "test_user", return_handle=True)
+    cohort = handle.result(timeout=30)
+    assert cohort is not None and handle.done()
+    assert not handle.cancel()
+    concept_stats_handle = cohort.get_concept_stats(return_handle=True)
+    assert concept_stats_handle.result()[0] == cohort.get_concept_stats()[0]
+    assert cohort.get_concept_stats(timeout=30)[0] == cohort.get_concept_stats()[0]
+    with pytest.raises(ValueError):
+        cohort.get_concept_stats(concept_type="dummy_invalid", timeout=30)
+    assert bias.compare_cohorts(cohort.cohort_id, cohort.cohort_id, timeout=30) == bias.compare_cohorts(
+        cohort.cohort_id, cohort.cohort_id
+    )
+
+
+def test_compute_cohort_fingerprint():
+    from biasanalyzer.utils import compute_cohort_fingerprint
+
+    config = {"inclusion_criteria": {"demographics": {"gender": "female", "min_birth_year": 1970}}}
+    reordered_config = {"inclusion_criteria": {"demographics": {"min_birth_year": 1970, "gender": "female"}}}
+    assert compute_cohort_fingerprint(config, "v1") == compute_cohort_fingerprint(reordered_config, "v1")
+    assert compute_cohort_fingerprint(config, "v1") != compute_cohort_fingerprint(config, "v2")
+    assert compute_cohort_fingerprint(" SELECT 1\n", "v1") == compute_cohort_fingerprint("SELECT 1", "v1")
+    # whitespace inside SQL string literals changes the query
+    assert compute_cohort_fingerprint("SELECT 'a  b'", "v1") != compute_cohort_fingerprint("SELECT 'a b'", "v1")
+
+
+def test_cohort_creation_query_predicate_pushdown():
+    from biasanalyzer.cohort_query_builder import CohortQueryBuilder
+    from biasanalyzer.config import load_cohort_creation_config
+
+    qry_builder = CohortQueryBuilder()
+    config = load_cohort_creation_config(
+        os.path.join(
+            os.path.dirname(__file__), "..", "assets", "cohort_creation", "test_cohort_creation_negative_instance.yaml"
+        )
+    )
+    query = qry_builder.build_query_cohort_creation(config)
+    # referenced concept ids and inclusion demographics are pushed down into a single ranked CTE per domain
+    assert "condition_concept_id IN (201826)" in query
+    assert "person_id IN (SELECT person_id FROM qualifying_persons)" in query
+    assert query.count("ranked_condition_occurrence AS") == 1
+    assert "event_instance_desc = 1" in query
+
+    config = load_cohort_creation_config(
+        os.path.join(os.path.dirname(__file__), "..", "assets", "cohort_creation", "test_cohort_creation_config.yaml")
+    )
+    query = qry_builder.build_query_cohort_creation(config)
+    assert "visit_concept_id IN (9202, 9203)" in query
+    assert "procedure_concept_id IN (619339, 4048609)" in query
+    # no event instance is referenced for drug exposure, so no window needs to be computed
+    drug_cte = query[query.index("ranked_drug_exposure AS") : query.index("ranked_procedure_occurrence AS")]
+    assert "ROW_NUMBER()" not in drug_cte
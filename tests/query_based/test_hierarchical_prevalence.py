@@ -1,4 +1,7 @@
+import logging
+
 import pytest
+from biasanalyzer.cohort_query_builder import CohortQueryBuilder
 from biasanalyzer.concept import ConceptHierarchy
 from numpy.ma.testutils import assert_equal
 
@@ -74,6 +77,122 @@ def test_cohort_concept_hierarchical_prevalence(test_db, caplog):
     )
 
 
+def test_cohort_concept_approximate_prevalence(test_db):
+    cohort_query = """
+        SELECT person_id, condition_concept_id, 
+        condition_start_date as cohort_start_date, 
+        condition_end_date as cohort_end_date
+        FROM condition_occurrence;
+    """
+    cohort = test_db.create_cohort(
+        "Diabetes Cohort", "Cohort of patients with diabetes-related conditions", cohort_query, "test_user"
+    )
+    exact_stats, exact_hierarchy = cohort.get_concept_stats(vocab="ICD10CM")
+    approx_stats, approx_hierarchy = cohort.get_concept_stats(vocab="ICD10CM", approximate=True)
+    # approximate results are cached separately from exact ones
+    assert approx_hierarchy is not exact_hierarchy
+    assert approx_hierarchy.identifier == f"{exact_hierarchy.identifier}-approx"
+
+    exact_counts = {
+        (s["ancestor_concept_id"], s["descendant_concept_id"]): s["count_in_cohort"]
+        for s in exact_stats["condition_occurrence"]
+    }
+    assert "count_in_cohort_lower" not in exact_stats["condition_occurrence"][0]
+    assert len(approx_stats["condition_occurrence"]) > 0
+    for s in approx_stats["condition_occurrence"]:
+        assert s["count_in_cohort_lower"] <= s["count_in_cohort"] <= s["count_in_cohort_upper"]
+        assert s["prevalence_lower"] <= s["prevalence"] <= s["prevalence_upper"] <= 1
+        exact_count = exact_counts[(s["ancestor_concept_id"], s["descendant_concept_id"])]
+        assert s["count_in_cohort_lower"] <= exact_count <= s["count_in_cohort_upper"]
+
+
+def test_concept_prevalence_local_vocab_tables(test_db, caplog):
+    cohort_query = """
+        SELECT person_id, condition_concept_id, 
+        condition_start_date as cohort_start_date, 
+        condition_end_date as cohort_end_date
+        FROM condition_occurrence;
+    """
+    cohort = test_db.create_cohort(
+        "Diabetes Cohort", "Cohort of patients with diabetes-related conditions", cohort_query, "test_user"
+    )
+    bias_db = test_db.bias_db
+    qry_builder = CohortQueryBuilder(cohort_creation=False)
+    bias_db.get_cohort_concept_stats(cohort.cohort_id, qry_builder, vocab="ICD10CM")
+    vocab_tables = bias_db.get_vocab_tables("ICD10CM")
+    assert set(vocab_tables) == {"concept_ancestor", "concept"}
+    local_vocabs = bias_db.conn.table(vocab_tables["concept"]).select("vocabulary_id").distinct().fetchall()
+    assert local_vocabs == [("ICD10CM",)]
+
+    # repeated prevalence queries reuse the local vocabulary tables without rebuilding them
+    caplog.clear()
+    with caplog.at_level(logging.INFO):
+        for _ in range(3):
+            bias_db.get_cohort_concept_stats(cohort.cohort_id, qry_builder, vocab="ICD10CM")
+    assert "vocabulary tables created" not in caplog.text
+    assert bias_db.get_vocab_tables("ICD10CM") == vocab_tables
+
+    # the prevalence query gives the same results against the local tables as against the OMOP vocabulary tables
+    def get_results(tables):
+        query = qry_builder.build_concept_prevalence_query(
+            bias_db.schema,
+            bias_db.omop_alias,
+            "condition_occurrence",
+            cohort.cohort_id,
+            0,
+            "ICD10CM",
+            vocab_tables=tables,
+        )
+        return bias_db.conn.execute(query).fetchdf().sort_values(["ancestor_concept_id", "descendant_concept_id"])
+
+    local_results = get_results(vocab_tables)
+    assert not local_results.empty
+    assert local_results.reset_index(drop=True).equals(get_results(None).reset_index(drop=True))
+
+    # the local tables are rebuilt for a new OMOP data version
+    caplog.clear()
+    with caplog.at_level(logging.INFO):
+        assert bias_db.get_vocab_tables("ICD10CM", omop_version="new-version") == vocab_tables
+    assert "Local ICD10CM vocabulary tables created." in caplog.text
+
+
+def test_cohort_multi_domain_concept_stats(test_db):
+    cohort_query = """
+        SELECT person_id, condition_concept_id, 
+        condition_start_date as cohort_start_date, 
+        condition_end_date as cohort_end_date
+        FROM condition_occurrence;
+    """
+    cohort = test_db.create_cohort(
+        "Diabetes Cohort", "Cohort of patients with diabetes-related conditions", cohort_query, "test_user"
+    )
+    concept_types = ["condition_occurrence", "drug_exposure", "procedure_occurrence"]
+    vocabs = {"condition_occurrence": "ICD10CM"}
+    connection_managers = [test_db.bias_db._connections, test_db.omop_cdm_db._engine]
+    open_cursors = [dict(manager._cursors) for manager in connection_managers]
+    stats, hierarchies = cohort.get_concept_stats(concept_types=concept_types, vocab=vocabs)
+    # the worker threads close their cursors once their domain queries complete
+    assert [manager._cursors for manager in connection_managers] == open_cursors
+    assert list(stats) == concept_types
+    assert list(hierarchies) == concept_types
+    # results of the concurrent per-domain queries are the same as those of one call per domain
+    for concept_type in concept_types:
+        domain_stats, domain_hierarchy = cohort.get_concept_stats(
+            concept_type=concept_type, vocab=vocabs.get(concept_type)
+        )
+        assert stats[concept_type] == domain_stats[concept_type]
+        assert hierarchies[concept_type] is domain_hierarchy
+    assert len(stats["condition_occurrence"]) > 0
+    assert stats["procedure_occurrence"] == []
+
+    handle = cohort.get_concept_stats(concept_types=concept_types, vocab=vocabs, return_handle=True)
+    assert handle.result()[0] == stats
+    with pytest.raises(ValueError):
+        cohort.get_concept_stats(concept_types=["condition_occurrence", "dummy_invalid"])
+    with pytest.raises(ValueError):
+        cohort.get_concept_stats(concept_types=[])
+
+
 def test_identifier_normalization_and_cache():
     ConceptHierarchy.clear_cache()
     # identifiers are normalized
@@ -286,3 +405,32 @@ def test_traversal_and_serialization():
             }
         ]
     }
+
+
+def test_cohort_concept_stats_bitmap_strategy(test_db):
+    cohort_query = """
+        SELECT person_id, condition_concept_id, 
+        condition_start_date as cohort_start_date, 
+        condition_end_date as cohort_end_date
+        FROM condition_occurrence;
+    """
+    cohort = test_db.create_cohort(
+        "Diabetes Cohort", "Cohort of patients with diabetes-related conditions", cohort_query, "test_user"
+    )
+
+    def sort_stats(stats):
+        return sorted(stats, key=lambda s: (s["ancestor_concept_id"], s["descendant_concept_id"]))
+
+    # the bitmap roll-up gives the same exact results as the SQL roll-up
+    for vocab, filter_count in ((None, 0), ("ICD10CM", 0), ("ICD10CM", 1)):
+        sql_stats, _ = cohort.get_concept_stats(vocab=vocab, filter_count=filter_count)
+        bitmap_stats, _ = cohort.get_concept_stats(vocab=vocab, filter_count=filter_count, strategy="bitmap")
+        assert sort_stats(bitmap_stats["condition_occurrence"]) == sort_stats(sql_stats["condition_occurrence"])
+        prevalences = [s["prevalence"] for s in bitmap_stats["condition_occurrence"]]
+        assert prevalences == sorted(prevalences, reverse=True)
+    assert len(bitmap_stats["condition_occurrence"]) > 0
+
+    with pytest.raises(ValueError):
+        cohort.get_concept_stats(strategy="dummy_invalid")
+    with pytest.raises(ValueError):
+        cohort.get_concept_stats(strategy="bitmap", approximate=True)
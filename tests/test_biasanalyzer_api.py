@@ -1,7 +1,9 @@
 import datetime
 import logging
 import os
+from functools import reduce
 
+import numpy as np
 import pytest
 from biasanalyzer import __version__
 from biasanalyzer.concept import ConceptHierarchy
@@ -112,6 +114,14 @@ def test_compare_cohort_with_no_action(caplog, fresh_bias_obj):
     caplog.clear()
     with caplog.at_level(logging.INFO):
         fresh_bias_obj.compare_cohorts(1, 2)
+        assert fresh_bias_obj.compare_cohort_matrix([1, 2]) is None
+    assert "failed to create a valid cohort action object" in caplog.text
+
+
+def test_compare_concept_prevalence_with_no_action(caplog, fresh_bias_obj):
+    caplog.clear()
+    with caplog.at_level(logging.INFO):
+        assert fresh_bias_obj.compare_concept_prevalence(1, 2) is None
     assert "failed to create a valid cohort action object" in caplog.text
 
 
@@ -201,6 +211,97 @@ def test_cohorts_union_concept_stats(test_db):
     }
 
 
+@pytest.mark.parametrize("filter_count", [0, 1])
+def test_cohorts_concept_stats_matches_union_of_cohorts(test_db, filter_count):
+    cohort_ids = [2, 1, 2]
+    ConceptHierarchy.clear_cache()
+    hierarchies = [
+        test_db.get_cohort(c).get_concept_stats(filter_count=filter_count)[1] for c in dict.fromkeys(cohort_ids)
+    ]
+    union_hierarchy = reduce(lambda h1, h2: h1.union(h2), hierarchies)
+    ConceptHierarchy.clear_cache()
+    # the hierarchy built from the grouped query of all cohorts is the same as the union of the cohort hierarchies
+    assert test_db.get_cohorts_concept_stats(cohort_ids, filter_count=filter_count) == union_hierarchy.to_dict()
+    assert ConceptHierarchy._graph_cache[union_hierarchy.identifier].to_dict() == union_hierarchy.to_dict()
+    ConceptHierarchy.clear_cache()
+
+
+def test_compare_concept_prevalence(test_db):
+    union_result = test_db.get_cohorts_concept_stats([1, 2])
+    comparison = test_db.compare_concept_prevalence(1, 2)
+    # counts and prevalences agree with the concept stats of each cohort computed separately
+    assert sorted(comparison["concept_id"]) == sorted(c["concept_id"] for c in union_result["hierarchy"])
+    for c in union_result["hierarchy"]:
+        row = comparison[comparison["concept_id"] == c["concept_id"]].iloc[0]
+        assert row["concept_name"] == c["concept_name"]
+        assert row["count_1"] == c["metrics"]["1"]["count"]
+        assert row["count_2"] == c["metrics"]["2"]["count"]
+        assert row["prevalence_1"] == pytest.approx(c["metrics"]["1"]["prevalence"])
+        assert row["prevalence_2"] == pytest.approx(c["metrics"]["2"]["prevalence"])
+    # Difficulty breathing has the largest prevalence difference of 0.8 vs. 0.25
+    assert comparison["concept_id"].tolist()[0] == 4041664
+    assert comparison["smd"].abs().is_monotonic_decreasing
+    assert comparison["smd"].iloc[0] == pytest.approx(0.55 / np.sqrt((0.8 * 0.2 + 0.25 * 0.75) / 2))
+    valid = comparison["p_value"].notna()
+    assert (comparison.loc[valid, "p_value_adjusted"] >= comparison.loc[valid, "p_value"]).all()
+    # COVID-19 is present in all subjects of cohort 2 but not in all subjects of cohort 1, so it can still be tested
+    assert comparison.loc[comparison["concept_id"] == 37311061, "p_value"].notna().all()
+
+    assert test_db.compare_concept_prevalence(1, 2, filter_count=3)["concept_id"].tolist() == [4041664, 37311061]
+    with pytest.raises(ValueError):
+        test_db.compare_concept_prevalence(1, 2, vocab="dummy_invalid_vocab")
+    with pytest.raises(ValueError):
+        test_db.compare_concept_prevalence(1, 2, concept_type="dummy_invalid")
+
+
+def test_concept_prevalence_incidence_tables(test_db):
+    bias_db = test_db.bias_db
+    union_result = test_db.get_cohorts_concept_stats([1, 2])
+    comparison = test_db.compare_concept_prevalence(1, 2)
+    ConceptHierarchy.clear_cache()
+    bias_db.use_incidence_tables = True
+    try:
+        # events outside of cohort periods are excluded from the incidence tables the same way as from event tables
+        assert test_db.get_cohorts_concept_stats([1, 2]) == union_result
+        assert test_db.compare_concept_prevalence(1, 2).equals(comparison)
+    finally:
+        bias_db.use_incidence_tables = False
+        ConceptHierarchy.clear_cache()
+    incidence_table = bias_db.get_incidence_table("condition_occurrence")
+    incidence_count = bias_db.conn.table(incidence_table).aggregate("COUNT(*)").fetchone()[0]
+    pair_count = bias_db.conn.execute(
+        "SELECT COUNT(DISTINCT (person_id, condition_concept_id)) FROM omop.condition_occurrence"
+    ).fetchone()[0]
+    assert incidence_count == pair_count
+    with pytest.raises(ValueError):
+        bias_db.get_incidence_table("dummy_invalid")
+
+
+def test_get_existing_cohort(caplog, test_db):
+    cohort = test_db.get_cohort(1)
+    assert cohort is not None
+    assert cohort.cohort_id == 1
+    assert cohort.metadata["id"] == 1
+    assert test_db.get_cohort_definitions()[0]["id"] == 1
+    caplog.clear()
+    with caplog.at_level(logging.INFO):
+        assert test_db.get_cohort(100000) is None
+    assert "does not exist" in caplog.text
+
+
+def test_get_cohort_definitions_no_omop_cdm(caplog, fresh_bias_obj):
+    caplog.clear()
+    with caplog.at_level(logging.INFO):
+        assert fresh_bias_obj.get_cohort_definitions() is None
+        fresh_bias_obj.checkpoint()
+        assert fresh_bias_obj.get_cohorts_stats([1, 2]) is None
+        assert fresh_bias_obj.get_cohorts_distributions([1, 2], "age") is None
+        assert fresh_bias_obj.delete_cohort(1) is None
+        assert fresh_bias_obj.get_cohorts_stratified_stats([1, 2], ["gender"]) is None
+        assert fresh_bias_obj.get_cohorts_temporal_distribution([1, 2]) is None
+    assert "valid OMOP CDM must be set" in caplog.text
+
+
 def test_get_domains_and_vocabularies_invalid(caplog, fresh_bias_obj):
     caplog.clear()
     with caplog.at_level(logging.INFO):
@@ -217,6 +318,52 @@ def test_get_domains_and_vocabularies(test_db):
     assert domains_and_vocabularies == expected
 
 
+def test_omop_catalog(caplog, test_db, fresh_bias_obj, monkeypatch):
+    caplog.clear()
+    with caplog.at_level(logging.INFO):
+        assert fresh_bias_obj.get_omop_catalog() is None
+    assert "valid OMOP CDM must be set" in caplog.text
+
+    bias_db = test_db.bias_db
+    catalog = test_db.get_omop_catalog()
+    catalog.clear()
+    concept_count = bias_db.conn.execute("SELECT COUNT(*) FROM omop.concept").fetchone()[0]
+    vocabulary_counts = catalog.get_vocabulary_concept_counts()
+    assert list(vocabulary_counts) == catalog.get_vocabularies() == ["ICD10CM", "SNOMED"]
+    assert sum(vocabulary_counts.values()) == concept_count
+    assert catalog.get_domains() == ["Condition"]
+    assert catalog.is_valid_vocabulary("SNOMED") and not catalog.is_valid_vocabulary("dummy_invalid_vocab")
+    row_counts = catalog.get_table_row_counts()
+    assert row_counts["concept"] == concept_count
+    assert row_counts["person"] == bias_db.conn.execute("SELECT COUNT(*) FROM omop.person").fetchone()[0]
+    assert "condition_occurrence" in row_counts
+
+    # domain listing and vocabulary validation are in-memory lookups until the OMOP data version changes
+    queries = []
+    execute_query = bias_db._execute_query
+    monkeypatch.setattr(
+        bias_db, "_execute_query", lambda query, **kwargs: queries.append(query) or execute_query(query, **kwargs)
+    )
+    for _ in range(3):
+        assert test_db.get_domains_and_vocabularies()[0] == {"domain_id": "Condition", "vocabulary_id": "ICD10CM"}
+        bias_db._validate_vocab("ICD10CM")
+        with pytest.raises(ValueError):
+            bias_db._validate_vocab("dummy_invalid_vocab")
+    assert queries == []
+    # the OMOP data version is looked up once per session until the catalog is refreshed
+    data_version = catalog.get_data_version()
+    monkeypatch.setattr(bias_db, "get_omop_data_version", lambda: "new-version")
+    assert catalog.get_vocabularies() == ["ICD10CM", "SNOMED"]
+    assert catalog.get_data_version() == data_version
+    assert queries == []
+    catalog.refresh()
+    assert catalog.get_vocabularies() == ["ICD10CM", "SNOMED"]
+    assert catalog.get_data_version() == "new-version"
+    assert len(queries) == 1
+    monkeypatch.undo()
+    catalog.clear()
+
+
 def test_get_concepts_no_omop_cdm(caplog, fresh_bias_obj):
     caplog.clear()
     with caplog.at_level(logging.INFO):
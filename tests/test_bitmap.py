@@ -0,0 +1,48 @@
+import networkx as nx
+import numpy as np
+from biasanalyzer.bitmap import PersonBitmap, rollup_concept_counts
+
+
+def test_person_bitmap_containers_and_union():
+    n_persons = 1000
+    sparse = PersonBitmap.from_indices(n_persons, [5, 3, 3, 999])
+    assert not sparse.is_dense
+    assert len(sparse) == 3
+    np.testing.assert_array_equal(sparse.to_indices(), [3, 5, 999])
+
+    dense_indices = np.arange(0, n_persons, 7)
+    dense = PersonBitmap.from_indices(n_persons, dense_indices)
+    assert dense.is_dense
+    assert len(dense) == len(dense_indices)
+    np.testing.assert_array_equal(dense.to_indices(), dense_indices)
+
+    for bitmaps in ([sparse], [sparse, sparse], [dense, sparse], [dense, dense, sparse]):
+        expected = np.unique(np.concatenate([b.to_indices() for b in bitmaps]))
+        union = PersonBitmap.union(n_persons, bitmaps)
+        assert len(union) == len(expected)
+        np.testing.assert_array_equal(union.to_indices(), expected)
+    # a union of sparse sets switches to a bitmap once it holds enough persons
+    assert PersonBitmap.union(n_persons, [PersonBitmap.from_indices(n_persons, [i]) for i in range(40)]).is_dense
+
+
+def test_rollup_concept_counts_matches_distinct_counts_over_descendants():
+    rng = np.random.default_rng(0)
+    n_concepts, n_persons = 60, 500
+    # random DAG with edges from lower to higher concept ids
+    parents, children = np.nonzero(np.triu(rng.random((n_concepts, n_concepts)) < 0.08, k=1))
+    closure = nx.transitive_closure_dag(nx.DiGraph(zip(parents.tolist(), children.tolist())))
+    reduction = nx.transitive_reduction(closure)
+    event_concept_ids = rng.integers(0, n_concepts, size=3000)
+    # skew the persons so that both sparse and dense bitmaps are merged
+    event_person_indices = (rng.random(3000) ** 3 * n_persons).astype(int)
+    parent_ids, child_ids = zip(*reduction.edges())
+
+    counts = rollup_concept_counts(event_concept_ids, event_person_indices, n_persons, parent_ids, child_ids)
+    for concept_id in closure.nodes:
+        concepts = {concept_id, *nx.descendants(closure, concept_id)}
+        expected = len(set(event_person_indices[np.isin(event_concept_ids, list(concepts))].tolist()))
+        assert counts[concept_id] == expected
+    # rolling up along all ancestor-descendant pairs gives the same counts
+    parent_ids, child_ids = zip(*closure.edges())
+    assert rollup_concept_counts(event_concept_ids, event_person_indices, n_persons, parent_ids, child_ids) == counts
+    assert rollup_concept_counts([], [], n_persons, [], []) == {}
@@ -1,9 +1,14 @@
+import importlib.util
+import logging
+from datetime import date
 from unittest.mock import Mock
 
 import duckdb
+import pandas as pd
 import pytest
 from biasanalyzer.cohort_query_builder import CohortQueryBuilder
 from biasanalyzer.database import BiasDatabase
+from biasanalyzer.models import CohortDefinition
 
 
 def test_load_postgres_extension_executes_twice(monkeypatch):
@@ -184,3 +189,82 @@ def test_get_cohort_attributes_handles_exception():
     assert result is None
     with pytest.raises(ValueError):
         db.get_cohort_concept_stats(123, qry_builder)
+
+
+def test_execute_query_output_formats():
+    BiasDatabase._instance = None
+    db = BiasDatabase(":memory:")
+    assert db._execute_query("SELECT 1 AS a, 'x' AS b") == [{"a": 1, "b": "x"}]
+    result_df = db._execute_query("SELECT 1 AS a, 'x' AS b", output_format="df")
+    assert list(result_df.columns) == ["a", "b"]
+    assert result_df.to_dict(orient="records") == [{"a": 1, "b": "x"}]
+    with pytest.raises(ValueError, match="Invalid output_format"):
+        db._execute_query("SELECT 1", output_format="invalid")
+    db.close()
+
+
+def test_execute_query_arrow_output_format():
+    pa = pytest.importorskip("pyarrow")
+    BiasDatabase._instance = None
+    db = BiasDatabase(":memory:")
+    result_table = db._execute_query("SELECT 1 AS a, 'x' AS b", output_format="arrow")
+    assert isinstance(result_table, pa.Table)
+    assert result_table.to_pylist() == [{"a": 1, "b": "x"}]
+    db.close()
+
+
+def test_arrow_output_format_without_pyarrow(monkeypatch):
+    BiasDatabase._instance = None
+    db = BiasDatabase(":memory:")
+    find_spec = importlib.util.find_spec
+    monkeypatch.setattr(
+        importlib.util, "find_spec", lambda name, *args: None if name == "pyarrow" else find_spec(name, *args)
+    )
+    with pytest.raises(ImportError, match="requires pyarrow"):
+        db._execute_query("SELECT 1", output_format="arrow")
+    with pytest.raises(ImportError, match="requires pyarrow"):
+        db.get_cohort_basic_stats(123, output_format="arrow")
+    db.close()
+
+
+def test_file_backed_bias_db_reopen_and_compact(tmp_path):
+    BiasDatabase._instance = None
+    db_path = str(tmp_path / "bias.duckdb")
+    db = BiasDatabase(db_path)
+    assert db.is_persistent
+    cohort_def = CohortDefinition(
+        name="persisted", description="persisted", created_date=date.today(), creation_info="q", created_by="test"
+    )
+    for _ in range(2):
+        cohort_def_id = db.create_cohort_definition(cohort_def, progress_obj=Mock())
+        db.create_cohort_in_bulk(
+            pd.DataFrame(
+                {
+                    "subject_id": [str(i) for i in range(1000)],
+                    "cohort_definition_id": cohort_def_id,
+                    "cohort_start_date": date(2020, 1, 1),
+                    "cohort_end_date": date(2020, 2, 1),
+                }
+            )
+        )
+    db.conn.execute("DELETE FROM biasanalyzer.cohort WHERE cohort_definition_id = 1")
+    db.checkpoint(compact=True)
+    assert len(db.get_cohort(2)) == 1000
+    db.close()
+
+    # reopening keeps existing cohorts and continues the id sequence
+    db = BiasDatabase(db_path)
+    assert [d["id"] for d in db.get_cohort_definitions()] == [1, 2]
+    assert len(db.get_cohort(2)) == 1000
+    assert db.create_cohort_definition(cohort_def, progress_obj=Mock()) == 3
+    db.close()
+
+
+def test_in_memory_bias_db_checkpoint(caplog):
+    BiasDatabase._instance = None
+    db = BiasDatabase(":memory:")
+    assert not db.is_persistent
+    with caplog.at_level(logging.INFO):
+        db.checkpoint(compact=True)
+    assert "nothing to checkpoint" in caplog.text
+    db.close()
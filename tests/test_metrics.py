@@ -0,0 +1,109 @@
+import numpy as np
+import pytest
+import scipy.stats
+from biasanalyzer.metrics import (
+    DISTANCE_METRICS,
+    benjamini_hochberg,
+    bootstrap_distance_ci,
+    chi_square_test,
+    distance,
+    normalize_counts,
+    pairwise_distances,
+    standardized_mean_difference,
+)
+from biasanalyzer.utils import hellinger_distance
+from scipy.spatial.distance import jensenshannon
+from scipy.stats import wasserstein_distance as scipy_wasserstein_distance
+
+
+def test_distance_metrics_match_reference_implementations():
+    counts_p = np.array([5, 0, 12, 30, 3])
+    counts_q = np.array([1, 7, 9, 2, 0])
+    p, q = normalize_counts(counts_p), normalize_counts(counts_q)
+    bins = np.arange(len(p))
+
+    assert distance(counts_p, counts_q, "hellinger") == pytest.approx(hellinger_distance(counts_p, counts_q))
+    assert distance(counts_p, counts_q, "jensen_shannon") == pytest.approx(jensenshannon(p, q, base=2))
+    assert distance(counts_p, counts_q, "total_variation") == pytest.approx(0.5 * np.abs(p - q).sum())
+    assert distance(counts_p, counts_q, "wasserstein") == pytest.approx(
+        scipy_wasserstein_distance(bins, bins, u_weights=p, v_weights=q)
+    )
+    for metric in DISTANCE_METRICS:
+        assert distance(counts_p, counts_p * 3, metric) == pytest.approx(0.0, abs=1e-12)
+    assert distance([1, 0], [0, 1], "jensen_shannon") == pytest.approx(1.0)
+    assert distance([1, 0, 0], [0, 0, 1], "wasserstein") == pytest.approx(2.0)
+    assert np.isnan(distance([0, 0], [1, 1], "hellinger"))
+    with pytest.raises(ValueError):
+        distance(counts_p, counts_q, "invalid")
+
+
+def test_pairwise_distances():
+    counts = np.array([[5, 0, 12], [1, 7, 9], [2, 2, 2], [10, 14, 18]])
+    for metric in DISTANCE_METRICS:
+        matrix = pairwise_distances(counts, metric)
+        assert matrix.shape == (4, 4)
+        np.testing.assert_allclose(matrix, matrix.T)
+        np.testing.assert_allclose(matrix.diagonal(), 0.0, atol=1e-12)
+        for i in range(len(counts)):
+            for j in range(len(counts)):
+                assert matrix[i, j] == pytest.approx(distance(counts[i], counts[j], metric))
+
+
+def test_bootstrap_distance_ci():
+    rng = np.random.default_rng(42)
+    counts_p = rng.integers(0, 200, size=(50, 10))
+    counts_q = rng.integers(0, 200, size=(50, 10))
+
+    results = bootstrap_distance_ci(counts_p, counts_q, n_resamples=1000, seed=0)
+    assert all(results[key].shape == (50,) for key in ("distance", "ci_lower", "ci_upper"))
+    np.testing.assert_allclose(results["distance"], distance(counts_p, counts_q))
+    assert np.all(results["ci_lower"] <= results["ci_upper"])
+
+    single = bootstrap_distance_ci(counts_p[0], counts_q[0], metric="total_variation", seed=0)
+    assert set(single) == {"distance", "ci_lower", "ci_upper"}
+    assert single["ci_lower"] <= single["distance"] <= single["ci_upper"]
+    # the same seed gives the same intervals, and a higher confidence level gives a wider interval
+    assert bootstrap_distance_ci(counts_p[0], counts_q[0], metric="total_variation", seed=0) == single
+    wider = bootstrap_distance_ci(counts_p[0], counts_q[0], metric="total_variation", confidence_level=0.99, seed=0)
+    assert wider["ci_upper"] - wider["ci_lower"] >= single["ci_upper"] - single["ci_lower"]
+
+    with pytest.raises(ValueError):
+        bootstrap_distance_ci(counts_p[0], counts_q[0], confidence_level=1.5)
+    with pytest.raises(ValueError):
+        bootstrap_distance_ci(counts_p[0], counts_q[0, :5])
+
+
+def test_standardized_mean_difference():
+    smd = standardized_mean_difference([0.5, 0.2, 0.3, 0.0, 1.0], [0.3, 0.2, 0.5, 1.0, 1.0])
+    assert smd[0] == pytest.approx(0.2 / np.sqrt((0.25 + 0.21) / 2))
+    assert smd[1] == 0.0
+    assert smd[2] == pytest.approx(-smd[0])
+    assert smd[3] == -np.inf
+    assert smd[4] == 0.0
+
+
+def test_chi_square_test_matches_scipy():
+    count_1 = np.array([10, 0, 45, 3, 50])
+    count_2 = np.array([25, 12, 40, 3, 80])
+    size_1, size_2 = 50, 80
+    for correction in (True, False):
+        statistics, p_values = chi_square_test(count_1, size_1, count_2, size_2, correction=correction)
+        for i in range(len(count_1) - 1):
+            table = [[count_1[i], size_1 - count_1[i]], [count_2[i], size_2 - count_2[i]]]
+            expected = scipy.stats.chi2_contingency(table, correction=correction)
+            assert statistics[i] == pytest.approx(expected[0])
+            assert p_values[i] == pytest.approx(expected[1])
+        # a concept all subjects have gives a zero expected count and no test result
+        assert np.isnan(statistics[-1]) and np.isnan(p_values[-1])
+
+
+def test_benjamini_hochberg():
+    p_values = np.array([0.01, 0.04, 0.03, 0.5, 0.002, np.nan, 0.04])
+    adjusted = benjamini_hochberg(p_values)
+    valid = ~np.isnan(p_values)
+    assert np.isnan(adjusted[5])
+    np.testing.assert_allclose(adjusted[valid], [0.03, 0.048, 0.048, 0.5, 0.012, 0.048])
+    if hasattr(scipy.stats, "false_discovery_control"):
+        np.testing.assert_allclose(adjusted[valid], scipy.stats.false_discovery_control(p_values[valid]))
+    assert np.all(adjusted[valid] >= p_values[valid])
+    assert benjamini_hochberg([]).size == 0